@@ -65,8 +65,15 @@ DOCUMENTATION = """
         env:
           - name: CONJUR_CONFIG_FILE
       conjur_appliance_url:
-        description: Conjur appliance url
-        type: string
+        description: >
+          Conjur appliance url, or a list of the urls of a Conjur leader and its followers. Prefix the url of a
+          read-only follower with C(ro:), or give it as a mapping with C(url) and C(read_only) keys. With several
+          urls, the round-trip time to each one is measured once per process, requests are sent to the fastest
+          healthy follower, or to the fastest healthy read-write url when no follower is healthy, and fail over to
+          the next url after a connection error or a 5xx response. The first url identifies the Conjur instance
+          in the identity file and in the caches.
+        type: list
+        elements: raw
         required: false
         ini:
           - section: conjur,
@@ -75,6 +82,25 @@ DOCUMENTATION = """
           - name: conjur_appliance_url
         env:
           - name: CONJUR_APPLIANCE_URL
+      conjur_follower_urls:
+        description: >
+          Urls of a pool of Conjur followers serving the same data as C(conjur_appliance_url). Each secret
+          read is sent to a follower chosen by consistent hashing of the variable path, so that every
+          follower serves a stable subset of the variables and adding or removing one only moves about
+          1/n of them. A read failing with a connection error or a 5xx response is sent to the next follower
+          for that path, then to C(conjur_appliance_url). The pool only applies to single-variable reads:
+          authentication and batch retrieval, used by default for lookups of several variables, still use
+          C(conjur_appliance_url). Set C(conjur_batch_retrieval) to C(false) to spread those lookups too.
+        type: list
+        elements: string
+        required: false
+        ini:
+          - section: conjur
+            key: follower_urls
+        vars:
+          - name: conjur_follower_urls
+        env:
+          - name: CONJUR_FOLLOWER_URLS
       conjur_authn_login:
         description: Conjur authn login
         type: string
@@ -142,7 +168,11 @@ DOCUMENTATION = """
         env:
           - name: CONJUR_AUTHN_TOKEN_FILE
       conjur_authn_type:
-        description: Type of Conjur authenticator
+        description: >
+          Type of Conjur authenticator: C(aws), C(azure), C(gcp), or C(auto) to use the authenticator of the
+          cloud the controller runs in. With C(auto), the AWS, Azure and GCP metadata services are probed
+          concurrently with a short timeout, and the API key authenticator is used when none answers. The
+          result is cached per host in a file under /dev/shm (or the system temp directory) for a day.
         type: string
         required: False
         ini:
@@ -174,6 +204,468 @@ DOCUMENTATION = """
           - name: azure_client_id
         env:
           - name: AZURE_CLIENT_ID
+      conjur_aws_sts_region:
+        description: >
+          AWS region whose regional STS endpoint the AWS IAM authenticator signs its GetCallerIdentity
+          request for, instead of the global sts.amazonaws.com endpoint. Set to C(auto) to use the region
+          of the AWS_REGION or AWS_DEFAULT_REGION environment variables, or else of the instance, read once
+          from the instance metadata service. Only set this when the Conjur authn-iam service accepts
+          requests signed for regional STS endpoints.
+        type: string
+        required: False
+        ini:
+          - section: conjur
+            key: aws_sts_region
+        vars:
+          - name: conjur_aws_sts_region
+        env:
+          - name: CONJUR_AWS_STS_REGION
+      conjur_batch_retrieval:
+        description: >
+          Retrieve the values of a lookup given more than one variable path through the Conjur batch secrets
+          endpoint. When disabled, or when a batch request is rejected because one of its variables is missing,
+          not permitted or holds a binary value, each variable is retrieved with its own request instead.
+        type: boolean
+        default: true
+        required: False
+        ini:
+          - section: conjur
+            key: batch_retrieval
+        vars:
+          - name: conjur_batch_retrieval
+        env:
+          - name: CONJUR_BATCH_RETRIEVAL
+      conjur_batch_max_url_length:
+        description: >
+          Maximum length of a batch secrets request URL. When more than one variable path is looked up,
+          the values are retrieved through the Conjur batch secrets endpoint, split into as many parallel
+          requests as needed to keep each URL within this limit.
+        type: integer
+        default: 4096
+        required: False
+        ini:
+          - section: conjur
+            key: batch_max_url_length
+        vars:
+          - name: conjur_batch_max_url_length
+        env:
+          - name: CONJUR_BATCH_MAX_URL_LENGTH
+      conjur_max_workers:
+        description: >
+          Maximum number of secret requests a lookup sends concurrently, when retrieving several batches
+          or several variables individually. All of them share the same access token.
+        type: integer
+        default: 4
+        required: False
+        ini:
+          - section: conjur
+            key: max_workers
+        vars:
+          - name: conjur_max_workers
+        env:
+          - name: CONJUR_MAX_WORKERS
+      conjur_token_cache_margin:
+        description: >
+          Access tokens are cached in memory per appliance URL, account, identity and authenticator, and
+          reused by later lookups in the same process until this many seconds before the token expires.
+          Set to a value larger than the token lifetime to authenticate on every lookup.
+        type: integer
+        default: 30
+        required: False
+        ini:
+          - section: conjur
+            key: token_cache_margin
+        vars:
+          - name: conjur_token_cache_margin
+        env:
+          - name: CONJUR_TOKEN_CACHE_MARGIN
+      conjur_token_refresh_fraction:
+        description: >
+          Fraction of the lifetime of a cached access token, between 0 and 1, after which a new token is
+          requested in a background thread, so that lookups keep using the current token instead of
+          waiting for authentication when it expires. A token is only refreshed if it was reused since it
+          was obtained. Refreshes are most useful in long-running processes such as the O(conjur_broker).
+          Set to 0 to disable background refreshes.
+        type: float
+        default: 0
+        required: False
+        ini:
+          - section: conjur
+            key: token_refresh_fraction
+        vars:
+          - name: conjur_token_refresh_fraction
+        env:
+          - name: CONJUR_TOKEN_REFRESH_FRACTION
+      conjur_shared_token_cache:
+        description: >
+          Share cached access tokens between the worker processes of an Ansible run, so that the first
+          worker authenticates and the others reuse its token. Tokens are stored encrypted, with a key
+          generated for each run of the Ansible controller, in a file readable only by the current
+          user under /dev/shm (or the system temp directory). Workers needing a new token wait for
+          the one refreshing it instead of authenticating at the same time. Requires the
+          C(cryptography) Python package.
+        type: boolean
+        default: false
+        required: False
+        ini:
+          - section: conjur
+            key: shared_token_cache
+        vars:
+          - name: conjur_shared_token_cache
+        env:
+          - name: CONJUR_SHARED_TOKEN_CACHE
+      conjur_connection_pooling:
+        description: >
+          Send requests to Conjur and to the cloud metadata services through a pool of keep-alive
+          connections shared by all lookups of an Ansible worker, so that authentication and secret
+          retrieval reuse established TCP connections and TLS sessions. Requests to hosts reached
+          through an HTTP(S) proxy configured in the environment are not pooled.
+        type: boolean
+        default: false
+        required: False
+        ini:
+          - section: conjur
+            key: connection_pooling
+        vars:
+          - name: conjur_connection_pooling
+        env:
+          - name: CONJUR_CONNECTION_POOLING
+      conjur_retries:
+        description: >
+          Number of times a secret request is retried after a connection error, a timeout, or a 429 or 5xx
+          response. Other errors, such as 401, 403 or 404 responses, are reported immediately.
+        type: integer
+        default: 4
+        required: False
+        ini:
+          - section: conjur
+            key: retries
+        vars:
+          - name: conjur_retries
+        env:
+          - name: CONJUR_RETRIES
+      conjur_retry_base_delay:
+        description: >
+          Base delay in seconds of the exponential backoff between retries. The delay before retry N is
+          a random duration of up to conjur_retry_base_delay * 2^(N-1) seconds, capped at 30 seconds, unless
+          the response carries a Retry-After header, which is honoured instead.
+        type: float
+        default: 1.0
+        required: False
+        ini:
+          - section: conjur
+            key: retry_base_delay
+        vars:
+          - name: conjur_retry_base_delay
+        env:
+          - name: CONJUR_RETRY_BASE_DELAY
+      conjur_retry_budget:
+        description: >
+          Maximum time in seconds spent retrying a secret request. No retry is attempted once it would
+          start later than this after the first attempt.
+        type: float
+        default: 60.0
+        required: False
+        ini:
+          - section: conjur
+            key: retry_budget
+        vars:
+          - name: conjur_retry_budget
+        env:
+          - name: CONJUR_RETRY_BUDGET
+      conjur_health_check:
+        description: >
+          Check the health endpoint of every configured Conjur url before authenticating and retrieving
+          secrets. When none is healthy, the lookup fails immediately with the error of each url; unhealthy
+          urls are otherwise avoided. Results are cached for C(conjur_health_check_ttl) seconds and shared by
+          all Ansible workers of the user.
+        type: boolean
+        default: false
+        required: False
+        ini:
+          - section: conjur
+            key: health_check
+        vars:
+          - name: conjur_health_check
+        env:
+          - name: CONJUR_HEALTH_CHECK
+      conjur_health_check_ttl:
+        description: >
+          Number of seconds the result of a Conjur health check is reused.
+        type: float
+        default: 10.0
+        required: False
+        ini:
+          - section: conjur
+            key: health_check_ttl
+        vars:
+          - name: conjur_health_check_ttl
+        env:
+          - name: CONJUR_HEALTH_CHECK_TTL
+      conjur_circuit_breaker_threshold:
+        description: >
+          Number of consecutive connection errors, timeouts or 5xx responses of a Conjur endpoint after which
+          its circuit opens. Requests then skip the endpoint, going to another configured url or failing
+          immediately, until C(conjur_circuit_breaker_reset_timeout) seconds have passed and a single trial
+          request is let through. The state of the circuits is shared by all Ansible workers of the user.
+          A request retried after failures counts as a single failure. Set to 0, the default, to disable
+          the circuit breaker.
+        type: integer
+        default: 0
+        required: False
+        ini:
+          - section: conjur
+            key: circuit_breaker_threshold
+        vars:
+          - name: conjur_circuit_breaker_threshold
+        env:
+          - name: CONJUR_CIRCUIT_BREAKER_THRESHOLD
+      conjur_circuit_breaker_reset_timeout:
+        description: >
+          Time in seconds an open circuit waits before letting a trial request through to its endpoint.
+        type: float
+        default: 30.0
+        required: False
+        ini:
+          - section: conjur
+            key: circuit_breaker_reset_timeout
+        vars:
+          - name: conjur_circuit_breaker_reset_timeout
+        env:
+          - name: CONJUR_CIRCUIT_BREAKER_RESET_TIMEOUT
+      conjur_rate_limit:
+        description: >
+          Maximum number of requests per second sent to each host, shared by all Ansible workers of the user
+          through a token bucket in the plugin state directory. Requests wait for a token before being sent.
+          Set to 0 to disable rate limiting.
+        type: float
+        default: 0
+        required: False
+        ini:
+          - section: conjur
+            key: rate_limit
+        vars:
+          - name: conjur_rate_limit
+        env:
+          - name: CONJUR_RATE_LIMIT
+      conjur_rate_limit_burst:
+        description: >
+          Number of requests which may be sent at once to a host before C(conjur_rate_limit) applies.
+        type: integer
+        default: 10
+        required: False
+        ini:
+          - section: conjur
+            key: rate_limit_burst
+        vars:
+          - name: conjur_rate_limit_burst
+        env:
+          - name: CONJUR_RATE_LIMIT_BURST
+      conjur_max_concurrency:
+        description: >
+          Maximum number of concurrent requests sent to each host by all Ansible workers of the user. The
+          actual limit adapts between 1 and this value: it is halved when a 429 or 503 response is received
+          and grows again by about one request per round of successful requests. Set to 0 to disable the
+          concurrency limit.
+        type: integer
+        default: 0
+        required: False
+        ini:
+          - section: conjur
+            key: max_concurrency
+        vars:
+          - name: conjur_max_concurrency
+        env:
+          - name: CONJUR_MAX_CONCURRENCY
+      conjur_metadata_connect_timeout:
+        description: >
+          Timeout in seconds for establishing a connection to a cloud metadata service (AWS, Azure or GCP).
+          Only applied as such with C(conjur_connection_pooling); without it, requests use the larger of
+          the connect and read timeouts of their phase for both.
+        type: float
+        default: 2.0
+        required: False
+        ini:
+          - section: conjur
+            key: metadata_connect_timeout
+        vars:
+          - name: conjur_metadata_connect_timeout
+        env:
+          - name: CONJUR_METADATA_CONNECT_TIMEOUT
+      conjur_metadata_read_timeout:
+        description: >
+          Timeout in seconds for waiting on data from a cloud metadata service once connected.
+        type: float
+        default: 10.0
+        required: False
+        ini:
+          - section: conjur
+            key: metadata_read_timeout
+        vars:
+          - name: conjur_metadata_read_timeout
+        env:
+          - name: CONJUR_METADATA_READ_TIMEOUT
+      conjur_authn_connect_timeout:
+        description: >
+          Timeout in seconds for establishing a connection to Conjur to authenticate.
+          Only applied as such with C(conjur_connection_pooling); without it, requests use the larger of
+          the connect and read timeouts of their phase for both.
+        type: float
+        default: 5.0
+        required: False
+        ini:
+          - section: conjur
+            key: authn_connect_timeout
+        vars:
+          - name: conjur_authn_connect_timeout
+        env:
+          - name: CONJUR_AUTHN_CONNECT_TIMEOUT
+      conjur_authn_read_timeout:
+        description: >
+          Timeout in seconds for waiting on data from Conjur during authentication once connected.
+        type: float
+        default: 10.0
+        required: False
+        ini:
+          - section: conjur
+            key: authn_read_timeout
+        vars:
+          - name: conjur_authn_read_timeout
+        env:
+          - name: CONJUR_AUTHN_READ_TIMEOUT
+      conjur_fetch_connect_timeout:
+        description: >
+          Timeout in seconds for establishing a connection to Conjur to retrieve secrets.
+          Only applied as such with C(conjur_connection_pooling); without it, requests use the larger of
+          the connect and read timeouts of their phase for both.
+        type: float
+        default: 5.0
+        required: False
+        ini:
+          - section: conjur
+            key: fetch_connect_timeout
+        vars:
+          - name: conjur_fetch_connect_timeout
+        env:
+          - name: CONJUR_FETCH_CONNECT_TIMEOUT
+      conjur_fetch_read_timeout:
+        description: >
+          Timeout in seconds for waiting on data from Conjur during secret retrieval once connected.
+        type: float
+        default: 10.0
+        required: False
+        ini:
+          - section: conjur
+            key: fetch_read_timeout
+        vars:
+          - name: conjur_fetch_read_timeout
+        env:
+          - name: CONJUR_FETCH_READ_TIMEOUT
+      conjur_lookup_deadline:
+        description: >
+          Maximum time in seconds a lookup may take, including authentication, secret retrieval and all
+          their retries. Request timeouts are shortened to the time left, no request or retry is started
+          once the deadline has passed, and the lookup then fails. Set to 0 to disable the deadline.
+        type: float
+        default: 0
+        required: False
+        ini:
+          - section: conjur
+            key: lookup_deadline
+        vars:
+          - name: conjur_lookup_deadline
+        env:
+          - name: CONJUR_LOOKUP_DEADLINE
+      conjur_secret_cache:
+        description: >
+          Keep retrieved secret values in memory and serve later lookups of the same variable with the same
+          identity from this cache, without authenticating or contacting Conjur, until the entry expires.
+          The cache is private to each Ansible worker process. Changes made to a variable in Conjur may not
+          be seen until its cache entry expires.
+        type: boolean
+        default: false
+        required: False
+        ini:
+          - section: conjur
+            key: secret_cache
+        vars:
+          - name: conjur_secret_cache
+        env:
+          - name: CONJUR_SECRET_CACHE
+      conjur_secret_cache_ttl:
+        description: Number of seconds a secret value is kept in the secret cache.
+        type: integer
+        default: 60
+        required: False
+        ini:
+          - section: conjur
+            key: secret_cache_ttl
+        vars:
+          - name: conjur_secret_cache_ttl
+        env:
+          - name: CONJUR_SECRET_CACHE_TTL
+      conjur_negative_cache_ttl:
+        description: >
+          Number of seconds a lookup of a variable which does not exist (404) or which the identity is not
+          allowed to read (403) keeps failing with the same error without contacting Conjur, per identity
+          and variable path. These results are shared by all Ansible workers of the user through a file in
+          the plugin state directory, which holds no secret values. Set to 0 to disable this cache.
+        type: float
+        default: 0
+        required: False
+        ini:
+          - section: conjur
+            key: negative_cache_ttl
+        vars:
+          - name: conjur_negative_cache_ttl
+        env:
+          - name: CONJUR_NEGATIVE_CACHE_TTL
+      conjur_secret_cache_max_entries:
+        description: >
+          Maximum number of values kept in the secret cache. The least recently used values are evicted,
+          and overwritten in memory, when it is exceeded.
+        type: integer
+        default: 1000
+        required: False
+        ini:
+          - section: conjur
+            key: secret_cache_max_entries
+        vars:
+          - name: conjur_secret_cache_max_entries
+        env:
+          - name: CONJUR_SECRET_CACHE_MAX_ENTRIES
+      conjur_broker:
+        description: >
+          Retrieve secrets through a broker process shared by all the workers of an Ansible run. The
+          broker is started by the first lookup which needs it, listens on a Unix socket accessible only
+          by the current user, and keeps the access tokens, pooled connections and, when
+          O(conjur_secret_cache) is enabled, the secret cache of every worker. Identical requests
+          received at the same time are sent to Conjur once. Lookups retrieve secrets directly when the
+          broker cannot be reached.
+        type: boolean
+        default: false
+        required: False
+        ini:
+          - section: conjur
+            key: broker
+        vars:
+          - name: conjur_broker
+        env:
+          - name: CONJUR_BROKER
+      conjur_broker_idle_timeout:
+        description: >
+          Number of seconds without requests after which the broker process exits. The broker also exits
+          when the Ansible run which started it ends.
+        type: integer
+        default: 300
+        required: False
+        ini:
+          - section: conjur
+            key: broker_idle_timeout
+        vars:
+          - name: conjur_broker_idle_timeout
+        env:
+          - name: CONJUR_BROKER_IDLE_TIMEOUT
 """
 
 EXAMPLES = """
@@ -185,48 +677,84 @@ EXAMPLES = """
     - name: Lookup variable in Conjur
       debug:
         msg: "{{ lookup('cyberark.conjur.conjur_variable', '/path/to/secret') }}"
+
+    - name: Retrieve several variables in a single batch request
+      debug:
+        msg: "{{ query('cyberark.conjur.conjur_variable', 'path/to/user', 'path/to/password') }}"
 """
 
 RETURN = """
   _raw:
     description:
-      - Value stored in Conjur.
+      - Value stored in Conjur, one element per requested variable path.
 """
 
+import atexit
+import fcntl
 import os
 import socket
 import traceback
 import ssl
 import re
 import shutil
-from base64 import b64encode
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+from base64 import b64encode, urlsafe_b64decode, urlsafe_b64encode
 from netrc import netrc
-from time import sleep
-from stat import S_IRUSR, S_IWUSR
+from time import monotonic, sleep, time
+from stat import S_IRUSR, S_IWUSR, S_IRWXU, S_IRWXG, S_IRWXO, S_ISDIR
 from tempfile import gettempdir, NamedTemporaryFile
 import datetime
 import hashlib
 import hmac
+import http.client
+import io
 import json
+import mmap
+import random
 import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
 import yaml
 import ansible.module_utils.six.moves.urllib.error as urllib_error
 from ansible.errors import AnsibleError
 from ansible.plugins.lookup import LookupBase
 from ansible.module_utils.six.moves.urllib.parse import quote
+from ansible.module_utils.parsing.convert_bool import boolean
 from ansible.module_utils.urls import open_url
 from ansible.utils.display import Display
 try:
     from cryptography.x509 import load_pem_x509_certificate
     from cryptography.hazmat.backends import default_backend
+    from cryptography.fernet import Fernet, InvalidToken
 except ImportError:
     cryptography_import_error = traceback.format_exc()
 else:
     cryptography_import_error = None
 
 display = Display()
-temp_cert_file = None
 telemetry_header = None
+_token_cache = {}
+_options_lock = threading.Lock()
+_telemetry_header_lock = threading.Lock()
+_token_cache_lock = threading.Lock()
+_ca_bundle_cache = {}
+_ca_bundle_lock = threading.Lock()
+_run_key = {}
+_metadata_cache = {}
+_metadata_cache_lock = threading.Lock()
+_endpoint_latencies = {}
+_unhealthy_endpoints = {}
+_endpoint_lock = threading.Lock()
+# Endpoints which failed during the retried request in progress in each thread, reported to
+# the circuit breaker once the request completes rather than after every attempt
+_request_failures = threading.local()
 
 
 # ************* REQUEST VALUES *************
@@ -238,10 +766,53 @@ SERVICE = 'sts'
 HOST = 'sts.amazonaws.com'
 ENDPOINT = 'https://sts.amazonaws.com'
 REQUEST_PARAMETERS = 'Action=GetCallerIdentity&Version=2011-06-15'
+AWS_METADATA_TOKEN_TTL = 900
+METADATA_CACHE_MARGIN = 60
+AWS_SIGNATURE_VALIDITY = 15 * 60
+AWS_SIGNATURE_REUSE = AWS_SIGNATURE_VALIDITY - 5 * 60
 
 AZURE_METADATA_URL = "http://169.254.169.254/metadata/identity/oauth2/token"
 GCP_METADATA_URL = "http://metadata/computeMetadata/v1/instance/service-accounts/default/identity"
 
+AZURE_INSTANCE_URL = "http://169.254.169.254/metadata/instance?api-version=2021-02-01"
+GCP_PROBE_URL = "http://169.254.169.254/computeMetadata/v1/"
+CLOUD_PROBE_TIMEOUT = 1.0
+CLOUD_DETECTION_TTL = 24 * 60 * 60
+
+DEFAULT_MAX_WORKERS = 4
+
+# CA bundles unused for this many seconds are removed when a new one is written
+CA_BUNDLE_STALE_AGE = 24 * 60 * 60
+
+POOL_MAX_IDLE_CONNECTIONS = 8
+
+DEFAULT_RETRIES = 4
+DEFAULT_RETRY_BASE_DELAY = 1.0
+DEFAULT_RETRY_BUDGET = 60.0
+RETRY_MAX_DELAY = 30.0
+# Time in seconds during which an endpoint which failed is only tried after all the others
+ENDPOINT_UNHEALTHY_TTL = 30.0
+DEFAULT_CIRCUIT_BREAKER_THRESHOLD = 0
+DEFAULT_CIRCUIT_BREAKER_RESET_TIMEOUT = 30.0
+DEFAULT_RATE_LIMIT_BURST = 10
+CONJUR_HEALTH_PATH = '/health'
+# Delay in seconds between two attempts to take a free concurrency slot
+CONCURRENCY_POLL_INTERVAL = 0.02
+# Delay in seconds between two attempts to take a file lock held by another worker before a deadline
+FILE_LOCK_POLL_INTERVAL = 0.02
+# (connect, read) timeouts in seconds of the requests of each phase of a lookup
+DEFAULT_TIMEOUTS = {
+    'metadata': (2.0, 10.0),
+    'authenticate': (5.0, 10.0),
+    'fetch': (5.0, 10.0),
+}
+BROKER_START_TIMEOUT = 5.0
+# Upper bound in seconds of the wait for the answer of the broker to a lookup
+BROKER_REQUEST_TIMEOUT = 300.0
+
+# Lifetime of Conjur access tokens which do not carry an `exp` claim
+CONJUR_TOKEN_LIFETIME = 8 * 60
+
 
 class ConjurIAMAuthnException(Exception):
     """
@@ -278,6 +849,36 @@ class InvalidAwsAccountIdException(Exception):
         )
 
 
+class ConjurBatchRetrievalException(AnsibleError):
+    """
+    Raised when the batch secrets endpoint rejects a request as a whole because of
+    some of the variables it contains.
+    """
+    def __init__(self, message, code):
+        AnsibleError.__init__(self, message)
+        self.code = code
+
+
+class ConjurVariableException(AnsibleError):
+    """
+    Raised when Conjur refuses to return a variable, with the status code of its response.
+    """
+    def __init__(self, message, conjur_variable, code):
+        AnsibleError.__init__(self, message)
+        self.conjur_variable = conjur_variable
+        self.code = code
+
+
+class ConjurRetrievalException(AnsibleError):
+    """
+    Raised when several variables could not be retrieved, with the error of each one
+    keyed by variable path in `failures`.
+    """
+    def __init__(self, message, failures):
+        AnsibleError.__init__(self, message)
+        self.failures = failures
+
+
 def _valid_aws_account_number(host_id):
     """
     Checks if the given host_id contains a valid 12-digit AWS Account ID.
@@ -296,15 +897,62 @@ def _sign(key, msg):
     return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
 
 
+def _get_cached_metadata_value(cache_key):
+    """
+    Returns the value cached for `cache_key` by `_cache_metadata_value`, or None when there is
+    none or it has expired.
+    """
+    with _metadata_cache_lock:
+        entry = _metadata_cache.get(cache_key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if time() < expires_at:
+            return value
+        del _metadata_cache[cache_key]
+    return None
+
+
+def _get_metadata_value_expiration(cache_key):
+    """
+    Returns the time at which the value cached for `cache_key` expires, or None when
+    there is no such value.
+    """
+    with _metadata_cache_lock:
+        entry = _metadata_cache.get(cache_key)
+        return None if entry is None else entry[1]
+
+
+def _cache_metadata_value(cache_key, value, expires_at):
+    """
+    Caches a value obtained from a cloud instance metadata service, or derived from it,
+    until `expires_at`. Expired entries are dropped at the same time.
+    """
+    now = time()
+    with _metadata_cache_lock:
+        for expired_key in [key for key, entry in _metadata_cache.items() if entry[1] <= now]:
+            del _metadata_cache[expired_key]
+        _metadata_cache[cache_key] = (value, expires_at)
+
+
 def _get_signature_key(key, date_stamp, region_name, service_name):
     """
     Generates the AWS V4 signing key using the provided key,
     date, region, and service name.
+
+    The key only depends on its inputs, so it is cached for a day per secret key,
+    date, region and service; the secret key is only kept as a digest.
     """
+    cache_key = ('signing_key', hashlib.sha256(key.encode('utf-8')).hexdigest(), date_stamp, region_name, service_name)
+    k_signing = _get_cached_metadata_value(cache_key)
+    if k_signing is not None:
+        return k_signing
+
     k_date = _sign(('AWS4' + key).encode('utf-8'), date_stamp)
     k_region = _sign(k_date, region_name)
     k_service = _sign(k_region, service_name)
     k_signing = _sign(k_service, 'aws4_request')
+    _cache_metadata_value(cache_key, k_signing, time() + 24 * 60 * 60)
     return k_signing
 
 
@@ -315,32 +963,100 @@ def _get_aws_region():
     return "us-east-1"
 
 
-def _get_iam_role_name():
+def _detect_aws_region(request_options=None):
+    """
+    Returns the AWS region the controller runs in, from the AWS_REGION or AWS_DEFAULT_REGION
+    environment variables, or else from the availability zone reported by the instance
+    metadata service. The region detected from instance metadata is cached.
+    """
+    region = os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION')
+    if region:
+        return region
+
+    region = _get_cached_metadata_value(('region',))
+    if region is not None:
+        return region
+
+    token = _get_metadata_token(request_options)
+    headers = {'X-aws-ec2-metadata-token': token} if token else {}
+    try:
+        res = _open_url(
+            AWS_AVAILABILITY_ZONE,
+            request_options=request_options,
+            phase='metadata',
+            method='GET',
+            validate_certs=False,
+            ca_path=None,
+            headers=headers
+        )
+        availability_zone = res.read().decode('utf-8')
+    except Exception as error:
+        raise AnsibleError(f"Error retrieving the AWS region from instance metadata: {str(error)}") from error
+
+    # Zones are named after their region, e.g. eu-west-1a or us-west-2-lax-1a for local zones
+    match = re.match(r'^[a-z]{2}(?:-gov|-iso[a-z]*)?-[a-z]+-\d+', availability_zone)
+    if match is None:
+        raise AnsibleError(f"Unable to derive the AWS region from availability zone {availability_zone}")
+    region = match.group(0)
+    _cache_metadata_value(('region',), region, float('inf'))
+    return region
+
+
+def _sts_host(region=None):
+    """
+    Returns the host name of the STS endpoint of `region`, or of the global endpoint.
+    """
+    if region is None:
+        return HOST
+    suffix = 'amazonaws.com.cn' if region.startswith('cn-') else 'amazonaws.com'
+    return f'sts.{region}.{suffix}'
+
+
+def _get_iam_role_name(request_options=None):
     """
     Retrieves the IAM Role Name associated with the current environment.
+
+    The role name is cached for the lifetime of an IMDSv2 session token.
     """
-    token = _get_metadata_token()
+    role_name = _get_cached_metadata_value(('role_name',))
+    if role_name is not None:
+        return role_name
+
+    token = _get_metadata_token(request_options)
     headers = {}
     if token:
         headers = {'X-aws-ec2-metadata-token': token}
-    res = open_url(
+    res = _open_url(
         AWS_METADATA_URL,
+        request_options=request_options,
+        phase='metadata',
         method='GET',
         validate_certs=False,
         ca_path=None,
         headers=headers
     )
     res_body = res.read().decode('utf-8')
+    _cache_metadata_value(('role_name',), res_body, time() + AWS_METADATA_TOKEN_TTL)
     return res_body
 
 
-def _get_metadata_token():
-    """Request a session token for IMDSv2"""
-    headers = {'X-aws-ec2-metadata-token-ttl-seconds': '900'}
-    token = None
+def _get_metadata_token(request_options=None):
+    """
+    Request a session token for IMDSv2.
+
+    The token is cached until shortly before the end of its AWS_METADATA_TOKEN_TTL
+    seconds lifetime.
+    """
+    token = _get_cached_metadata_value(('metadata_token',))
+    if token is not None:
+        return token
+
+    headers = {'X-aws-ec2-metadata-token-ttl-seconds': str(AWS_METADATA_TOKEN_TTL)}
     try:
-        response = open_url(
+        response = _open_url(
             AWS_TOKEN_URL,
+            request_options=request_options,
+            phase='metadata',
             method='PUT',
             validate_certs=False,
             ca_path=None,
@@ -349,28 +1065,34 @@ def _get_metadata_token():
         response_body = response.read().decode('utf-8')
 
         if response.getcode() == 200:
+            _cache_metadata_value(('metadata_token',), response_body, time() + AWS_METADATA_TOKEN_TTL - METADATA_CACHE_MARGIN)
             return response_body
         return None
     except Exception as error:  # pylint: disable=broad-except
         display.warning(f"IMDSv2 token retrieval failed: {str(error)}. Falling back to IMDSv1.")
         return None
-    finally:
-        if token:
-            token = None
 
 
-def _get_iam_role_metadata(role_name, token=None):
+def _get_iam_role_metadata(role_name, token=None, request_options=None):
     """
     Retrieves metadata for the IAM role associated with the current environment.
+
+    The credentials are cached per role until shortly before the `Expiration` returned
+    with them. The metadata service makes new credentials available well before that.
     """
+    credentials = _get_cached_metadata_value(('role_credentials', role_name))
+    if credentials is not None:
+        return credentials
 
     headers = {}
     if token:
         headers = {'X-aws-ec2-metadata-token': token}
 
     try:
-        res = open_url(
+        res = _open_url(
             AWS_METADATA_URL + role_name,
+            request_options=request_options,
+            phase='metadata',
             method='GET',
             headers=headers,
             validate_certs=False
@@ -388,19 +1110,37 @@ def _get_iam_role_metadata(role_name, token=None):
         secret_access_key = json_dict["SecretAccessKey"]
         token = json_dict["Token"]
 
+        expiration = _parse_aws_expiration(json_dict.get("Expiration"))
+        if expiration is not None:
+            _cache_metadata_value(
+                ('role_credentials', role_name), (access_key_id, secret_access_key, token), expiration - METADATA_CACHE_MARGIN
+            )
+
         return access_key_id, secret_access_key, token
 
     except Exception as error:
         raise AnsibleError(f"Error retrieving IAM role metadata: Exception occurred - {str(error)}") from error
 
 
-def _create_canonical_request(amzdate, token, signed_headers, payload_hash):
+def _parse_aws_expiration(expiration):
+    """
+    Converts an ISO 8601 `Expiration` timestamp returned by the metadata service,
+    such as 2025-04-25T18:30:00Z, to a Unix timestamp. Returns None when it is missing
+    or invalid.
+    """
+    try:
+        return datetime.datetime.fromisoformat(expiration.replace('Z', '+00:00')).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+def _create_canonical_request(amzdate, token, signed_headers, payload_hash, host=HOST):
     """
     Creates the canonical request string for signing the AWS request.
     """
     canonical_uri = '/'
     canonical_querystring = REQUEST_PARAMETERS
-    canonical_headers = 'host:' + HOST + '\n' + 'x-amz-content-sha256:' + payload_hash + '\n' + \
+    canonical_headers = 'host:' + host + '\n' + 'x-amz-content-sha256:' + payload_hash + '\n' + \
         'x-amz-date:' + amzdate + '\n' + 'x-amz-security-token:' + token + '\n'
 
     canonical_request = METHOD + '\n' + canonical_uri + '\n' + canonical_querystring + '\n' + \
@@ -410,30 +1150,47 @@ def _create_canonical_request(amzdate, token, signed_headers, payload_hash):
 
 
 # pylint: disable=too-many-arguments,too-many-locals
-def _create_conjur_iam_api_key(iam_role_name=None, access_key=None, secret_key=None, token=None):
+def _create_conjur_iam_api_key(iam_role_name=None, access_key=None, secret_key=None, token=None, request_options=None,
+                               sts_region=None):
     """
     Creates an IAM API key for Conjur authentication using the provided IAM role and credentials.
-    """
-    if iam_role_name is None:
-        iam_role_name = _get_iam_role_name()
 
-    metadata_token = _get_metadata_token()
+    The request is signed for the global STS endpoint, or for the regional endpoint of
+    `sts_region` when given; `auto` selects the region detected by `_detect_aws_region`.
 
+    STS accepts a signed request for AWS_SIGNATURE_VALIDITY seconds, so the API key is
+    cached per access key, session token and region, and reused for AWS_SIGNATURE_REUSE
+    seconds or until shortly before the role credentials expire.
+    """
+    credentials_expire_at = float('inf')
     if access_key is None and secret_key is None and token is None:
-        access_key, secret_key, token = _get_iam_role_metadata(iam_role_name, metadata_token)
+        if iam_role_name is None:
+            iam_role_name = _get_iam_role_name(request_options)
+        metadata_token = _get_metadata_token(request_options)
+        access_key, secret_key, token = _get_iam_role_metadata(iam_role_name, metadata_token, request_options)
+        credentials_expire_at = _get_metadata_value_expiration(('role_credentials', iam_role_name)) or time()
 
-    region = _get_aws_region()
+    if sts_region == 'auto':
+        sts_region = _detect_aws_region(request_options)
+    region = sts_region or _get_aws_region()
+    host = _sts_host(sts_region)
 
     if access_key is None or secret_key is None:
         raise AnsibleError('No access key is available.')
 
+    cache_key = ('signed_request', access_key, hashlib.sha256((token or '').encode('utf-8')).hexdigest(), region, host)
+    iam_api_key = _get_cached_metadata_value(cache_key)
+    if iam_api_key is not None:
+        display.vvvv("Reusing signed AWS GetCallerIdentity request")
+        return iam_api_key
+
     date = datetime.datetime.now(datetime.timezone.utc)
     amzdate = date.strftime('%Y%m%dT%H%M%SZ')
     datestamp = date.strftime('%Y%m%d')
 
     signed_headers = 'host;x-amz-content-sha256;x-amz-date;x-amz-security-token'
     payload_hash = hashlib.sha256(('').encode('utf-8')).hexdigest()
-    canonical_request = _create_canonical_request(amzdate, token, signed_headers, payload_hash)
+    canonical_request = _create_canonical_request(amzdate, token, signed_headers, payload_hash, host)
 
     algorithm = 'AWS4-HMAC-SHA256'
     credential_scope = datestamp + '/' + region + '/' + SERVICE + '/' + 'aws4_request'
@@ -452,7 +1209,7 @@ def _create_conjur_iam_api_key(iam_role_name=None, access_key=None, secret_key=N
     )
 
     headers = {
-        'host': HOST,
+        'host': host,
         'x-amz-date': amzdate,
         'x-amz-security-token': token,
         'x-amz-content-sha256': payload_hash,
@@ -466,12 +1223,14 @@ def _create_conjur_iam_api_key(iam_role_name=None, access_key=None, secret_key=N
     string_to_sign = None
     canonical_request = None
 
-    return f'{headers}'.replace("'", '"')
+    iam_api_key = f'{headers}'.replace("'", '"')
+    _cache_metadata_value(cache_key, iam_api_key, min(date.timestamp() + AWS_SIGNATURE_REUSE, credentials_expire_at))
+    return iam_api_key
 
 
 def _fetch_conjur_iam_session_token(
     appliance_url, account, service_id, host_id, cert_file, validate_certs,
-    iam_role_name=None, access_key=None, secret_key=None, token=None
+    iam_role_name=None, access_key=None, secret_key=None, token=None, request_options=None, sts_region=None
 ):
     """
     Retrieves the Conjur IAM session token for the provided service and IAM role credentials.
@@ -493,11 +1252,13 @@ def _fetch_conjur_iam_session_token(
         f"{urllib.parse.quote(host_id, safe='')}/authenticate"
     )
 
-    iam_api_key = _create_conjur_iam_api_key(iam_role_name, access_key, secret_key, token)
+    iam_api_key = _create_conjur_iam_api_key(iam_role_name, access_key, secret_key, token, request_options, sts_region)
 
     try:
-        res = open_url(
+        res = _open_url(
             url,
+            request_options=request_options,
+            phase='authenticate',
             data=iam_api_key,
             method='POST',
             validate_certs=validate_certs,
@@ -573,17 +1334,53 @@ def _get_valid_certificate(cert_content, cert_file):
     raise AnsibleError("Both certificate content and certificate file are invalid or missing. Please provide a valid certificate.")
 
 
+def _file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except (OSError, TypeError):
+        return None
+
+
+def _ca_bundle_key(cert_content, cert_file, system_ca_bundle):
+    """
+    Identifies a CA bundle by the certificate content, the certificate file and the system
+    CA bundle it is built from. Changing any of them, including touching one of the files,
+    produces a new key.
+    """
+    content_digest = hashlib.sha256((cert_content or '').encode('utf-8')).hexdigest()
+    key = f'{content_digest}:{cert_file}:{_file_mtime(cert_file)}:{system_ca_bundle}:{_file_mtime(system_ca_bundle)}'
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def _write_ca_bundle(bundle_file, cert_content, system_ca_bundle):
+    # Prepare a CA bundle including system CA certificates
+    if system_ca_bundle and os.path.exists(system_ca_bundle):
+        with open(system_ca_bundle, 'rb') as bundle:
+            shutil.copyfileobj(bundle, bundle_file)
+    else:
+        display.warning("System CA bundle not found, only the provided cert(s) will be used.")
+
+    # Normalize and append custom cert(s)
+    cert_bytes = cert_content.encode() if isinstance(cert_content, str) else cert_content
+    bundle_file.write(b"\n" + cert_bytes.strip().replace(b"\r\n", b"\n") + b"\n")
+
+
 def _get_certificate_file(cert_content, cert_file):
     """
     Creates a CA bundle containing CAs from the system truststore appended with the
-    provided certificate. The CA bundle is stored in a temporary file.
+    provided certificate, and returns its path.
 
-    The file must persist until the end of the process, so `delete=False` is used
-    to prevent automatic deletion. We manually handle deletion at the end of the process
-    to ensure proper resource management. A global variable tracks the file for cleanup.
+    Bundles are content addressed: they are written once to the plugin state directory
+    under a name derived from `_ca_bundle_key`, and reused by every later lookup, fork
+    and run built from the same certificate and system CA bundle. Each process also
+    remembers the path per key, so a repeated lookup does not even revalidate the
+    certificate. A bundle found in the state directory is touched, and writing a new bundle
+    removes the bundles nobody used for CA_BUNDLE_STALE_AGE seconds, such as those built from
+    a previous certificate or system CA bundle. Recently used bundles are kept, as concurrent
+    lookups may be using them.
 
-    Pylint's warning about not using a `with` statement is disabled because the file
-    needs to remain accessible beyond the function scope.
+    If the state directory is unusable, the bundle is written to a temporary file which
+    is reused for the rest of the process and removed when it exits.
 
     Args:
         cert_content (str): Raw certificate content.
@@ -592,33 +1389,73 @@ def _get_certificate_file(cert_content, cert_file):
     Returns:
         str: Path to the certificate file to be used.
     """
-    global temp_cert_file
-    cert_content = _get_valid_certificate(cert_content, cert_file)
-
-    if cert_content:
+    system_ca_bundle = ssl.get_default_verify_paths().cafile
+    bundle_key = _ca_bundle_key(cert_content, cert_file, system_ca_bundle)
+
+    with _ca_bundle_lock:
+        cached_path = _ca_bundle_cache.get(bundle_key)
+        if cached_path and os.path.exists(cached_path):
+            return cached_path
+
+        state_dir = _state_dir()
+        bundle_path = os.path.join(state_dir, f'ca-bundle-{bundle_key}.pem') if state_dir else None
+        if bundle_path and os.path.exists(bundle_path):
+            try:
+                os.utime(bundle_path)
+            except OSError:
+                pass
+            _ca_bundle_cache[bundle_key] = bundle_path
+            return bundle_path
+
+        cert_content = _get_valid_certificate(cert_content, cert_file)
         try:
-            temp_cert_file = NamedTemporaryFile(delete=False)  # pylint: disable=consider-using-with
-
-            # Prepare a CA bundle including system CA certificates
-            system_ca_bundle = ssl.get_default_verify_paths().cafile
-            if system_ca_bundle and os.path.exists(system_ca_bundle):
-                with open(system_ca_bundle, 'rb') as bundle:
-                    shutil.copyfileobj(bundle, temp_cert_file)
+            bundle_file = NamedTemporaryFile(dir=state_dir, delete=False)  # pylint: disable=consider-using-with
+            with bundle_file:
+                _write_ca_bundle(bundle_file, cert_content, system_ca_bundle)
+            if bundle_path:
+                os.replace(bundle_file.name, bundle_path)
+                _remove_stale_ca_bundles(state_dir)
             else:
-                display.warning("System CA bundle not found, only the provided cert(s) will be used.")
-
-            # Normalize and append custom cert(s)
-            cert_bytes = cert_content.encode() if isinstance(cert_content, str) else cert_content
-            temp_cert_file.write(b"\n" + cert_bytes.strip().replace(b"\r\n", b"\n") + b"\n")
-            temp_cert_file.close()
-            cert_file = temp_cert_file.name
+                bundle_path = bundle_file.name
+                atexit.register(_remove_file, bundle_path)
         except Exception as err:
             raise AnsibleError(f"Failed to create temporary CA bundle: {str(err)}") from err
 
-    return cert_file
+        display.vvvv(f'Created CA bundle {bundle_path}')
+        _ca_bundle_cache[bundle_key] = bundle_path
+        return bundle_path
 
 
-# Load configuration and return as dictionary if file is present on file system
+def _remove_stale_ca_bundles(state_dir):
+    """
+    Removes the CA bundles of the state directory which were neither written nor reused
+    for CA_BUNDLE_STALE_AGE seconds.
+    """
+    stale_before = time() - CA_BUNDLE_STALE_AGE
+    try:
+        names = os.listdir(state_dir)
+    except OSError:
+        return
+    for name in names:
+        if not (name.startswith('ca-bundle-') and name.endswith('.pem')):
+            continue
+        path = os.path.join(state_dir, name)
+        try:
+            if os.lstat(path).st_mtime < stale_before:
+                os.unlink(path)
+                display.vvvv(f'Removed stale CA bundle {path}')
+        except OSError:
+            pass
+
+
+def _remove_file(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+# Load configuration and return as dictionary if file is present on file system
 def _load_conf_from_file(conf_path):
     display.vvv(f'conf file: {conf_path}')
 
@@ -677,7 +1514,13 @@ def _encode_str(input_str):
 def _telemetry_header():
     global telemetry_header
 
-    if telemetry_header is None:
+    if telemetry_header is not None:
+        return telemetry_header
+
+    with _telemetry_header_lock:
+        if telemetry_header is not None:
+            return telemetry_header
+
         plugin_dir = os.path.dirname(__file__)
         collection_root = os.path.abspath(os.path.join(plugin_dir, '..', '..'))
         if collection_root.find('ansible_collections') != -1:
@@ -697,7 +1540,8 @@ def _telemetry_header():
 
 
 # Use credentials to retrieve temporary authorization token
-def _fetch_conjur_token(conjur_url, account, username, api_key, validate_certs, cert_file):  # pylint: disable=too-many-arguments
+def _fetch_conjur_token(conjur_url, account, username, api_key, validate_certs, cert_file,  # pylint: disable=too-many-arguments
+                        request_options=None):
     conjur_url = f'{conjur_url}/authn/{account}/{_encode_str(username)}/authenticate'
     display.vvvv(f'Authentication request to Conjur at: {conjur_url}, with user: {_encode_str(username)}')
 
@@ -709,89 +1553,1704 @@ def _fetch_conjur_token(conjur_url, account, username, api_key, validate_certs,
         'x-cybr-telemetry': encoded_telemetry
     }
 
-    response = open_url(conjur_url,
-                        data=api_key,
-                        method='POST',
-                        validate_certs=validate_certs,
-                        ca_path=cert_file,
-                        headers=headers)
+    response = _open_url(conjur_url,
+                         request_options=request_options,
+                         phase='authenticate',
+                         data=api_key,
+                         method='POST',
+                         validate_certs=validate_certs,
+                         ca_path=cert_file,
+                         headers=headers)
     code = response.getcode()
     if code != 200:
         raise AnsibleError(f'Failed to authenticate as \'{username}\' (got {code} response)')
 
-    return response.read()
+    return response.read()
+
+
+def _probe_aws(request_options=None):
+    response = _open_url(
+        AWS_TOKEN_URL,
+        request_options=request_options,
+        phase='metadata',
+        method='PUT',
+        headers={'X-aws-ec2-metadata-token-ttl-seconds': '60'},
+        validate_certs=False,
+        timeout=CLOUD_PROBE_TIMEOUT
+    )
+    return response.getcode() == 200
+
+
+def _probe_azure(request_options=None):
+    response = _open_url(
+        AZURE_INSTANCE_URL,
+        request_options=request_options,
+        phase='metadata',
+        method='GET',
+        headers={'Metadata': 'true'},
+        validate_certs=False,
+        timeout=CLOUD_PROBE_TIMEOUT
+    )
+    return response.getcode() == 200
+
+
+def _probe_gcp(request_options=None):
+    response = _open_url(
+        GCP_PROBE_URL,
+        request_options=request_options,
+        phase='metadata',
+        method='GET',
+        headers={'Metadata-Flavor': 'Google'},
+        validate_certs=False,
+        timeout=CLOUD_PROBE_TIMEOUT
+    )
+    return response.getcode() == 200 and response.headers.get('Metadata-Flavor') == 'Google'
+
+
+def _probe_authn_type(request_options=None):
+    """
+    Probes the AWS, Azure and GCP metadata services concurrently, each with a
+    CLOUD_PROBE_TIMEOUT seconds timeout, and returns the authenticator type of the first
+    one that answers, or None when the controller does not run in any of these clouds.
+    """
+    probes = {'aws': _probe_aws, 'azure': _probe_azure, 'gcp': _probe_gcp}
+    executor = ThreadPoolExecutor(max_workers=len(probes))
+    futures = {executor.submit(probe, request_options): authn_type for authn_type, probe in probes.items()}
+    try:
+        for future in as_completed(futures, timeout=CLOUD_PROBE_TIMEOUT * 2):
+            try:
+                if future.result():
+                    return futures[future]
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                display.vvvv(f"No {futures[future]} metadata service: {str(err)}")
+    except FuturesTimeoutError:
+        pass
+    finally:
+        # Do not wait for the probes of the other clouds
+        executor.shutdown(wait=False, cancel_futures=True)
+    return None
+
+
+def _detect_authn_type(request_options=None):
+    """
+    Returns the authenticator type matching the cloud the controller runs in: `aws`, `azure`,
+    `gcp`, or None for API key authentication.
+
+    The result of `_probe_authn_type` is cached in memory and in a file of the plugin state
+    directory named after the host, so that later lookups and runs on the same host do not
+    probe again for CLOUD_DETECTION_TTL seconds.
+    """
+    hostname = socket.gethostname()
+    cached = _get_cached_metadata_value(('authn_type', hostname))
+    if cached is not None:
+        return cached or None
+
+    state_dir = _state_dir()
+    path = None
+    if state_dir is not None:
+        path = os.path.join(state_dir, f"authn-type-{hashlib.sha256(hostname.encode('utf-8')).hexdigest()[:16]}.json")
+        try:
+            with open(path, 'r', encoding='utf-8') as detection_file:
+                detection = json.load(detection_file)
+            if detection['hostname'] == hostname and time() < detection['detected_at'] + CLOUD_DETECTION_TTL:
+                _cache_metadata_value(('authn_type', hostname), detection['authn_type'], detection['detected_at'] + CLOUD_DETECTION_TTL)
+                return detection['authn_type'] or None
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    authn_type = _probe_authn_type(request_options)
+    display.vvv(f"Detected authenticator type: {authn_type or 'API key'}")
+    detected_at = time()
+    _cache_metadata_value(('authn_type', hostname), authn_type or '', detected_at + CLOUD_DETECTION_TTL)
+    if path is not None:
+        try:
+            with NamedTemporaryFile(mode='w', dir=state_dir, prefix='.authn-type-', delete=False) as detection_file:
+                json.dump({'hostname': hostname, 'authn_type': authn_type, 'detected_at': detected_at}, detection_file)
+            os.replace(detection_file.name, path)
+        except OSError as err:
+            display.vvvv(f"Could not save the detected authenticator type: {str(err)}")
+    return authn_type
+
+
+# Authenticate with the configured authenticator and return a Conjur access token
+def _authenticate(conf, identity, authn_type, service_id, azure_client_id, validate_certs, cert_file,  # pylint: disable=too-many-arguments
+                  request_options=None, aws_sts_region=None):
+    if authn_type == 'aws':
+        return _fetch_conjur_iam_session_token(
+            appliance_url=conf['appliance_url'],
+            account=conf['account'],
+            host_id=identity['id'],
+            service_id=service_id,
+            validate_certs=validate_certs,
+            cert_file=cert_file,
+            request_options=request_options,
+            sts_region=aws_sts_region
+        )
+    if authn_type == "azure":
+        return _fetch_conjur_azure_token(
+            appliance_url=conf['appliance_url'],
+            account=conf['account'],
+            host_id=identity['id'],
+            service_id=service_id,
+            validate_certs=validate_certs,
+            cert_file=cert_file,
+            client_id=azure_client_id,
+            request_options=request_options
+        )
+    if authn_type == "gcp":
+        return _fetch_conjur_gcp_identity_token(
+            appliance_url=conf['appliance_url'],
+            account=conf['account'],
+            host_id=identity['id'],
+            validate_certs=validate_certs,
+            cert_file=cert_file,
+            request_options=request_options
+        )
+    return _fetch_conjur_token(
+        conf['appliance_url'],
+        conf['account'],
+        identity['id'],
+        identity['api_key'],
+        validate_certs,
+        cert_file,
+        request_options
+    )
+
+
+def _token_cache_key(appliance_url, account, identity, authn_type, service_id, azure_client_id):  # pylint: disable=too-many-arguments
+    """
+    Builds the key under which the access token of an identity is cached.
+
+    The API key or Azure client id is only included as a digest, so that a token is never
+    served to a caller presenting different credentials for the same login.
+    """
+    credential = identity.get('api_key') or azure_client_id or ''
+    credential_digest = hashlib.sha256(credential.encode('utf-8')).hexdigest()
+    return (appliance_url, account, identity['id'], authn_type, service_id, credential_digest)
+
+
+def _token_expiration(token):
+    """
+    Returns the expiry time of a Conjur access token as a Unix timestamp.
+
+    Conjur access tokens are JSON documents whose base64url encoded `payload` carries an
+    `exp` claim. Tokens issued without `exp` are valid for CONJUR_TOKEN_LIFETIME seconds
+    after `iat`. Returns None when the token cannot be parsed.
+    """
+    try:
+        payload = json.loads(token)['payload']
+        claims = json.loads(urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        if 'exp' in claims:
+            return float(claims['exp'])
+        return float(claims['iat']) + CONJUR_TOKEN_LIFETIME
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def _get_cached_token(cache_key, margin):
+    """
+    Returns the cached access token for `cache_key`, or None when there is none
+    or it expires within `margin` seconds.
+    """
+    with _token_cache_lock:
+        entry = _token_cache.get(cache_key)
+        if entry is None:
+            return None
+        token, expires_at = entry
+        if time() < expires_at - margin:
+            return token
+        del _token_cache[cache_key]
+    return None
+
+
+def _cache_token(cache_key, token):
+    """
+    Caches an access token until its expiry. Tokens without a readable expiry are not cached.
+    """
+    expires_at = _token_expiration(token)
+    if expires_at is None:
+        display.vvvv("Conjur access token has no readable expiry, it will not be cached")
+        return
+    with _token_cache_lock:
+        _token_cache[cache_key] = (token, expires_at)
+
+
+@contextmanager
+def _file_lock(path, deadline=None):
+    """
+    Holds an exclusive `flock` on `path`, created with user-only permissions if needed,
+    for the duration of the block. Serializes the processes of the current user.
+
+    With a `deadline`, the wall clock time of the end of the lookup, the lock is polled
+    instead of waited for.
+
+    Raises:
+        AnsibleError: The deadline passed before the lock could be taken.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, S_IRUSR | S_IWUSR)
+    try:
+        if deadline is None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time() >= deadline:
+                        raise AnsibleError("The Conjur lookup deadline was exceeded") from None
+                    sleep(min(FILE_LOCK_POLL_INTERVAL, max(deadline - time(), 0)))
+        yield
+    finally:
+        os.close(fd)
+
+
+def _process_start_time(pid):
+    """
+    Returns the start time of process `pid` in clock ticks since boot, read from /proc,
+    or None when it is not available.
+    """
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as stat_file:
+            # The command name may contain spaces: the fields after it are counted from its closing parenthesis
+            return int(stat_file.read().rsplit(b')', 1)[1].split()[19])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _controller_run_id(pid=None):
+    """
+    Identifies a run of the Ansible controller, the parent of the worker processes running
+    lookups. The start time of the process distinguishes runs which reuse the same pid.
+    """
+    pid = os.getppid() if pid is None else pid
+    return f'{pid}-{_process_start_time(pid)}'
+
+
+def _remove_stale_run_files(state_dir, run_id):
+    """
+    Removes the key, token and broker lock files of controller runs which are no longer running.
+    """
+    for name in os.listdir(state_dir):
+        match = re.match(r'^(?:run|token|broker)-(\d+)-(\w+?)(?:\.key|\.sock\.lock|-[0-9a-f]{64}(?:\.lock)?)$', name)
+        if match is None or f'{match.group(1)}-{match.group(2)}' == run_id:
+            continue
+        if _controller_run_id(int(match.group(1))) != f'{match.group(1)}-{match.group(2)}':
+            _remove_file(os.path.join(state_dir, name))
+
+
+def _get_run_key(state_dir, run_id):
+    """
+    Returns the key encrypting the tokens shared by the workers of the controller run `run_id`.
+
+    The first worker generates a random secret and publishes it atomically in a user-only file
+    named after the run; the others read it. Files left by earlier runs are removed when a new
+    run starts.
+    """
+    with _token_cache_lock:
+        if run_id in _run_key:
+            return _run_key[run_id]
+
+        path = os.path.join(state_dir, f'run-{run_id}.key')
+        with NamedTemporaryFile(dir=state_dir, prefix='.run-', delete=False) as key_file:
+            key_file.write(os.urandom(32))
+        try:
+            os.link(key_file.name, path)
+            _remove_stale_run_files(state_dir, run_id)
+        except FileExistsError:
+            pass
+        finally:
+            _remove_file(key_file.name)
+
+        with open(path, 'rb') as key_file:
+            secret = key_file.read()
+        key = urlsafe_b64encode(hmac.new(secret, b'conjur-token-cache', hashlib.sha256).digest())
+        _run_key.clear()
+        _run_key[run_id] = key
+        return key
+
+
+def _read_shared_token(path, fernet, margin):
+    try:
+        with open(path, 'rb') as token_file:
+            entry = json.loads(fernet.decrypt(token_file.read()))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, InvalidToken) as err:
+        display.vvvv(f"Ignoring unreadable shared Conjur access token: {str(err)}")
+        return None
+    try:
+        if time() < entry['expires_at'] - margin:
+            return entry['token'].encode('utf-8')
+    except (KeyError, TypeError, AttributeError) as err:
+        display.vvvv(f"Ignoring malformed shared Conjur access token: {str(err)}")
+    return None
+
+
+def _get_shared_token(cache_key, margin, authenticate, run_id=None, deadline=None):  # pylint: disable=too-many-arguments
+    """
+    Returns an access token for `cache_key` from the cache shared by the workers of the controller
+    run `run_id`, the current one by default, calling `authenticate` to obtain and share a new one
+    when needed.
+
+    A token is refreshed by a single worker at a time: the others wait on a file lock, until
+    `deadline` at most, and read the token it wrote. Falls back to `authenticate` alone when
+    the cache cannot be used.
+    """
+    state_dir = _state_dir()
+    if cryptography_import_error is not None or state_dir is None:
+        display.warning("The shared Conjur token cache requires the cryptography package and a private "
+                        "state directory, authenticating without it")
+        return authenticate()
+
+    run_id = run_id or _controller_run_id()
+    fernet = Fernet(_get_run_key(state_dir, run_id))
+    key_digest = hashlib.sha256(repr(cache_key).encode('utf-8')).hexdigest()
+    path = os.path.join(state_dir, f'token-{run_id}-{key_digest}')
+
+    token = _read_shared_token(path, fernet, margin)
+    if token is not None:
+        display.vvv("Reusing shared Conjur access token")
+        return token
+
+    with _file_lock(f'{path}.lock', deadline):
+        token = _read_shared_token(path, fernet, margin)
+        if token is not None:
+            display.vvv("Reusing shared Conjur access token")
+            return token
+
+        token = authenticate()
+        expires_at = _token_expiration(token)
+        if expires_at is None:
+            display.vvvv("Conjur access token has no readable expiry, it will not be shared")
+            return token
+        entry = json.dumps({'token': token.decode('utf-8'), 'expires_at': expires_at})
+        with NamedTemporaryFile(dir=state_dir, prefix='.token-', delete=False) as token_file:
+            token_file.write(fernet.encrypt(entry.encode('utf-8')))
+        os.replace(token_file.name, path)
+        return token
+
+
+class _TokenRefresher:
+    """
+    Renews cached access tokens in background daemon threads before they expire.
+
+    A refresh is scheduled when a token is cached, once `fraction` of its remaining lifetime
+    has elapsed. It only runs if the token was reused in the meantime, so that identities
+    which are no longer looked up are not kept authenticated. Refreshes are started by
+    `timer_factory`, called like `threading.Timer`.
+    """
+    def __init__(self, timer_factory=threading.Timer):
+        self._timer_factory = timer_factory
+        self._lock = threading.Lock()
+        self._timers = {}
+        self._used = set()
+
+    def schedule(self, cache_key, token, fraction, refresh):
+        """
+        Schedules `refresh(margin)` for the token cached under `cache_key`. `margin` is the
+        number of seconds before expiry at which a token is considered due for renewal.
+        """
+        expires_at = _token_expiration(token)
+        if expires_at is None or not 0 < fraction < 1:
+            return
+        lifetime = expires_at - time()
+        timer = self._timer_factory(fraction * lifetime, self._run, (cache_key, refresh, (1 - fraction) * lifetime))
+        timer.daemon = True
+        with self._lock:
+            previous = self._timers.pop(cache_key, None)
+            if previous is not None:
+                previous.cancel()
+            self._used.discard(cache_key)
+            self._timers[cache_key] = timer
+        timer.start()
+
+    def mark_used(self, cache_key):
+        with self._lock:
+            if cache_key in self._timers:
+                self._used.add(cache_key)
+
+    def _run(self, cache_key, refresh, margin):
+        with self._lock:
+            used = cache_key in self._used
+            self._timers.pop(cache_key, None)
+            self._used.discard(cache_key)
+        if not used:
+            return
+        try:
+            refresh(margin)
+            display.vvv("Refreshed Conjur access token in the background")
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            display.vvv(f"Background Conjur access token refresh failed, the next lookup will authenticate: {str(err)}")
+
+    def after_fork(self):
+        # Timer threads do not survive a fork
+        self._lock = threading.Lock()
+        self._timers = {}
+        self._used = set()
+
+
+class _CircuitBreaker:
+    """
+    Circuit breakers of the Conjur endpoints, shared by the workers of the current user through
+    a file per endpoint in the plugin state directory, or kept in memory without one.
+
+    A circuit opens after `threshold` consecutive connection failures or 5xx responses of its
+    endpoint, and requests to the endpoint are then refused. Once `reset_timeout` seconds have
+    passed the circuit is half-open: a single trial request is let through, which closes the
+    circuit when it succeeds and opens it again when it fails.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _path(url):
+        state_dir = _state_dir()
+        if state_dir is None:
+            return None
+        return os.path.join(state_dir, f"circuit-{hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]}.json")
+
+    def _read(self, path, url):
+        if path is None:
+            return self._states.get(url, {'state': 'closed', 'failures': 0})
+        try:
+            with open(path, 'r', encoding='utf-8') as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError):
+            return {'state': 'closed', 'failures': 0}
+
+    def _write(self, path, url, state):
+        if path is None:
+            self._states[url] = state
+            return
+        with NamedTemporaryFile('w', dir=os.path.dirname(path), prefix='.circuit-', delete=False) as state_file:
+            json.dump(state, state_file)
+        os.replace(state_file.name, path)
+
+    @contextmanager
+    def _locked(self, path):
+        if path is None:
+            with self._lock:
+                yield
+        else:
+            with _file_lock(f'{path}.lock'):
+                yield
+
+    def allow(self, url, reset_timeout):
+        """
+        Tells whether a request may be sent to `url`, moving an open circuit to half-open
+        for a single trial request once `reset_timeout` seconds have passed.
+        """
+        path = self._path(url)
+        state = self._read(path, url)
+        if state['state'] == 'closed':
+            return True
+        if time() < state['since'] + reset_timeout:
+            return False
+        with self._locked(path):
+            state = self._read(path, url)
+            if state['state'] == 'closed':
+                return True
+            # An open circuit past its timeout, or a trial request which never reported back
+            if time() < state['since'] + reset_timeout:
+                return False
+            self._write(path, url, {'state': 'half-open', 'failures': state['failures'], 'since': time()})
+        display.vvv(f"Circuit of Conjur endpoint {url} is half-open, sending a trial request")
+        return True
+
+    def record_success(self, url):
+        path = self._path(url)
+        if self._read(path, url) == {'state': 'closed', 'failures': 0}:
+            return
+        with self._locked(path):
+            if self._read(path, url)['state'] != 'closed':
+                display.v(f"Circuit of Conjur endpoint {url} closed")
+            self._write(path, url, {'state': 'closed', 'failures': 0})
+
+    def record_failure(self, url, threshold):
+        path = self._path(url)
+        with self._locked(path):
+            state = self._read(path, url)
+            failures = state['failures'] + 1
+            if state['state'] != 'closed' or failures >= threshold:
+                if state['state'] != 'open':
+                    display.warning(f"Circuit of Conjur endpoint {url} opened after {failures} consecutive failure(s)")
+                self._write(path, url, {'state': 'open', 'failures': failures, 'since': time()})
+            else:
+                self._write(path, url, {'state': 'closed', 'failures': failures})
+
+
+class _RateLimiter:
+    """
+    Limits the requests sent to each host by all workers of the current user.
+
+    The state of a host lives in a small memory-mapped file of the plugin state directory,
+    updated under a file lock: a token bucket refilled at `rate_limit` tokens per second up
+    to `rate_limit_burst`, and an AIMD concurrency limit of up to `max_concurrency`, halved
+    when a request is throttled with a 429 or 503 response and increased by 1 / limit after
+    every successful request. Concurrent requests hold an exclusive lock on one of `limit`
+    slot files, which the kernel releases if the worker dies.
+    """
+    # tokens, time of the last refill, concurrency limit, initialized flag
+    _STATE = struct.Struct('4d')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def after_fork(self):
+        # File locks belong to the open file, which is shared with the parent after a fork
+        for fd, state in self._states.values():
+            state.close()
+            os.close(fd)
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def _state(self, state_dir, host):
+        entry = self._states.get(host)
+        if entry is None:
+            path = os.path.join(state_dir, f"ratelimit-{hashlib.sha256(host.encode('utf-8')).hexdigest()[:16]}")
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, S_IRUSR | S_IWUSR)
+            if os.fstat(fd).st_size < self._STATE.size:
+                os.ftruncate(fd, self._STATE.size)
+            entry = self._states[host] = (fd, mmap.mmap(fd, self._STATE.size))
+        return entry
+
+    @contextmanager
+    def _locked_state(self, state_dir, host, request_options):
+        """
+        Yields the state of `host` as a list, written back when the block exits.
+        """
+        with self._lock:
+            fd, state = self._state(state_dir, host)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                values = list(self._STATE.unpack_from(state))
+                if not values[3]:
+                    values = [request_options.rate_limit_burst, time(), request_options.max_concurrency, 1.0]
+                yield values
+                self._STATE.pack_into(state, 0, *values)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _take_token(self, state_dir, host, request_options, phase):
+        while True:
+            with self._locked_state(state_dir, host, request_options) as values:
+                now = time()
+                values[0] = min(request_options.rate_limit_burst, values[0] + (now - values[1]) * request_options.rate_limit)
+                values[1] = now
+                if values[0] >= 1:
+                    values[0] -= 1
+                    return
+                wait = (1 - values[0]) / request_options.rate_limit
+            # Raises once the deadline of the lookup has passed
+            request_options.timeout(phase)
+            sleep(wait)
+
+    def _take_slot(self, state_dir, host, request_options, phase):
+        prefix = os.path.join(state_dir, f"ratelimit-{hashlib.sha256(host.encode('utf-8')).hexdigest()[:16]}-slot-")
+        while True:
+            with self._locked_state(state_dir, host, request_options) as values:
+                values[2] = min(max(values[2], 1.0), request_options.max_concurrency)
+                limit = int(values[2])
+            for index in random.sample(range(limit), limit):
+                fd = os.open(f'{prefix}{index}', os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, S_IRUSR | S_IWUSR)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    os.close(fd)
+            request_options.timeout(phase)
+            sleep(CONCURRENCY_POLL_INTERVAL)
+
+    def acquire(self, host, request_options, phase):
+        """
+        Waits until a request may be sent to `host`, and returns the concurrency slot it holds
+        until `release`, or None when there is no concurrency limit or no state directory.
+        """
+        state_dir = _state_dir()
+        if state_dir is None:
+            return None
+        if request_options.rate_limit > 0:
+            self._take_token(state_dir, host, request_options, phase)
+        if request_options.max_concurrency > 0:
+            return self._take_slot(state_dir, host, request_options, phase)
+        return None
+
+    def release(self, host, slot, request_options, throttled):
+        """
+        Frees the concurrency slot of a request, adapting the concurrency limit to whether it
+        succeeded (throttled is False), was throttled (True), or failed otherwise (None).
+        """
+        if slot is None:
+            return
+        os.close(slot)
+        if throttled is None:
+            return
+        with self._locked_state(_state_dir(), host, request_options) as values:
+            if throttled:
+                values[2] = max(1.0, values[2] / 2)
+                display.vvv(f"Throttled by {host}, concurrency limit lowered to {int(values[2])}")
+            else:
+                values[2] = min(request_options.max_concurrency, values[2] + 1 / values[2])
+
+
+class _RequestOptions:  # pylint: disable=too-many-instance-attributes
+    """
+    Settings of a single lookup which apply to every HTTP request it sends.
+
+    An instance is built by `LookupModule.run` and passed down explicitly, so that
+    concurrent lookups in the same process never share per-call settings. `timeouts`
+    maps each phase of DEFAULT_TIMEOUTS to its (connect, read) timeouts, `deadline`
+    is the wall clock time after which the lookup must not send any more requests,
+    `endpoints` lists the (url, read_only) pairs of the Conjur endpoints requests may be
+    sent to, and `follower_urls` the pool of followers secret reads are spread over.
+    """
+    def __init__(self, connection_pooling=False, retries=DEFAULT_RETRIES,  # pylint: disable=too-many-arguments
+                 retry_base_delay=DEFAULT_RETRY_BASE_DELAY, retry_budget=DEFAULT_RETRY_BUDGET,
+                 timeouts=None, deadline=None, endpoints=None, follower_urls=None,
+                 circuit_breaker_threshold=DEFAULT_CIRCUIT_BREAKER_THRESHOLD,
+                 circuit_breaker_reset_timeout=DEFAULT_CIRCUIT_BREAKER_RESET_TIMEOUT,
+                 rate_limit=0, rate_limit_burst=DEFAULT_RATE_LIMIT_BURST, max_concurrency=0):
+        self.connection_pooling = connection_pooling
+        self.retries = retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_budget = retry_budget
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.deadline = deadline
+        self.endpoints = endpoints
+        self.follower_urls = follower_urls
+        self.circuit_breaker_threshold = circuit_breaker_threshold
+        self.circuit_breaker_reset_timeout = circuit_breaker_reset_timeout
+        self.rate_limit = rate_limit
+        self.rate_limit_burst = rate_limit_burst
+        self.max_concurrency = max_concurrency
+
+    def timeout(self, phase, limit=None):
+        """
+        Returns the (connect, read) timeouts of a request of `phase`, at most `limit`
+        and the time left before the deadline.
+
+        Raises:
+            AnsibleError: The deadline of the lookup has passed.
+        """
+        connect_timeout, read_timeout = self.timeouts[phase]
+        if limit is not None:
+            connect_timeout, read_timeout = min(connect_timeout, limit), min(read_timeout, limit)
+        if self.deadline is not None:
+            remaining = self.deadline - time()
+            if remaining <= 0:
+                raise AnsibleError("The Conjur lookup deadline was exceeded")
+            connect_timeout, read_timeout = min(connect_timeout, remaining), min(read_timeout, remaining)
+        return connect_timeout, read_timeout
+
+    def without_deadline(self):
+        """
+        Returns a copy of these options for requests made outside of the lookup, such as
+        background token refreshes, which must not be bound by its deadline.
+        """
+        return _RequestOptions(**{**vars(self), 'deadline': None})
+
+
+class _PooledResponse:
+    """
+    Fully read response of a pooled request, exposing the subset of the
+    `open_url` response interface used by this plugin.
+    """
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self._body = body
+
+    def getcode(self):
+        return self.status
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+    def info(self):
+        return self.headers
+
+    def read(self):
+        return self._body
+
+
+class _PooledHTTPSConnection(http.client.HTTPSConnection):
+    """
+    HTTPS connection which resumes the TLS session of an earlier connection to the
+    same endpoint instead of performing a full handshake.
+    """
+    def __init__(self, host, port=None, timeout=None, context=None, tls_session=None):  # pylint: disable=too-many-arguments
+        super().__init__(host, port=port, timeout=timeout, context=context)
+        self._pool_context = context
+        self._tls_session = tls_session
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        self.sock = self._pool_context.wrap_socket(self.sock, server_hostname=self.host, session=self._tls_session)
+
+
+class _ConnectionPool:
+    """
+    Keep-alive HTTP(S) connections shared by all lookups of a process.
+
+    Idle connections are kept per (scheme, host, port, CA bundle, validate_certs), so a
+    connection is only ever reused with the certificate validation settings it was
+    opened with. The pool is emptied in forked children, which must not share sockets
+    with their parent.
+    """
+    def __init__(self, max_idle=POOL_MAX_IDLE_CONNECTIONS):
+        self._max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._tls_sessions = {}
+        self._ssl_contexts = {}
+
+    def after_fork(self):
+        """
+        Drops the connections inherited from the parent process, without closing them.
+        """
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._tls_sessions = {}
+        self._ssl_contexts = {}
+
+    def _ssl_context(self, ca_path, validate_certs):
+        key = (ca_path, validate_certs)
+        context = self._ssl_contexts.get(key)
+        if context is None:
+            if validate_certs:
+                context = ssl.create_default_context(cafile=ca_path)
+            else:
+                context = ssl.create_default_context()
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            self._ssl_contexts[key] = context
+        return context
+
+    def _acquire(self, key, connect_timeout, read_timeout):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                connection = idle.pop()
+                connection.timeout = connect_timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(read_timeout)
+                return connection, True
+
+            scheme, host, port, ca_path, validate_certs = key
+            if scheme == 'https':
+                connection = _PooledHTTPSConnection(
+                    host, port, timeout=connect_timeout,
+                    context=self._ssl_context(ca_path, validate_certs),
+                    tls_session=self._tls_sessions.get(key)
+                )
+            else:
+                connection = http.client.HTTPConnection(host, port, timeout=connect_timeout)
+            return connection, False
+
+    def _release(self, key, connection):
+        with self._lock:
+            if isinstance(connection, _PooledHTTPSConnection) and connection.sock is not None:
+                self._tls_sessions[key] = connection.sock.session
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self._max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def request(self, url, data=None, headers=None, method=None, validate_certs=True, ca_path=None, timeout=10):  # pylint: disable=too-many-arguments
+        """
+        Sends a request over a pooled connection and returns a `_PooledResponse`.
+
+        Like `open_url`, an `HTTPError` is raised for responses with a status of 400 or above.
+        A request failing on a reused connection because the server closed it while it was
+        idle, before any byte of a response was received, is sent again on a new connection.
+        Requests which time out or fail after the response started are never sent again. `timeout` is either a single timeout
+        or a (connect, read) pair of timeouts, in seconds.
+        """
+        connect_timeout, read_timeout = timeout if isinstance(timeout, (tuple, list)) else (timeout, timeout)
+        parsed = urllib.parse.urlsplit(url)
+        default_port = 443 if parsed.scheme == 'https' else 80
+        key = (parsed.scheme, parsed.hostname, parsed.port or default_port, ca_path, validate_certs)
+        path = parsed.path or '/'
+        if parsed.query:
+            path = f'{path}?{parsed.query}'
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        method = method or ('POST' if data is not None else 'GET')
+
+        while True:
+            connection, reused = self._acquire(key, connect_timeout, read_timeout)
+            try:
+                if connection.sock is None:
+                    connection.connect()
+                    connection.sock.settimeout(read_timeout)
+                connection.request(method, path, body=data, headers=headers or {})
+                response = connection.getresponse()
+            except (http.client.HTTPException, OSError) as err:
+                connection.close()
+                if reused and _is_stale_connection_error(err):
+                    continue
+                raise
+            try:
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                raise
+            break
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(key, connection)
+
+        if response.status >= 400:
+            raise urllib_error.HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(body))
+        return _PooledResponse(url, response.status, response.reason, response.headers, body)
+
+
+def _is_stale_connection_error(err):
+    """
+    Tells whether a request failed because its keep-alive connection had been closed by the
+    server: the connection was reset or closed before any byte of a response arrived.
+    """
+    if isinstance(err, http.client.BadStatusLine):
+        # RemoteDisconnected, or a status line left empty by a closed connection
+        return isinstance(err, http.client.RemoteDisconnected) or not err.line
+    return isinstance(err, (ConnectionResetError, BrokenPipeError))
+
+
+def _uses_proxy(url):
+    hostname = urllib.parse.urlsplit(url).hostname
+    proxies = urllib.request.getproxies()
+    return url.split(':', 1)[0] in proxies and not urllib.request.proxy_bypass(hostname)
+
+
+def _send_request(url, request_options, phase, **kwargs):
+    if request_options is None or (request_options.rate_limit <= 0 and request_options.max_concurrency <= 0):
+        return _dispatch_request(url, request_options, phase, **kwargs)
+
+    host = urllib.parse.urlsplit(url).netloc
+    slot = _rate_limiter.acquire(host, request_options, phase)
+    throttled = None
+    try:
+        response = _dispatch_request(url, request_options, phase, **kwargs)
+        throttled = False
+        return response
+    except urllib_error.HTTPError as err:
+        if err.code in (429, 503):
+            throttled = True
+        raise
+    finally:
+        _rate_limiter.release(host, slot, request_options, throttled)
+
+
+def _dispatch_request(url, request_options, phase, **kwargs):
+    pooled = request_options is not None and request_options.connection_pooling and not _uses_proxy(url)
+    if request_options is not None and phase is not None:
+        timeouts = request_options.timeout(phase, kwargs.get('timeout'))
+        # open_url applies a single timeout to connecting and to every read
+        kwargs['timeout'] = timeouts if pooled else max(timeouts)
+    if pooled:
+        return _connection_pool.request(url, **kwargs)
+    return open_url(url, **kwargs)
+
+
+def _parse_endpoints(appliance_url):
+    """
+    Returns the (url, read_only) pairs of the Conjur appliance url option, which is either
+    a single url or a list of urls, each prefixed with `ro:` when read-only or given as a
+    mapping with `url` and `read_only` keys.
+    """
+    endpoints = []
+    for item in appliance_url if isinstance(appliance_url, list) else [appliance_url]:
+        if isinstance(item, dict):
+            if 'url' not in item:
+                raise AnsibleError(f"Invalid Conjur appliance url {item}: a `url` key is required")
+            url, read_only = str(item['url']), boolean(item.get('read_only', False), strict=False)
+        elif str(item).startswith('ro:'):
+            url, read_only = str(item)[3:], True
+        else:
+            url, read_only = str(item), False
+        url = url.strip().rstrip('/')
+        if url:
+            endpoints.append((url, read_only))
+    if not endpoints:
+        raise AnsibleError("Configuration must define at least one Conjur appliance url")
+    return endpoints
+
+
+def _measure_endpoint(url, request_options, **kwargs):
+    """
+    Returns the round-trip time in seconds of a request to the root of a Conjur endpoint,
+    or None when it cannot be reached or answers with a 5xx response.
+    """
+    start = monotonic()
+    try:
+        _send_request(f'{url}/', request_options, 'fetch', method='GET', **kwargs)
+    except urllib_error.HTTPError as err:
+        if err.code >= 500:
+            return None
+    except Exception as err:  # pylint: disable=broad-exception-caught
+        display.vvvv(f"Conjur endpoint {url} is not reachable: {str(err)}")
+        return None
+    return monotonic() - start
+
+
+def _mark_endpoint_unhealthy(url):
+    with _endpoint_lock:
+        _unhealthy_endpoints[url] = monotonic() + ENDPOINT_UNHEALTHY_TTL
+
+
+def _endpoint_order(request_options, **kwargs):
+    """
+    Returns the urls of `request_options.endpoints` in the order requests try them: healthy
+    read-only endpoints before healthy read-write ones, each by increasing round-trip time,
+    then the endpoints which failed less than ENDPOINT_UNHEALTHY_TTL seconds ago.
+
+    Round-trip times are measured concurrently, once per process, the first time an endpoint
+    is used, with the `validate_certs` and `ca_path` arguments given in `kwargs`.
+    """
+    if len(request_options.endpoints) == 1:
+        return [request_options.endpoints[0][0]]
+    with _endpoint_lock:
+        unmeasured = [url for url, _ in request_options.endpoints if url not in _endpoint_latencies]
+    if unmeasured:
+        def measure():
+            with ThreadPoolExecutor(max_workers=len(unmeasured)) as executor:
+                latencies = dict(zip(unmeasured, executor.map(
+                    lambda url: _measure_endpoint(url, request_options, **kwargs), unmeasured
+                )))
+            display.vvv(f"Conjur endpoint round-trip times: {latencies}")
+            with _endpoint_lock:
+                _endpoint_latencies.update(latencies)
+            for url, latency in latencies.items():
+                if latency is None:
+                    _mark_endpoint_unhealthy(url)
+
+        _single_flight.do(('endpoint_latencies', tuple(unmeasured)), measure, request_options.deadline)
+
+    now = monotonic()
+    with _endpoint_lock:
+        def sort_key(endpoint):
+            url, read_only = endpoint
+            latency = _endpoint_latencies.get(url)
+            return (_unhealthy_endpoints.get(url, 0) > now, not read_only, float('inf') if latency is None else latency)
+
+        return [url for url, _ in sorted(request_options.endpoints, key=sort_key)]
+
+
+def _follower_order(follower_urls, routing_key):
+    """
+    Returns `follower_urls` in the order a request for `routing_key` tries them, using
+    rendezvous hashing: the followers are sorted by a hash of the follower url and the key,
+    so a key keeps its follower when other followers are added or removed. Followers which
+    failed less than ENDPOINT_UNHEALTHY_TTL seconds ago come last.
+    """
+    def weight(url):
+        digest = hashlib.sha256(f'{url}\n{routing_key}'.encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big')
+
+    now = monotonic()
+    with _endpoint_lock:
+        unhealthy = {url for url in follower_urls if _unhealthy_endpoints.get(url, 0) > now}
+    return sorted(follower_urls, key=lambda url: (url in unhealthy, -weight(url)))
+
+
+def _is_endpoint_failure(err):
+    """
+    Tells whether a failed request should be sent to another Conjur endpoint: after connection
+    errors, timeouts and 5xx responses. Other HTTP errors would be the same on every endpoint.
+    """
+    if isinstance(err, urllib_error.HTTPError):
+        return err.code >= 500
+    return True
+
+
+def _check_endpoint_health(url, request_options, validate_certs, cert_file):
+    """
+    Requests the health endpoint of a Conjur url, and returns None when it is healthy or the
+    reason why it is not. Endpoints answering with a client error, such as a 404 from Conjur
+    versions without a health endpoint, are reachable and considered healthy.
+    """
+    try:
+        _send_request(f'{url}{CONJUR_HEALTH_PATH}', request_options, 'fetch',
+                      method='GET', validate_certs=validate_certs, ca_path=cert_file)
+    except urllib_error.HTTPError as err:
+        if err.code >= 500:
+            return f'{err.code} {err.reason}'
+    except (urllib_error.URLError, socket.timeout, ConnectionError, http.client.HTTPException) as err:
+        return str(err)
+    return None
+
+
+def _read_health(path, ttl):
+    try:
+        with open(path, 'r', encoding='utf-8') as health_file:
+            entry = json.load(health_file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entry, dict) or entry.get('checked_at', 0) + ttl <= time():
+        return None
+    return entry
+
+
+def _endpoint_health(url, request_options, validate_certs, cert_file, ttl):
+    """
+    Returns the result of `_check_endpoint_health` for `url`, cached for `ttl` seconds in the
+    plugin state directory. A single worker checks an endpoint at a time, the others wait on
+    a file lock, until the deadline of the lookup at most, and reuse its result.
+    """
+    state_dir = _state_dir()
+    if state_dir is None:
+        return _check_endpoint_health(url, request_options, validate_certs, cert_file)
+
+    path = os.path.join(state_dir, f"health-{hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]}.json")
+    entry = _read_health(path, ttl)
+    if entry is None:
+        with _file_lock(f'{path}.lock', request_options.deadline):
+            entry = _read_health(path, ttl)
+            if entry is None:
+                entry = {'error': _check_endpoint_health(url, request_options, validate_certs, cert_file), 'checked_at': time()}
+                with NamedTemporaryFile('w', dir=state_dir, prefix='.health-', delete=False) as health_file:
+                    json.dump(entry, health_file)
+                os.replace(health_file.name, path)
+    return entry['error']
+
+
+def _preflight(request_options, validate_certs, cert_file, ttl):
+    """
+    Checks the health of every configured Conjur url concurrently. Unhealthy urls are only
+    tried after the healthy ones.
+
+    Raises:
+        AnsibleError: No configured Conjur url is healthy.
+    """
+    urls = list(dict.fromkeys([url for url, _ in request_options.endpoints] + list(request_options.follower_urls or [])))
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        errors = dict(zip(urls, executor.map(
+            lambda url: _endpoint_health(url, request_options, validate_certs, cert_file, ttl), urls
+        )))
+    for url, error in errors.items():
+        if error is not None:
+            display.vvv(f"Conjur endpoint {url} is unhealthy: {error}")
+            _mark_endpoint_unhealthy(url)
+    if all(error is not None for error in errors.values()):
+        raise AnsibleError("Conjur is unavailable: " + "; ".join(f"{url}: {error}" for url, error in errors.items()))
+
+
+# Every request of the plugin goes through this function. The timeouts of `phase`, a key of
+# DEFAULT_TIMEOUTS, apply when it is given, bounded by an explicit `timeout` argument.
+# Requests to one of several configured Conjur endpoints fail over to the others, skipping
+# those whose circuit is open, and requests with a `routing_key` are first sent to the
+# followers chosen for that key. Within a call of a `retry` decorated function, endpoint
+# failures are reported to the circuit breaker by the decorator once all attempts are done.
+def _open_url(url, request_options=None, phase=None, routing_key=None, **kwargs):
+    endpoints = request_options.endpoints if request_options is not None else None
+    base_url = next((endpoint for endpoint, _ in endpoints or [] if url == endpoint or url.startswith(f'{endpoint}/')), None)
+    if base_url is None:
+        return _send_request(url, request_options, phase, **kwargs)
+
+    path = url[len(base_url):]
+    order = _endpoint_order(request_options, **{key: kwargs[key] for key in ('validate_certs', 'ca_path') if key in kwargs})
+    if routing_key is not None and request_options.follower_urls:
+        order = _follower_order(request_options.follower_urls, routing_key) + order
+    breaker = request_options.circuit_breaker_threshold > 0
+    failures = getattr(_request_failures, 'endpoints', None)
+    error = None
+    for endpoint in dict.fromkeys(order):
+        if breaker and not _circuit_breaker.allow(endpoint, request_options.circuit_breaker_reset_timeout):
+            display.vvv(f"Circuit of Conjur endpoint {endpoint} is open, skipping it")
+            continue
+        try:
+            response = _send_request(f'{endpoint}{path}', request_options, phase, **kwargs)
+        except (urllib_error.URLError, socket.timeout, ConnectionError, http.client.HTTPException) as err:
+            if not _is_endpoint_failure(err):
+                if breaker:
+                    _circuit_breaker.record_success(endpoint)
+                raise
+            display.v(f"Request to Conjur endpoint {endpoint} failed: {str(err)}")
+            _mark_endpoint_unhealthy(endpoint)
+            if breaker and failures is not None:
+                failures[endpoint] = request_options.circuit_breaker_threshold
+            elif breaker:
+                _circuit_breaker.record_failure(endpoint, request_options.circuit_breaker_threshold)
+            error = err
+            continue
+        if breaker:
+            _circuit_breaker.record_success(endpoint)
+            if failures is not None:
+                failures.pop(endpoint, None)
+        return response
+    if error is None:
+        raise AnsibleError(f"Conjur is unavailable: the circuit of {', '.join(dict.fromkeys(order))} is open")
+    raise error
+
+
+def _is_retryable(err):
+    """
+    Tells whether a failed request may succeed when sent again: connection errors,
+    timeouts, 429 and 5xx responses. Client errors such as 401, 403 or 404, name
+    resolution failures and certificate errors are returned immediately.
+    """
+    if isinstance(err, urllib_error.HTTPError):
+        return err.code == 429 or err.code >= 500
+    if isinstance(err, urllib_error.URLError):
+        err = err.reason
+    return isinstance(err, (ConnectionError, TimeoutError, socket.timeout, http.client.HTTPException))
+
+
+def _retry_after(err):
+    """
+    Returns the delay in seconds requested by the `Retry-After` header of an HTTP error, if any.
+    """
+    headers = getattr(err, 'headers', None)
+    value = headers.get('Retry-After') if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_date - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+def _backoff_delay(attempt, base_delay):
+    """
+    Exponential backoff with full jitter: a random delay of up to `base_delay * 2 ** (attempt - 1)`
+    seconds, capped at RETRY_MAX_DELAY.
+    """
+    return random.uniform(0, min(RETRY_MAX_DELAY, base_delay * 2 ** (attempt - 1)))
+
+
+def retry(retries, base_delay, retry_budget):
+    """
+    Custom retry decorator
+
+    Retries the decorated call when it fails with an error accepted by `_is_retryable`,
+    waiting between attempts as requested by `Retry-After` or otherwise with `_backoff_delay`.
+    Retrying stops once the next attempt would start after `retry_budget` seconds from the
+    first one, or after the deadline of the lookup. The `request_options` keyword argument of
+    the decorated call, when given, overrides the default values.
+
+    The endpoints which failed during the attempts and did not succeed later are reported to
+    the circuit breaker once the call completes, so that a retried request counts as a single
+    failure.
+
+    Args:
+        retries (int): Number of retries after the first attempt.
+        base_delay (float): Base of the exponential backoff, in seconds.
+        retry_budget (float): Maximum time spent retrying, in seconds.
+    """
+    def parameters_wrapper(target):
+        def decorator(*args, **kwargs):
+            request_options = kwargs.get('request_options')
+            max_retries = request_options.retries if request_options else retries
+            delay_base = request_options.retry_base_delay if request_options else base_delay
+            budget_end = monotonic() + (request_options.retry_budget if request_options else retry_budget)
+            # A decorated call made by another one belongs to the same request
+            outermost = getattr(_request_failures, 'endpoints', None) is None
+            if outermost:
+                _request_failures.endpoints = {}
+            attempt = 0
+            try:
+                while True:
+                    attempt += 1
+                    try:
+                        return target(*args, **kwargs)
+                    except (urllib_error.URLError, socket.timeout, ConnectionError, http.client.HTTPException) as err:
+                        if attempt > max_retries or not _is_retryable(err):
+                            raise
+                        delay = _retry_after(err)
+                        if delay is None:
+                            delay = _backoff_delay(attempt, delay_base)
+                        if monotonic() + delay > budget_end:
+                            display.v(f'Retry budget exhausted after {attempt} attempt(s)')
+                            raise
+                        if request_options and request_options.deadline is not None and time() + delay > request_options.deadline:
+                            display.v(f'Lookup deadline reached after {attempt} attempt(s)')
+                            raise
+                        display.v(f'Error encountered: {str(err)}. Retrying in {delay:.1f}s..')
+                        sleep(delay)
+            finally:
+                if outermost:
+                    failures, _request_failures.endpoints = _request_failures.endpoints, None
+                    for endpoint, threshold in failures.items():
+                        _circuit_breaker.record_failure(endpoint, threshold)
+        return decorator
+    return parameters_wrapper
+
+
+@retry(retries=DEFAULT_RETRIES, base_delay=DEFAULT_RETRY_BASE_DELAY, retry_budget=DEFAULT_RETRY_BUDGET)
+def _repeat_open_url(url, headers=None, method=None, validate_certs=True, ca_path=None, request_options=None,  # pylint: disable=too-many-arguments
+                     routing_key=None):
+    return _open_url(url,
+                     request_options=request_options,
+                     phase='fetch',
+                     routing_key=routing_key,
+                     headers=headers,
+                     method=method,
+                     validate_certs=validate_certs,
+                     ca_path=ca_path)
+
+
+# Retrieve Conjur variable using the temporary token
+def _fetch_conjur_variable(conjur_variable, token, conjur_url, account, validate_certs, cert_file,  # pylint: disable=too-many-arguments
+                           request_options=None):
+    token = b64encode(token)
+    # Get the telemetry header
+    encoded_telemetry = _telemetry_header()
+
+    headers = {
+        'Authorization': f'Token token="{token.decode("utf-8")}"',
+        'x-cybr-telemetry': encoded_telemetry
+    }
+
+    url = f'{conjur_url}/secrets/{account}/variable/{_encode_str(conjur_variable)}'
+    display.vvvv(f'Conjur Variable URL: {url}')
+
+    try:
+        response = _repeat_open_url(url,
+                                    headers=headers,
+                                    method='GET',
+                                    validate_certs=validate_certs,
+                                    ca_path=cert_file,
+                                    request_options=request_options,
+                                    routing_key=conjur_variable)
+    except urllib_error.HTTPError as err:
+        error = _variable_error(err.code, conjur_variable)
+        if error is None:
+            raise
+        raise error from err
+
+    if response.getcode() == 200:
+        display.vvvv(f'Conjur variable {conjur_variable} was successfully retrieved')
+        value = response.read().decode("utf-8")
+        return [value]
+    error = _variable_error(response.getcode(), conjur_variable)
+    if error is not None:
+        raise error
+
+    return {}
+
+
+def _variable_error(code, conjur_variable):
+    """
+    Returns the error reported for a variable request answered with `code`, or None
+    when the status is not one this plugin explains.
+    """
+    if code == 401:
+        return ConjurVariableException('Conjur request has invalid authorization credentials', conjur_variable, code)
+    if code == 403:
+        return ConjurVariableException(
+            f'The controlling host\'s Conjur identity does not have authorization to retrieve {conjur_variable}', conjur_variable, code
+        )
+    if code == 404:
+        return ConjurVariableException(f'The variable {conjur_variable} does not exist', conjur_variable, code)
+    return None
+
+
+def _batch_variable_chunks(conjur_variables, conjur_url, account, max_url_length):
+    """
+    Splits variable paths into groups whose batch secrets URL fits within `max_url_length`.
+
+    Each group is returned as a list of (variable path, fully qualified variable id) tuples.
+    A variable whose id alone exceeds the limit is still placed in a group of its own.
+    """
+    base_url = f'{conjur_url}/secrets?variable_ids='
+    chunks = []
+    chunk = []
+    url_length = len(base_url)
+    for conjur_variable in conjur_variables:
+        variable_id = f'{account}:variable:{conjur_variable}'
+        encoded_length = len(_encode_str(variable_id))
+        separator_length = 1 if chunk else 0
+        if chunk and url_length + separator_length + encoded_length > max_url_length:
+            chunks.append(chunk)
+            chunk = []
+            url_length = len(base_url)
+            separator_length = 0
+        chunk.append((conjur_variable, variable_id))
+        url_length += separator_length + encoded_length
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _fetch_conjur_variable_batch(chunk, token, conjur_url, validate_certs, cert_file, request_options=None):  # pylint: disable=too-many-arguments
+    """
+    Retrieves a group of variables with a single request to the batch secrets endpoint.
+
+    Args:
+        chunk (list): (variable path, fully qualified variable id) tuples, see `_batch_variable_chunks`.
+
+    Returns:
+        dict: Secret values keyed by variable path.
+    """
+    encoded_token = b64encode(token)
+    encoded_telemetry = _telemetry_header()
+
+    headers = {
+        'Authorization': f'Token token="{encoded_token.decode("utf-8")}"',
+        'x-cybr-telemetry': encoded_telemetry
+    }
+
+    variable_ids = ','.join(_encode_str(variable_id) for unused, variable_id in chunk)
+    url = f'{conjur_url}/secrets?variable_ids={variable_ids}'
+    display.vvvv(f'Conjur batch secrets URL: {url}')
+
+    variable_names = ', '.join(conjur_variable for conjur_variable, unused in chunk)
+    try:
+        response = _repeat_open_url(url,
+                                    headers=headers,
+                                    method='GET',
+                                    validate_certs=validate_certs,
+                                    ca_path=cert_file,
+                                    request_options=request_options)
+    except urllib_error.HTTPError as err:
+        if err.code == 401:
+            raise AnsibleError('Conjur request has invalid authorization credentials') from err
+        if err.code == 403:
+            raise ConjurBatchRetrievalException(
+                f'The controlling host\'s Conjur identity does not have authorization to retrieve one or more of: {variable_names}',
+                err.code
+            ) from err
+        if err.code == 404:
+            raise ConjurBatchRetrievalException(f'One or more of the variables {variable_names} does not exist', err.code) from err
+        if err.code == 406:
+            raise ConjurBatchRetrievalException(
+                f'One or more of the variables {variable_names} holds a binary value, which the batch secrets endpoint cannot return',
+                err.code
+            ) from err
+        raise
+
+    if response.getcode() != 200:
+        raise AnsibleError(f'Failed to retrieve variables {variable_names} (got {response.getcode()} response)')
+
+    try:
+        values = json.loads(response.read().decode("utf-8"))
+        values = {conjur_variable: values[variable_id] for conjur_variable, variable_id in chunk}
+    except (ValueError, KeyError, TypeError) as err:
+        raise AnsibleError(f'Failed to retrieve variables {variable_names} (unexpected response)') from err
+    display.vvvv(f'Conjur variables {variable_names} were successfully retrieved')
+    return values
+
+
+def _resolve_conjur_variable_batch(chunk, token, conjur_url, account, validate_certs, cert_file,  # pylint: disable=too-many-arguments
+                                   request_options=None):
+    """
+    Retrieves a group of variables through the batch secrets endpoint, isolating the variables
+    which make the batch fail.
+
+    A batch rejected because of some of its variables (403, 404, or 406 for binary values) is
+    split in halves which are retried recursively, so that k failing variables among n cost
+    O(k log n) requests. Groups reduced to a single variable are retrieved with
+    `_fetch_conjur_variable`, which returns binary values and reports the precise error.
+
+    Returns:
+        tuple: Secret values keyed by variable path, and `AnsibleError` instances keyed by the
+        path of each variable which could not be retrieved.
+    """
+    try:
+        return _fetch_conjur_variable_batch(chunk, token, conjur_url, validate_certs, cert_file, request_options), {}
+    except ConjurBatchRetrievalException as err:
+        display.vvv(f'Batch of {len(chunk)} Conjur variables failed with {err.code}, splitting it')
+        if len(chunk) == 1:
+            return _resolve_conjur_variable(chunk[0][0], token, conjur_url, account, validate_certs, cert_file, request_options)
+
+    values = {}
+    failures = {}
+    middle = len(chunk) // 2
+    for half in (chunk[:middle], chunk[middle:]):
+        if len(half) == 1:
+            half_values, half_failures = _resolve_conjur_variable(
+                half[0][0], token, conjur_url, account, validate_certs, cert_file, request_options
+            )
+        else:
+            half_values, half_failures = _resolve_conjur_variable_batch(
+                half, token, conjur_url, account, validate_certs, cert_file, request_options
+            )
+        values.update(half_values)
+        failures.update(half_failures)
+    return values, failures
+
+
+def _resolve_conjur_variable(conjur_variable, token, conjur_url, account, validate_certs, cert_file,  # pylint: disable=too-many-arguments
+                             request_options=None):
+    result = _fetch_conjur_variable_or_error(conjur_variable, token, conjur_url, account, validate_certs, cert_file, request_options)
+    if isinstance(result, AnsibleError):
+        return {}, {conjur_variable: result}
+    return {conjur_variable: result}, {}
+
+
+# Retrieve several Conjur variables through the batch secrets endpoint
+def _fetch_conjur_variables(conjur_variables, token, conjur_url, account, validate_certs, cert_file,  # pylint: disable=too-many-arguments
+                            max_url_length=4096, max_workers=DEFAULT_MAX_WORKERS, request_options=None):
+    """
+    Retrieves every variable in `conjur_variables` with as few batch requests as possible.
+
+    Duplicate paths are requested once. When the variable ids do not fit in a single URL of
+    `max_url_length` characters, the request is split in chunks which are issued in parallel.
+    A chunk rejected because of some of its variables is bisected with
+    `_resolve_conjur_variable_batch`, so the other variables are still retrieved.
+
+    Returns:
+        list: Secret values or `AnsibleError` instances for the variables which could not be
+        retrieved, in the same order as `conjur_variables`.
+    """
+    unique_variables = list(dict.fromkeys(conjur_variables))
+    chunks = _batch_variable_chunks(unique_variables, conjur_url, account, max_url_length)
+    display.vvv(f'Retrieving {len(unique_variables)} Conjur variables in {len(chunks)} batch request(s)')
+
+    def resolve(chunk):
+        return _resolve_conjur_variable_batch(chunk, token, conjur_url, account, validate_certs, cert_file, request_options)
+
+    values = {}
+    if len(chunks) == 1:
+        results = [resolve(chunks[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=min(len(chunks), max_workers)) as executor:
+            results = list(executor.map(resolve, chunks))
+    for chunk_values, chunk_failures in results:
+        values.update(chunk_values)
+        values.update(chunk_failures)
+    failed = [conjur_variable for conjur_variable in unique_variables if isinstance(values[conjur_variable], AnsibleError)]
+    if failed:
+        display.vvv(f'Conjur variables which could not be retrieved: {", ".join(failed)}')
+
+    return [values[conjur_variable] for conjur_variable in conjur_variables]
+
+
+def _fetch_conjur_variable_or_error(conjur_variable, token, conjur_url, account, validate_certs, cert_file,  # pylint: disable=too-many-arguments
+                                    request_options=None):
+    try:
+        return _fetch_conjur_variable(conjur_variable, token, conjur_url, account, validate_certs, cert_file, request_options)[0]
+    except AnsibleError as err:
+        return err
+    except (urllib_error.URLError, OSError, http.client.HTTPException, ValueError) as err:
+        return AnsibleError(f'Failed to retrieve {conjur_variable}: {str(err)}', orig_exc=err)
+
+
+def _fetch_conjur_variables_concurrently(conjur_variables, token, conjur_url, account, validate_certs, cert_file,  # pylint: disable=too-many-arguments
+                                         max_workers=DEFAULT_MAX_WORKERS, request_options=None):
+    """
+    Retrieves variables one by one with `_fetch_conjur_variable`, sending up to `max_workers`
+    requests at a time. All requests share the same access token, and the connection pool
+    when `request_options` enables it.
+
+    A variable which cannot be retrieved does not interrupt the others: its position in the
+    result holds the `AnsibleError` describing the failure instead of a value.
+
+    Returns:
+        list: Secret values or `AnsibleError` instances, in the same order as `conjur_variables`.
+    """
+    unique_variables = list(dict.fromkeys(conjur_variables))
+    display.vvv(f'Retrieving {len(unique_variables)} Conjur variables individually, {max_workers} at a time')
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(unique_variables), max_workers))) as executor:
+        results = executor.map(
+            lambda conjur_variable: _fetch_conjur_variable_or_error(
+                conjur_variable, token, conjur_url, account, validate_certs, cert_file, request_options
+            ),
+            unique_variables
+        )
+        values = dict(zip(unique_variables, results))
+
+    return [values[conjur_variable] for conjur_variable in conjur_variables]
 
 
-def retry(retries, retry_interval):
+def _raise_for_failed_variables(results, conjur_variables):
     """
-    Custom retry decorator
-
-    Args:
-        retries (int, optional): Number of retries. Defaults to 5.
-        retry_interval (int, optional): Time to wait between intervals. Defaults to 10.
+    Raises an error naming every variable whose result is an error, or returns `results`
+    unchanged when all variables were retrieved.
     """
-    def parameters_wrapper(target):
-        def decorator(*args, **kwargs):
-            retry_count = 0
-            while True:
-                retry_count += 1
-                try:
-                    return_value = target(*args, **kwargs)
-                    return return_value
-                except urllib_error.HTTPError as err:
-                    if retry_count >= retries:
-                        raise err
-                    display.v('Error encountered. Retrying..')
-                except socket.timeout as err:
-                    if retry_count >= retries:
-                        raise err
-                    display.v('Socket timeout encountered. Retrying..')
-                sleep(retry_interval)
-        return decorator
-    return parameters_wrapper
+    failures = {
+        conjur_variable: result for conjur_variable, result in zip(conjur_variables, results)
+        if isinstance(result, Exception)
+    }
+    if not failures:
+        return results
+    if len(failures) == 1:
+        raise next(iter(failures.values()))
+    details = '; '.join(f'{conjur_variable}: {error.message}' for conjur_variable, error in failures.items())
+    raise ConjurRetrievalException(f'Failed to retrieve {len(failures)} Conjur variables - {details}', failures)
+
+
+# Retrieve several Conjur variables, in batches or with individual requests
+def _retrieve_conjur_variables(conjur_variables, token, conjur_url, account, validate_certs, cert_file,  # pylint: disable=too-many-arguments
+                               batch_retrieval=True, max_url_length=4096, max_workers=DEFAULT_MAX_WORKERS,
+                               request_options=None):
+    """
+    Retrieves several variables through the batch secrets endpoint, or individually with
+    `_fetch_conjur_variables_concurrently` when `batch_retrieval` is disabled.
 
+    Returns:
+        list: Secret values, in the same order as `conjur_variables`.
 
-@retry(retries=5, retry_interval=10)
-def _repeat_open_url(url, headers=None, method=None, validate_certs=True, ca_path=None):
-    return open_url(url,
-                    headers=headers,
-                    method=method,
-                    validate_certs=validate_certs,
-                    ca_path=ca_path)
+    Raises:
+        AnsibleError: Naming every variable which could not be retrieved.
+    """
+    if batch_retrieval:
+        results = _fetch_conjur_variables(
+            conjur_variables, token, conjur_url, account, validate_certs, cert_file,
+            max_url_length=max_url_length, max_workers=max_workers, request_options=request_options
+        )
+    else:
+        results = _fetch_conjur_variables_concurrently(
+            conjur_variables, token, conjur_url, account, validate_certs, cert_file,
+            max_workers=max_workers, request_options=request_options
+        )
+    return _raise_for_failed_variables(results, conjur_variables)
 
 
-# Retrieve Conjur variable using the temporary token
-def _fetch_conjur_variable(conjur_variable, token, conjur_url, account, validate_certs, cert_file):  # pylint: disable=too-many-arguments
-    token = b64encode(token)
-    # Get the telemetry header
-    encoded_telemetry = _telemetry_header()
+class _SecretCache:
+    """
+    In-memory cache of secret values, shared by the lookups of a process.
 
-    headers = {
-        'Authorization': f'Token token="{token.decode("utf-8")}"',
-        'x-cybr-telemetry': encoded_telemetry
-    }
+    Values are stored per scope, the identity they were retrieved with (see
+    `_token_cache_key`), and variable path. Entries expire after the TTL given
+    when they were stored, and the least recently used entries are evicted when the
+    cache grows beyond its maximum size. Values are kept in bytearrays which are
+    overwritten with zeros when their entry expires or is evicted.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _discard(entry):
+        value = entry[0]
+        value[:] = b"\x00" * len(value)
+
+    def get_many(self, scope, conjur_variables):
+        """
+        Returns the unexpired cached values among `conjur_variables`, keyed by variable path.
+        """
+        now = time()
+        values = {}
+        with self._lock:
+            for conjur_variable in conjur_variables:
+                key = (scope, conjur_variable)
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[1] <= now:
+                    self._discard(self._entries.pop(key))
+                    continue
+                self._entries.move_to_end(key)
+                values[conjur_variable] = entry[0].decode('utf-8')
+        return values
+
+    def put_many(self, scope, values, ttl, max_entries):
+        """
+        Stores `values`, a dictionary of secret values keyed by variable path, for `ttl` seconds,
+        then evicts the least recently used entries beyond `max_entries`.
+        """
+        expires_at = time() + ttl
+        with self._lock:
+            for conjur_variable, value in values.items():
+                key = (scope, conjur_variable)
+                if key in self._entries:
+                    self._discard(self._entries.pop(key))
+                self._entries[key] = (bytearray(value.encode('utf-8')), expires_at)
+            while len(self._entries) > max(max_entries, 0):
+                self._discard(self._entries.popitem(last=False)[1])
+
+    def clear(self):
+        with self._lock:
+            for entry in self._entries.values():
+                self._discard(entry)
+            self._entries.clear()
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+
+class _NegativeCache:
+    """
+    Cache of the variables Conjur refused to return with a 403 or 404 response, shared by
+    the workers of the current user through a file per scope in the plugin state directory.
 
-    url = f'{conjur_url}/secrets/{account}/variable/{_encode_str(conjur_variable)}'
-    display.vvvv(f'Conjur Variable URL: {url}')
+    Scopes are the same as those of `_SecretCache`. Entries only hold the status code of the
+    refusal, keyed by a digest of the variable path, until they expire: the error is rebuilt
+    from the requested path, so that no variable path is written to the file.
+    """
+    CODES = (403, 404)
 
-    response = _repeat_open_url(url,
-                                headers=headers,
-                                method='GET',
-                                validate_certs=validate_certs,
-                                ca_path=cert_file)
+    @staticmethod
+    def _path(scope):
+        state_dir = _state_dir()
+        if state_dir is None:
+            return None
+        return os.path.join(state_dir, f"negative-{hashlib.sha256(repr(scope).encode('utf-8')).hexdigest()[:32]}.json")
 
-    if response.getcode() == 200:
-        display.vvvv(f'Conjur variable {conjur_variable} was successfully retrieved')
-        value = response.read().decode("utf-8")
-        return [value]
-    if response.getcode() == 401:
-        raise AnsibleError('Conjur request has invalid authorization credentials')
-    if response.getcode() == 403:
-        raise AnsibleError(f'The controlling host\'s Conjur identity does not have authorization to retrieve {conjur_variable}')
-    if response.getcode() == 404:
-        raise AnsibleError(f'The variable {conjur_variable} does not exist')
+    @staticmethod
+    def _key(conjur_variable):
+        return hashlib.sha256(conjur_variable.encode('utf-8')).hexdigest()
 
-    return {}
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as cache_file:
+                entries = json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(entries, dict):
+            return {}
+        now = time()
+        # Malformed entries are misses, rewritten by the next refusal
+        return {
+            key: entry for key, entry in entries.items()
+            if isinstance(entry, dict) and isinstance(entry.get('expires_at'), (int, float)) and entry['expires_at'] > now
+        }
+
+    def get_many(self, scope, conjur_variables):
+        """
+        Returns the unexpired refusals among `conjur_variables`, as `ConjurVariableException`
+        instances keyed by variable path.
+        """
+        path = self._path(scope)
+        if path is None:
+            return {}
+        entries = self._read(path)
+        errors = {}
+        for conjur_variable in conjur_variables:
+            entry = entries.get(self._key(conjur_variable))
+            if entry is not None and entry.get('code') in self.CODES:
+                errors[conjur_variable] = _variable_error(entry['code'], conjur_variable)
+        return errors
+
+    def put_many(self, scope, errors, ttl):
+        """
+        Stores the errors of `errors`, keyed by variable path, which are refusals with a 403
+        or 404 response for `ttl` seconds.
+        """
+        refusals = {
+            conjur_variable: error for conjur_variable, error in errors.items()
+            if isinstance(error, ConjurVariableException) and error.code in self.CODES
+        }
+        path = self._path(scope)
+        if not refusals or path is None:
+            return
+        expires_at = time() + ttl
+        with _file_lock(f'{path}.lock'):
+            entries = self._read(path)
+            for conjur_variable, error in refusals.items():
+                entries[self._key(conjur_variable)] = {'code': error.code, 'expires_at': expires_at}
+            with NamedTemporaryFile('w', dir=os.path.dirname(path), prefix='.negative-', delete=False) as cache_file:
+                json.dump(entries, cache_file)
+            os.replace(cache_file.name, path)
 
 
 def _default_tmp_path():
@@ -801,61 +3260,192 @@ def _default_tmp_path():
     return gettempdir()
 
 
+def _state_dir():
+    """
+    Returns the directory in which the plugin keeps state shared between lookups, forks
+    and runs of the same user, creating it if needed.
+
+    The directory lives under `_default_tmp_path()` and is only accessible by the current
+    user. Returns None when an existing directory with that name is not a directory
+    owned by the current user with user-only permissions, so that state is never read
+    from or written to a location another user could have prepared.
+    """
+    path = os.path.join(_default_tmp_path(), f'ansible-conjur-{os.getuid()}')
+    try:
+        os.mkdir(path, S_IRWXU)
+    except FileExistsError:
+        pass
+    except OSError as err:
+        display.warning(f"Unable to create plugin state directory {path}: {str(err)}")
+        return None
+
+    stat_result = os.lstat(path)
+    if not S_ISDIR(stat_result.st_mode) or stat_result.st_uid != os.getuid() or stat_result.st_mode & (S_IRWXG | S_IRWXO):
+        display.warning(f"Ignoring plugin state directory {path}: it must be a directory accessible only by the current user")
+        return None
+    return path
+
+
 def _store_secret_in_file(value):
     """
-    Writes a secret value to a secure temporary file and returns its path.
+    Writes each secret value to a secure temporary file and returns their paths.
 
-    The file is created in /dev/shm or /tmp (based on `_default_tmp_path()`),
-    with user-only read/write permissions. `delete=False` ensures the file
-    persists beyond this function, as it needs to be accessible later.
+    The files are created in /dev/shm or /tmp (based on `_default_tmp_path()`),
+    with user-only read/write permissions. `delete=False` ensures the files
+    persist beyond this function, as they need to be accessible later.
 
     Note: We avoid using a `with` statement here to prevent premature file
     closure or deletion, which would make the file unusable.
 
     Args:
-        value (list): List containing the secret string.
+        value (list): List containing the secret strings.
 
     Returns:
-        list: Path to the temporary file as a single-item list.
+        list: Paths to the temporary files, in the same order as `value`.
     """
-    secrets_file = NamedTemporaryFile(mode='w', dir=_default_tmp_path(), delete=False)  # pylint: disable=consider-using-with
-    os.chmod(secrets_file.name, S_IRUSR | S_IWUSR)
-    secrets_file.write(value[0])
-    return [secrets_file.name]
+    paths = []
+    for secret in value:
+        secrets_file = NamedTemporaryFile(mode='w', dir=_default_tmp_path(), delete=False)  # pylint: disable=consider-using-with
+        os.chmod(secrets_file.name, S_IRUSR | S_IWUSR)
+        secrets_file.write(secret)
+        secrets_file.close()
+        paths.append(secrets_file.name)
+    return paths
 
 
-# Fetch token from aure vm, func, app and authn with conjur for access token
-def _fetch_conjur_azure_token(
-    appliance_url, account, service_id,
-    host_id, cert_file, validate_certs, client_id=""
-):
+def _jwt_expiration(jwt):
+    """
+    Returns the `exp` claim of a JSON Web Token as a Unix timestamp, or None when it cannot be read.
+    """
     try:
-        params = {
-            "api-version": "2018-02-01",
-            "resource": "https://management.azure.com/"
-        }
+        payload = jwt.split('.')[1]
+        return float(json.loads(urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))['exp'])
+    except (IndexError, ValueError, KeyError, TypeError):
+        return None
 
-        if client_id:
-            params["client_id"] = client_id
 
-        headers = {
-            "Metadata": "true"
-        }
-        url_with_params = f"{AZURE_METADATA_URL}?{urllib.parse.urlencode(params)}"
-        response = open_url(
-            url_with_params,
-            method='GET',
-            headers=headers,
-            validate_certs=validate_certs,
-            timeout=10
-        )
+@retry(retries=DEFAULT_RETRIES, base_delay=DEFAULT_RETRY_BASE_DELAY, retry_budget=DEFAULT_RETRY_BUDGET)
+def _get_azure_identity_token(client_id="", validate_certs=True, request_options=None):
+    """
+    Retrieves a managed identity access token from the Azure instance metadata service.
 
-        response_body = response.read().decode('utf-8')
-        # Parse JSON response
-        data = json.loads(response_body)
+    Tokens are cached per client id until shortly before their `expires_on` time, so that
+    lookups do not run into the rate limits of the metadata service.
+    """
+    cache_key = ('azure_token', client_id or '')
+    access_token = _get_cached_metadata_value(cache_key)
+    if access_token is not None:
+        return access_token
+
+    params = {
+        "api-version": "2018-02-01",
+        "resource": "https://management.azure.com/"
+    }
 
-        if response.getcode() != 200:
-            raise AnsibleError(f"Error retrieving token from azure: {str(response.getcode())}")
+    if client_id:
+        params["client_id"] = client_id
+
+    headers = {
+        "Metadata": "true"
+    }
+    url_with_params = f"{AZURE_METADATA_URL}?{urllib.parse.urlencode(params)}"
+    response = _open_url(
+        url_with_params,
+        request_options=request_options,
+        phase='metadata',
+        method='GET',
+        headers=headers,
+        validate_certs=validate_certs
+    )
+
+    response_body = response.read().decode('utf-8')
+    # Parse JSON response
+    data = json.loads(response_body)
+
+    if response.getcode() != 200:
+        raise AnsibleError(f"Error retrieving token from azure: {str(response.getcode())}")
+
+    access_token = data.get('access_token')
+    try:
+        expires_on = float(data['expires_on'])
+    except (KeyError, TypeError, ValueError):
+        expires_on = None
+    if access_token and expires_on is not None:
+        _cache_metadata_value(cache_key, access_token, expires_on - METADATA_CACHE_MARGIN)
+    return access_token
+
+
+@retry(retries=DEFAULT_RETRIES, base_delay=DEFAULT_RETRY_BASE_DELAY, retry_budget=DEFAULT_RETRY_BUDGET)
+def _get_gcp_identity_token(account, host_id, validate_certs=True, request_options=None):
+    """
+    Retrieves an identity token for the Conjur audience of `host_id` from the GCP metadata server.
+
+    Tokens are cached per audience until shortly before their `exp` claim.
+    """
+    audience = f'conjur/{account}/{host_id}'
+    cache_key = ('gcp_token', audience)
+    identity_token = _get_cached_metadata_value(cache_key)
+    if identity_token is not None:
+        return identity_token
+
+    params = {
+        'audience': audience,
+        'format': 'full'
+    }
+    headers = {'Metadata-Flavor': 'Google'}
+
+    url_with_params = f"{GCP_METADATA_URL}?{urllib.parse.urlencode(params)}"
+
+    response = _open_url(
+        url_with_params,
+        request_options=request_options,
+        phase='metadata',
+        method='GET',
+        headers=headers,
+        validate_certs=validate_certs
+    )
+
+    if response.getcode() != 200:
+        raise AnsibleError(f"Error retrieving token from gcp: {str(response.getcode())}")
+
+    identity_token = response.read().decode('utf-8')
+    expires_at = _jwt_expiration(identity_token)
+    if expires_at is not None:
+        _cache_metadata_value(cache_key, identity_token, expires_at - METADATA_CACHE_MARGIN)
+    return identity_token
+
+
+@retry(retries=DEFAULT_RETRIES, base_delay=DEFAULT_RETRY_BASE_DELAY, retry_budget=DEFAULT_RETRY_BUDGET)
+def _post_conjur_jwt(url, jwt, validate_certs, cert_file, request_options=None):
+    """
+    Sends a cloud identity token to a Conjur JWT based authenticator and returns the response.
+    """
+    # Get the telemetry header
+    encoded_telemetry = _telemetry_header()
+
+    # Prepare headers
+    headers = {
+        'x-cybr-telemetry': encoded_telemetry
+    }
+    return _open_url(
+        url,
+        request_options=request_options,
+        phase='authenticate',
+        method='POST',
+        data=f"jwt={jwt}".encode('utf-8'),
+        headers=headers,
+        validate_certs=validate_certs,
+        ca_path=cert_file
+    )
+
+
+# Fetch token from aure vm, func, app and authn with conjur for access token
+def _fetch_conjur_azure_token(
+    appliance_url, account, service_id,
+    host_id, cert_file, validate_certs, client_id="", request_options=None
+):
+    try:
+        access_token = _get_azure_identity_token(client_id, validate_certs, request_options=request_options)
 
         appliance_url = appliance_url.rstrip("/")
         url = (
@@ -863,24 +3453,7 @@ def _fetch_conjur_azure_token(
             f"{urllib.parse.quote(host_id, safe='')}/authenticate"
         )
 
-        token = f"jwt={data.get('access_token')}"
-
-        # Get the telemetry header
-        encoded_telemetry = _telemetry_header()
-
-        # Prepare headers
-        headers = {
-            'x-cybr-telemetry': encoded_telemetry
-        }
-        response = open_url(
-            url,
-            method='POST',
-            data=token.encode('utf-8'),
-            headers=headers,
-            validate_certs=validate_certs,
-            ca_path=cert_file,
-            timeout=10
-        )
+        response = _post_conjur_jwt(url, access_token, validate_certs, cert_file, request_options=request_options)
         if response.getcode() != 200:
             raise AnsibleError(f"Error authenticating with Conjur: HTTP {str(response.getcode())}")
         return response.read()
@@ -895,55 +3468,19 @@ def _fetch_conjur_azure_token(
         raise AnsibleError(f"Error fetching identity token: {str(error)}") from error
     finally:
         client_id = None
-        token = None
-        response_body = None
+        access_token = None
 
 
 def _fetch_conjur_gcp_identity_token(
-    appliance_url, account, host_id, cert_file, validate_certs
+    appliance_url, account, host_id, cert_file, validate_certs, request_options=None
 ):
     try:
-        params = {
-            'audience': f'conjur/{account}/{host_id}',
-            'format': 'full'
-        }
-        headers = {'Metadata-Flavor': 'Google'}
-
-        url_with_params = f"{GCP_METADATA_URL}?{urllib.parse.urlencode(params)}"
-
-        response = open_url(
-            url_with_params,
-            method='GET',
-            headers=headers,
-            validate_certs=validate_certs,
-            timeout=10
-        )
+        identity_token = _get_gcp_identity_token(account, host_id, validate_certs, request_options=request_options)
 
-        if response.getcode() != 200:
-            raise AnsibleError(f"Error retrieving token from gcp: {str(response.getcode())}")
-
-        response_body = response.read().decode('utf-8')
         appliance_url = appliance_url.rstrip("/")
         url = f"{appliance_url}/authn-gcp/{account}/authenticate"
 
-        token = f"jwt={response_body}"
-
-        # Get the telemetry header
-        encoded_telemetry = _telemetry_header()
-
-        # Prepare headers
-        headers = {
-            'x-cybr-telemetry': encoded_telemetry
-        }
-        response = open_url(
-            url,
-            method='POST',
-            data=token.encode('utf-8'),
-            headers=headers,
-            validate_certs=validate_certs,
-            ca_path=cert_file,
-            timeout=10
-        )
+        response = _post_conjur_jwt(url, identity_token, validate_certs, cert_file, request_options=request_options)
         if response.getcode() != 200:
             raise AnsibleError(f"Error: Received status code {str(response.getcode())}")
 
@@ -957,8 +3494,447 @@ def _fetch_conjur_gcp_identity_token(
     except Exception as error:
         raise AnsibleError(f"Error fetching identity token: {str(error)}") from error
     finally:
+        identity_token = None
+
+
+class _SingleFlight:
+    """
+    Runs a single call per key at a time: callers asking for a key whose call is already
+    in progress wait for it and receive its result, or its exception, instead of calling again.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function, deadline=None):
+        """
+        Returns the result of `function()`, shared with the concurrent callers of the same `key`.
+        A caller waiting for the call of another one gives up at `deadline`, a wall clock time.
+
+        Raises:
+            AnsibleError: The deadline passed before the call in progress completed.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        if not leader:
+            try:
+                return future.result(None if deadline is None else max(deadline - time(), 0))
+            except FuturesTimeoutError:
+                if future.done():
+                    raise
+                raise AnsibleError("The Conjur lookup deadline was exceeded") from None
+
+        try:
+            result = function()
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+
+_connection_pool = _ConnectionPool()
+_secret_cache = _SecretCache()
+_negative_cache = _NegativeCache()
+_single_flight = _SingleFlight()
+_token_refresher = _TokenRefresher()
+_circuit_breaker = _CircuitBreaker()
+_rate_limiter = _RateLimiter()
+
+
+def _after_fork_in_child():
+    """
+    Ansible forks a worker process per task. A lock held by another thread of the
+    parent at fork time would never be released in the child, so every lock is
+    replaced, calls in flight in the parent are forgotten, and pooled connections are
+    dropped as they belong to the parent.
+    """
+    global _options_lock, _telemetry_header_lock, _token_cache_lock, _ca_bundle_lock, _metadata_cache_lock, _endpoint_lock
+    _options_lock = threading.Lock()
+    _telemetry_header_lock = threading.Lock()
+    _token_cache_lock = threading.Lock()
+    _ca_bundle_lock = threading.Lock()
+    _metadata_cache_lock = threading.Lock()
+    _endpoint_lock = threading.Lock()
+    _connection_pool.after_fork()
+    _secret_cache.after_fork()
+    _single_flight.after_fork()
+    _token_refresher.after_fork()
+    _circuit_breaker.after_fork()
+    _rate_limiter.after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _lookup_token(settings, token_cache_key, request_options):
+    """
+    Returns the access token for a lookup: read from the configured token file, or taken
+    from the token caches and otherwise obtained by authenticating.
+
+    Concurrent lookups needing a new token for the same `token_cache_key` share a single
+    authentication. With `shared_token_cache`, the workers of the controller run also share it.
+    """
+    conf = settings['conf']
+    if 'authn_token_file' in conf:
+        if not os.path.exists(conf['authn_token_file']):
+            raise AnsibleError(f"Conjur authn token file `{conf['authn_token_file']}` was not found on the host")
+        with open(conf['authn_token_file'], 'rb') as file:
+            return file.read()
+
+    display.vvv(f"Using auth_type as {settings['authn_type']}")
+    margin = settings['token_cache_margin']
+    token = _get_cached_token(token_cache_key, margin)
+    if token is not None:
+        display.vvv("Reusing cached Conjur access token")
+        _token_refresher.mark_used(token_cache_key)
+        return token
+
+    def renew_token(renew_margin, options):
+        def authenticate():
+            return _authenticate(
+                conf, settings['identity'], settings['authn_type'], settings['service_id'], settings['azure_client_id'],
+                settings['validate_certs'], settings['cert_file'], options, settings['aws_sts_region']
+            )
+
+        if settings['shared_token_cache']:
+            token = _get_shared_token(token_cache_key, renew_margin, authenticate, settings['run_id'], options.deadline)
+        else:
+            token = authenticate()
+        _cache_token(token_cache_key, token)
+        if settings['token_refresh_fraction']:
+            # The current token stays cached, and served, until the renewed one replaces it.
+            # Background refreshes outlive the lookup and are not bound by its deadline.
+            background_options = options.without_deadline()
+            _token_refresher.schedule(
+                token_cache_key, token, settings['token_refresh_fraction'],
+                lambda due_margin: _single_flight.do(('token', token_cache_key), lambda: renew_token(due_margin, background_options))
+            )
+        return token
+
+    def refresh_token():
+        # The token may have been cached by a concurrent lookup since it was last looked up
+        token = _get_cached_token(token_cache_key, margin)
+        if token is None:
+            token = renew_token(margin, request_options)
+        return token
+
+    return _single_flight.do(('token', token_cache_key), refresh_token, request_options.deadline)
+
+
+def _lookup_values(terms, settings):
+    """
+    Retrieves the values of `terms` with the configuration resolved by `LookupModule.run`,
+    authenticating and using the token and secret caches as configured.
+
+    `settings` only holds JSON serializable values, so that the same lookup can be performed
+    by the broker process on behalf of a worker. The broker sets `run_id` to the controller run
+    it serves, which is not the parent of its process.
+
+    Returns:
+        dict: Secret values keyed by variable path.
+    """
+    conf = settings['conf']
+    validate_certs = settings['validate_certs']
+    cert_file = settings['cert_file']
+    request_options = _RequestOptions(**settings['request_options'])
+
+    token_cache_key = None
+    if 'authn_token_file' not in conf:
+        token_cache_key = _token_cache_key(
+            conf['appliance_url'], conf['account'], settings['identity'], settings['authn_type'],
+            settings['service_id'], settings['azure_client_id']
+        )
+    secret_cache_scope = token_cache_key or (conf['appliance_url'], conf['account'], 'authn_token_file', conf['authn_token_file'])
+
+    values = _secret_cache.get_many(secret_cache_scope, terms) if settings['secret_cache'] else {}
+    missing_terms = [term for term in dict.fromkeys(terms) if term not in values]
+    if values:
+        display.vvv(f"Using cached values for {len(values)} Conjur variable(s)")
+
+    if missing_terms and settings['negative_cache_ttl']:
+        refusals = _negative_cache.get_many(secret_cache_scope, missing_terms)
+        if refusals:
+            display.vvv(f"Using cached errors for {len(refusals)} Conjur variable(s)")
+            _raise_for_failed_variables([refusals.get(term) for term in missing_terms], missing_terms)
+
+    def fetch_missing_terms():
+        if settings['health_check']:
+            _preflight(request_options, validate_certs, cert_file, settings['health_check_ttl'])
         token = None
-        response_body = None
+        try:
+            token = _lookup_token(settings, token_cache_key, request_options)
+            if len(missing_terms) == 1:
+                fetched_values = _fetch_conjur_variable(
+                    missing_terms[0],
+                    token,
+                    conf['appliance_url'],
+                    conf['account'],
+                    validate_certs,
+                    cert_file,
+                    request_options
+                )
+            else:
+                fetched_values = _retrieve_conjur_variables(
+                    missing_terms,
+                    token,
+                    conf['appliance_url'],
+                    conf['account'],
+                    validate_certs,
+                    cert_file,
+                    batch_retrieval=settings['batch_retrieval'],
+                    max_url_length=settings['batch_max_url_length'],
+                    max_workers=settings['max_workers'],
+                    request_options=request_options
+                )
+        except ConjurVariableException as err:
+            if settings['negative_cache_ttl']:
+                _negative_cache.put_many(secret_cache_scope, {err.conjur_variable: err}, settings['negative_cache_ttl'])
+            raise
+        except ConjurRetrievalException as err:
+            if settings['negative_cache_ttl']:
+                _negative_cache.put_many(secret_cache_scope, err.failures, settings['negative_cache_ttl'])
+            raise
+        finally:
+            if isinstance(token, bytes):
+                token = b"\x00" * len(token)
+            else:
+                token = None
+
+        fetched = dict(zip(missing_terms, fetched_values))
+        if settings['secret_cache']:
+            _secret_cache.put_many(secret_cache_scope, fetched, settings['secret_cache_ttl'], settings['secret_cache_max_entries'])
+        return fetched
+
+    if missing_terms:
+        # Concurrent lookups of the same variables with the same identity share a single retrieval
+        values.update(_single_flight.do(
+            ('variables', secret_cache_scope, tuple(missing_terms)), fetch_missing_terms, request_options.deadline
+        ))
+
+    return values
+
+
+def _peer_uid(connection):
+    """
+    Returns the user id of the process connected to a Unix socket, or the current user id
+    on platforms which do not report peer credentials; the socket directory is private there.
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return os.getuid()
+    credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', credentials)[1]
+
+
+class _BrokerRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Serves one lookup sent by a worker: a JSON line holding the terms and the settings of
+    `_lookup_values`, answered with a JSON line holding the values or the error message.
+    """
+    def handle(self):
+        if _peer_uid(self.request) != os.getuid():
+            return
+        self.server.begin_request()
+        try:
+            line = self.rfile.readline()
+            key = hashlib.sha256(line).hexdigest()
+            request = json.loads(line)
+            request['settings']['request_options']['connection_pooling'] = True
+            request['settings']['run_id'] = self.server.run_id
+            try:
+                values = self.server.single_flight.do(key, lambda: _lookup_values(request['terms'], request['settings']))
+                response = {'values': values}
+            except AnsibleError as err:
+                response = {'error': err.message}
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                response = {'error': f'Conjur secret broker failed to retrieve secrets: {str(err)}'}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+        finally:
+            self.server.end_request()
+
+
+class _BrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Broker process serving the lookups of the workers of one controller run over a Unix socket.
+
+    Identical requests received while one is in progress are coalesced. The server stops after
+    `idle_timeout` seconds without requests, or once the controller run has ended.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, run_id, idle_timeout):
+        socketserver.UnixStreamServer.__init__(self, socket_path, _BrokerRequestHandler)
+        self.run_id = run_id
+        self.idle_timeout = idle_timeout
+        self.single_flight = _SingleFlight()
+        self._activity_lock = threading.Lock()
+        self._active_requests = 0
+        self._last_activity = monotonic()
+
+    def begin_request(self):
+        with self._activity_lock:
+            self._active_requests += 1
+
+    def end_request(self):
+        with self._activity_lock:
+            self._active_requests -= 1
+            self._last_activity = monotonic()
+
+    def watch(self):
+        """
+        Shuts the server down once it has been idle for `idle_timeout` seconds or the controller
+        run has ended. Meant to run in its own thread.
+        """
+        controller_pid = int(self.run_id.split('-', 1)[0])
+        while True:
+            sleep(min(1.0, self.idle_timeout))
+            with self._activity_lock:
+                idle = self._active_requests == 0 and monotonic() - self._last_activity >= self.idle_timeout
+            if idle or _controller_run_id(controller_pid) != self.run_id:
+                self.shutdown()
+                return
+
+
+def _run_broker(socket_path, run_id, idle_timeout):
+    """
+    Serves lookups on `socket_path` until the broker is idle or the controller run has ended.
+    """
+    _remove_file(socket_path)
+    server = _BrokerServer(socket_path, run_id, idle_timeout)
+    os.chmod(socket_path, S_IRUSR | S_IWUSR)
+    socket_inode = os.stat(socket_path).st_ino
+    threading.Thread(target=server.watch, daemon=True).start()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        try:
+            if os.stat(socket_path).st_ino == socket_inode:
+                os.unlink(socket_path)
+        except OSError:
+            pass
+
+
+def _connect_broker(socket_path):
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        connection.close()
+        return None
+    connection.settimeout(BROKER_REQUEST_TIMEOUT)
+    return connection
+
+
+def _spawn_broker(socket_path, run_id, idle_timeout):
+    """
+    Starts a broker process for the current controller run and waits until it accepts
+    connections. The broker runs this file as a script in its own session, so that it
+    outlives the worker which started it.
+    """
+    display.vvv(f"Starting Conjur secret broker on {socket_path}")
+    subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, os.path.abspath(__file__), 'broker', socket_path, run_id, str(idle_timeout)],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        cwd='/', start_new_session=True, close_fds=True
+    )
+    deadline = monotonic() + BROKER_START_TIMEOUT
+    while monotonic() < deadline:
+        connection = _connect_broker(socket_path)
+        if connection is not None:
+            return connection
+        sleep(0.05)
+    raise OSError(f'the broker did not start within {BROKER_START_TIMEOUT} seconds')
+
+
+def _broker_timeout(request_options):
+    """
+    Returns how long a worker waits for the answer of the broker: the time left before the
+    deadline of the lookup or, when it has none, the retry budget of the lookup plus the sum
+    of its phase timeouts, so that the broker has the time to complete a retried retrieval.
+
+    Raises:
+        AnsibleError: The deadline of the lookup has passed.
+    """
+    if request_options.get('deadline') is not None:
+        timeout = request_options['deadline'] - time()
+        if timeout <= 0:
+            raise AnsibleError("The Conjur lookup deadline was exceeded")
+    else:
+        timeouts = {**DEFAULT_TIMEOUTS, **(request_options.get('timeouts') or {})}
+        timeout = request_options.get('retry_budget', DEFAULT_RETRY_BUDGET) + sum(
+            connect_timeout + read_timeout for connect_timeout, read_timeout in timeouts.values()
+        )
+    return min(timeout, BROKER_REQUEST_TIMEOUT)
+
+
+def _query_broker(terms, settings, idle_timeout):
+    """
+    Retrieves the values of `terms` through the broker of the current controller run,
+    starting it if needed. Only one worker starts the broker, under a file lock.
+
+    Returns:
+        dict: Secret values keyed by variable path, or None when the broker cannot be started,
+        connected to, or closes the connection without answering.
+
+    Raises:
+        AnsibleError: The broker failed to retrieve the secrets or did not answer in time. The
+        worker does not retrieve them itself then, as the broker may still be doing so.
+    """
+    state_dir = _state_dir()
+    if state_dir is None:
+        return None
+    run_id = _controller_run_id()
+    socket_path = os.path.join(state_dir, f'broker-{run_id}.sock')
+    request = json.dumps({'terms': terms, 'settings': settings}, sort_keys=True).encode('utf-8') + b'\n'
+    timeout = _broker_timeout(settings['request_options'])
+
+    try:
+        connection = _connect_broker(socket_path)
+        if connection is None:
+            with _file_lock(f'{socket_path}.lock'):
+                connection = _connect_broker(socket_path) or _spawn_broker(socket_path, run_id, idle_timeout)
+    except OSError as err:
+        display.warning(f"Conjur secret broker is not available, retrieving secrets directly: {str(err)}")
+        return None
+
+    with connection:
+        try:
+            connection.settimeout(timeout)
+            connection.sendall(request)
+            with connection.makefile('rb') as response_file:
+                line = response_file.readline()
+        except socket.timeout as err:
+            raise AnsibleError(f"Conjur secret broker did not answer within {timeout:.1f} seconds") from err
+        except (BrokenPipeError, ConnectionResetError):
+            line = b''
+        except OSError as err:
+            raise AnsibleError(f"Conjur secret broker failed to answer: {str(err)}") from err
+    if not line:
+        # A broker shutting down once idle closes the connections it has not served
+        display.warning("Conjur secret broker closed the connection, retrieving secrets directly")
+        return None
+    try:
+        response = json.loads(line)
+    except ValueError as err:
+        raise AnsibleError(f"Conjur secret broker sent an invalid answer: {str(err)}") from err
+
+    if 'error' in response:
+        raise AnsibleError(response['error'])
+    display.vvv(f"Retrieved {len(response['values'])} Conjur variable(s) through the secret broker")
+    return response['values']
 
 
 class LookupModule(LookupBase):
@@ -966,8 +3942,9 @@ class LookupModule(LookupBase):
     def run(self, terms, variables=None, **kwargs):  # pylint: disable=too-many-locals,missing-function-docstring,too-many-branches,too-many-statements
         if terms == []:
             raise AnsibleError("Invalid secret path: no secret path provided.")
-        if not terms[0] or terms[0].isspace():
-            raise AnsibleError("Invalid secret path: empty secret path not accepted.")
+        for term in terms:
+            if not term or term.isspace():
+                raise AnsibleError("Invalid secret path: empty secret path not accepted.")
 
         # We should register the variables as LookupModule options.
         #
@@ -979,22 +3956,66 @@ class LookupModule(LookupBase):
         # behavior described in the DOCUMENTATION variable. An option can have
         # both a Ansible variable and environment variable source, which means
         # Ansible will do some juggling on our behalf.
-        self.set_options(var_options=variables, direct=kwargs)
-
-        appliance_url = self.get_var_value("conjur_appliance_url")
-        account = self.get_var_value("conjur_account")
-        authn_login = self.get_var_value("conjur_authn_login")
-        authn_api_key = self.get_var_value("conjur_authn_api_key")
-        cert_file = self.get_var_value("conjur_cert_file")
-        cert_content = self.get_var_value("conjur_cert_content")
-        authn_token_file = self.get_var_value("conjur_authn_token_file")
-        authn_type = self.get_var_value("conjur_authn_type")
-        service_id = self.get_var_value("conjur_authn_service_id")
-        azure_client_id = self.get_var_value("azure_client_id")
-
-        validate_certs = self.get_option('validate_certs')
-        conf_file = self.get_option('config_file')
-        as_file = self.get_option('as_file')
+        #
+        # Options are stored on the plugin instance, which may be shared by
+        # concurrent lookups: read them all while holding the lock.
+        with _options_lock:
+            self.set_options(var_options=variables, direct=kwargs)
+
+            appliance_url = self.get_var_value("conjur_appliance_url")
+            account = self.get_var_value("conjur_account")
+            authn_login = self.get_var_value("conjur_authn_login")
+            authn_api_key = self.get_var_value("conjur_authn_api_key")
+            cert_file = self.get_var_value("conjur_cert_file")
+            cert_content = self.get_var_value("conjur_cert_content")
+            authn_token_file = self.get_var_value("conjur_authn_token_file")
+            authn_type = self.get_var_value("conjur_authn_type")
+            service_id = self.get_var_value("conjur_authn_service_id")
+            azure_client_id = self.get_var_value("azure_client_id")
+            aws_sts_region = self.get_var_value("conjur_aws_sts_region")
+
+            validate_certs = self.get_option('validate_certs')
+            conf_file = self.get_option('config_file')
+            identity_file = self.get_option('identity_file')
+            as_file = self.get_option('as_file')
+            batch_retrieval = self.get_var_value('conjur_batch_retrieval')
+            batch_max_url_length = self.get_var_value('conjur_batch_max_url_length')
+            max_workers = self.get_var_value('conjur_max_workers')
+            token_cache_margin = self.get_var_value('conjur_token_cache_margin')
+            shared_token_cache = self.get_var_value('conjur_shared_token_cache')
+            token_refresh_fraction = self.get_var_value('conjur_token_refresh_fraction')
+            secret_cache = self.get_var_value('conjur_secret_cache')
+            secret_cache_ttl = self.get_var_value('conjur_secret_cache_ttl')
+            secret_cache_max_entries = self.get_var_value('conjur_secret_cache_max_entries')
+            broker = self.get_var_value('conjur_broker')
+            broker_idle_timeout = self.get_var_value('conjur_broker_idle_timeout')
+            request_options = _RequestOptions(
+                connection_pooling=self.get_var_value('conjur_connection_pooling'),
+                retries=self.get_var_value('conjur_retries'),
+                retry_base_delay=self.get_var_value('conjur_retry_base_delay'),
+                retry_budget=self.get_var_value('conjur_retry_budget'),
+                timeouts={
+                    'metadata': (self.get_var_value('conjur_metadata_connect_timeout'),
+                                 self.get_var_value('conjur_metadata_read_timeout')),
+                    'authenticate': (self.get_var_value('conjur_authn_connect_timeout'),
+                                     self.get_var_value('conjur_authn_read_timeout')),
+                    'fetch': (self.get_var_value('conjur_fetch_connect_timeout'),
+                              self.get_var_value('conjur_fetch_read_timeout')),
+                },
+                circuit_breaker_threshold=self.get_var_value('conjur_circuit_breaker_threshold'),
+                circuit_breaker_reset_timeout=self.get_var_value('conjur_circuit_breaker_reset_timeout'),
+                rate_limit=self.get_var_value('conjur_rate_limit'),
+                rate_limit_burst=self.get_var_value('conjur_rate_limit_burst'),
+                max_concurrency=self.get_var_value('conjur_max_concurrency')
+            )
+            lookup_deadline = self.get_var_value('conjur_lookup_deadline')
+            follower_urls = self.get_var_value('conjur_follower_urls')
+            health_check = self.get_var_value('conjur_health_check')
+            health_check_ttl = self.get_var_value('conjur_health_check_ttl')
+            negative_cache_ttl = self.get_var_value('conjur_negative_cache_ttl')
+
+        if lookup_deadline:
+            request_options.deadline = time() + lookup_deadline
 
         if validate_certs is False:
             display.warning('Certificate validation has been disabled. Please enable with validate_certs option.')
@@ -1005,6 +4026,10 @@ class LookupModule(LookupBase):
         if validate_certs is True:
             cert_file = _get_certificate_file(cert_content, cert_file)
 
+        if authn_type == "auto":
+            # A token file replaces authentication, there is no authenticator to detect
+            authn_type = _detect_authn_type(request_options) if authn_token_file is None else None
+
         if authn_type in ("aws", "azure") and service_id is None:
             raise AnsibleError("[WARNING]: Please set the conjur_authn_service_id for AWS or Azure authenticator")
 
@@ -1039,8 +4064,17 @@ class LookupModule(LookupBase):
                 - A configuration file on the controlling host with the field `appliance_url`"""
             )
 
+        # The first url identifies the Conjur instance, requests may be sent to any of them
+        request_options.endpoints = _parse_endpoints(conf['appliance_url'])
+        conf['appliance_url'] = request_options.endpoints[0][0]
+        if follower_urls:
+            request_options.follower_urls = [url.strip().rstrip('/') for url in follower_urls if url.strip()]
+        for url in [url for url, _ in request_options.endpoints] + (request_options.follower_urls or []):
+            if url.lower().startswith('http://'):
+                raise AnsibleError(f'[WARNING]: Conjur URL {url} uses insecure connection. Please consider using HTTPS.')
+
+        identity = None
         if 'authn_token_file' not in conf:
-            identity_file = self.get_option('identity_file')
             identity = _merge_dictionaries(
                 _load_identity_from_file(identity_file, conf['appliance_url']),
                 {
@@ -1063,72 +4097,35 @@ class LookupModule(LookupBase):
             display.vvv(f"Using cert file path {conf['cert_file']}")
             cert_file = conf['cert_file']
 
-        try:
-            token = None
-            if 'authn_token_file' not in conf:
-                display.vvv(f"Using auth_type as {authn_type}")
-                if authn_type == 'aws':
-                    token = _fetch_conjur_iam_session_token(
-                        appliance_url=conf['appliance_url'],
-                        account=conf['account'],
-                        host_id=identity['id'],
-                        service_id=service_id,
-                        validate_certs=validate_certs,
-                        cert_file=cert_file
-                    )
-                elif authn_type == "azure":
-                    token = _fetch_conjur_azure_token(
-                        appliance_url=conf['appliance_url'],
-                        account=conf['account'],
-                        host_id=identity['id'],
-                        service_id=service_id,
-                        validate_certs=validate_certs,
-                        cert_file=cert_file,
-                        client_id=azure_client_id
-                    )
-                elif authn_type == "gcp":
-                    token = _fetch_conjur_gcp_identity_token(
-                        appliance_url=conf['appliance_url'],
-                        account=conf['account'],
-                        host_id=identity['id'],
-                        validate_certs=validate_certs,
-                        cert_file=cert_file,
-                    )
-                else:
-                    token = _fetch_conjur_token(
-                        conf['appliance_url'],
-                        conf['account'],
-                        identity['id'],
-                        identity['api_key'],
-                        validate_certs,
-                        cert_file
-                    )
-            else:
-                if not os.path.exists(conf['authn_token_file']):
-                    raise AnsibleError(f"Conjur authn token file `{conf['authn_token_file']}` was not found on the host")
-                with open(conf['authn_token_file'], 'rb') as file:
-                    token = file.read()
-
-            conjur_variable = _fetch_conjur_variable(
-                terms[0],
-                token,
-                conf['appliance_url'],
-                conf['account'],
-                validate_certs,
-                cert_file
-            )
-        finally:
-            if isinstance(token, bytes):
-                token = b"\x00" * len(token)
-            else:
-                token = None
+        settings = {
+            'conf': conf,
+            'identity': identity,
+            'authn_type': authn_type,
+            'service_id': service_id,
+            'azure_client_id': azure_client_id,
+            'aws_sts_region': aws_sts_region,
+            'validate_certs': validate_certs,
+            'cert_file': cert_file,
+            'batch_retrieval': batch_retrieval,
+            'batch_max_url_length': batch_max_url_length,
+            'max_workers': max_workers,
+            'token_cache_margin': token_cache_margin,
+            'shared_token_cache': shared_token_cache,
+            'token_refresh_fraction': token_refresh_fraction,
+            'secret_cache': secret_cache,
+            'secret_cache_ttl': secret_cache_ttl,
+            'secret_cache_max_entries': secret_cache_max_entries,
+            'health_check': health_check,
+            'negative_cache_ttl': negative_cache_ttl,
+            'health_check_ttl': health_check_ttl,
+            'request_options': vars(request_options),
+            'run_id': None
+        }
+        values = _query_broker(terms, settings, broker_idle_timeout) if broker else None
+        if values is None:
+            values = _lookup_values(terms, settings)
 
-            if temp_cert_file:
-                try:
-                    if os.path.exists(temp_cert_file.name):
-                        os.unlink(temp_cert_file.name)
-                except (OSError, PermissionError) as err:
-                    raise AnsibleError(f"Failed to delete temporary certificate file `{temp_cert_file.name}`: {str(err)}") from err
+        conjur_variable = [values[term] for term in terms]
 
         if as_file:
             return _store_secret_in_file(conjur_variable)
@@ -1142,3 +4139,8 @@ class LookupModule(LookupBase):
             raise AnsibleError(f"{key} was not defined in configuration") from err
 
         return variable_value
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 5 and sys.argv[1] == 'broker':
+        _run_broker(sys.argv[2], sys.argv[3], float(sys.argv[4]))
@@ -1,15 +1,25 @@
 from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
+import datetime
 import hashlib
 import hmac
 import json
+import os
+import socket
+import threading
+import tempfile
+import urllib.parse
 from ansible.module_utils.six.moves import urllib_error
 from unittest import TestCase
 from unittest.mock import MagicMock, patch, mock_open
 from ansible.errors import AnsibleError
 from ansible.plugins.loader import lookup_loader
-from base64 import b64encode
+from base64 import b64encode, urlsafe_b64encode
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.fernet import Fernet
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep, time
 
 from ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable import _merge_dictionaries, _fetch_conjur_token, _fetch_conjur_variable, \
     _validate_pem_certificate, _load_identity_from_file, _load_conf_from_file, _telemetry_header, \
@@ -17,7 +27,18 @@ from ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable import _
     _get_metadata_token, _get_iam_role_metadata, _create_canonical_request, \
     _create_conjur_iam_api_key, _get_iam_role_name, _fetch_conjur_iam_session_token, \
     InvalidAwsAccountIdException, ConjurIAMAuthnException, _fetch_conjur_azure_token, \
-    _fetch_conjur_gcp_identity_token
+    _fetch_conjur_gcp_identity_token, _fetch_conjur_variables, _batch_variable_chunks, \
+    _token_expiration, _cache_token, _get_cached_token, _token_cache, \
+    _get_certificate_file, _ca_bundle_cache, _state_dir, \
+    _open_url, _uses_proxy, _RequestOptions, _ConnectionPool, \
+    _is_retryable, _retry_after, _repeat_open_url, _SecretCache, _secret_cache, \
+    _fetch_conjur_variables_concurrently, _retrieve_conjur_variables, ConjurBatchRetrievalException, \
+    _get_shared_token, _get_run_key, _controller_run_id, _SingleFlight, _file_lock, _run_broker, _connect_broker, _query_broker, _broker_timeout, \
+    _TokenRefresher, _metadata_cache, _detect_aws_region, _sts_host, \
+    _get_azure_identity_token, _get_gcp_identity_token, AZURE_METADATA_URL, \
+    _probe_authn_type, _detect_authn_type, _parse_endpoints, _endpoint_order, _follower_order, _CircuitBreaker, _RateLimiter, _preflight, \
+    _NegativeCache, ConjurVariableException, \
+    _endpoint_latencies, _unhealthy_endpoints
 
 
 class MockMergeDictionaries(MagicMock):
@@ -28,9 +49,80 @@ class MockFileload(MagicMock):
     RESPONSE = {}
 
 
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        status = 404 if self.path.endswith('missing') else 200
+        body = self.path.encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self.server.requests.append(self.path)
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/slow':
+            sleep(0.5)
+        self.do_GET()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class _LocalServer:
+    def __enter__(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _KeepAliveHandler)
+        self.server.connections = 0
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.server
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _ManualTimer:
+    """
+    Stands in for `threading.Timer`, running its function only when the test calls `fire`.
+    """
+    def __init__(self, interval, function, args):
+        self.interval = interval
+        self.function = function
+        self.args = args
+        self.started = False
+        self.cancelled = False
+
+    def start(self):
+        self.started = True
+
+    def cancel(self):
+        self.cancelled = True
+
+    def fire(self):
+        self.function(*self.args)
+
+
+def _conjur_token(**claims):
+    payload = urlsafe_b64encode(json.dumps(claims).encode()).decode().rstrip("=")
+    return json.dumps({"protected": "e30", "payload": payload, "signature": "c2ln"}).encode()
+
+
 class TestConjurLookup(TestCase):
     def setUp(self):
         self.lookup = lookup_loader.get("conjur_variable")
+        _token_cache.clear()
+        _secret_cache.clear()
+        _metadata_cache.clear()
+        _endpoint_latencies.clear()
+        _unhealthy_endpoints.clear()
 
     def test_merge_dictionaries(self):
         functionOutput = _merge_dictionaries(
@@ -81,7 +173,9 @@ class TestConjurLookup(TestCase):
             },
             method="GET",
             validate_certs=True,
-            ca_path="cert_file"
+            ca_path="cert_file",
+            request_options=None,
+            routing_key="variable"
         )
         self.assertEqual(['response body'], result)
 
@@ -104,6 +198,423 @@ class TestConjurLookup(TestCase):
 
         self.assertEqual(result, ["conjur_variable"])
 
+    def test_batch_variable_chunks(self):
+        chunks = _batch_variable_chunks(['a/one', 'a/two', 'a/three'], "url", "account", 90)
+        self.assertEqual(chunks, [
+            [('a/one', 'account:variable:a/one'), ('a/two', 'account:variable:a/two')],
+            [('a/three', 'account:variable:a/three')]
+        ])
+
+        chunks = _batch_variable_chunks(['a/one', 'a/two', 'a/three'], "url", "account", 10)
+        self.assertEqual(len(chunks), 3)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._telemetry_header')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._repeat_open_url')
+    def test_fetch_conjur_variables(self, mock_repeat_open_url, mock_telemetry_header):
+        mock_response = MagicMock()
+        mock_response.getcode.return_value = 200
+        mock_response.read.return_value = json.dumps({
+            "account:variable:path/one": "first",
+            "account:variable:path/two": "second"
+        }).encode("utf-8")
+        mock_repeat_open_url.return_value = mock_response
+        mock_telemetry_header.return_value = 'fake_encoded_telemetry_value'
+
+        result = _fetch_conjur_variables(["path/two", "path/one", "path/two"], b'{"protected":"fakeid"}', "url", "account", True, "cert_file")
+
+        mock_repeat_open_url.assert_called_once_with(
+            "url/secrets?variable_ids=account%3Avariable%3Apath%2Ftwo,account%3Avariable%3Apath%2Fone",
+            headers={
+                'Authorization': 'Token token="eyJwcm90ZWN0ZWQiOiJmYWtlaWQifQ=="',
+                'x-cybr-telemetry': 'fake_encoded_telemetry_value'
+            },
+            method="GET",
+            validate_certs=True,
+            ca_path="cert_file",
+            request_options=None
+        )
+        self.assertEqual(["second", "first", "second"], result)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._telemetry_header')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._repeat_open_url')
+    def test_fetch_conjur_variables_unexpected_response(self, mock_repeat_open_url, mock_telemetry_header):
+        mock_response = MagicMock()
+        mock_response.getcode.return_value = 200
+        mock_repeat_open_url.return_value = mock_response
+        mock_telemetry_header.return_value = 'fake_encoded_telemetry_value'
+
+        for body in [b"<html>Bad Gateway</html>", json.dumps({"account:variable:path/one": "first"}).encode("utf-8")]:
+            mock_response.read.return_value = body
+            with self.assertRaises(AnsibleError) as context:
+                _fetch_conjur_variables(["path/one", "path/two"], b'{"protected":"fakeid"}', "url", "account", True, "cert_file")
+            self.assertIn("Failed to retrieve variables path/one, path/two (unexpected response)", context.exception.message)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._telemetry_header')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._repeat_open_url')
+    def test_fetch_conjur_variables_in_chunks(self, mock_repeat_open_url, mock_telemetry_header):
+        def respond(url, **kwargs):
+            variable_id = urllib.parse.unquote(url.split('=', 1)[1])
+            mock_response = MagicMock()
+            mock_response.getcode.return_value = 200
+            mock_response.read.return_value = json.dumps({variable_id: variable_id.upper()}).encode("utf-8")
+            return mock_response
+
+        mock_repeat_open_url.side_effect = respond
+        mock_telemetry_header.return_value = 'fake_encoded_telemetry_value'
+
+        terms = ["path/one", "path/two", "path/three"]
+        result = _fetch_conjur_variables(terms, b'token', "url", "account", True, "cert_file", max_url_length=10)
+
+        self.assertEqual(mock_repeat_open_url.call_count, 3)
+        self.assertEqual(["ACCOUNT:VARIABLE:PATH/ONE", "ACCOUNT:VARIABLE:PATH/TWO", "ACCOUNT:VARIABLE:PATH/THREE"], result)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_variable')
+    def test_fetch_conjur_variables_concurrently(self, mock_fetch_conjur_variable):
+        def fetch(conjur_variable, *args):
+            if conjur_variable.startswith('missing'):
+                raise AnsibleError(f'The variable {conjur_variable} does not exist')
+            return [conjur_variable.upper()]
+
+        mock_fetch_conjur_variable.side_effect = fetch
+        terms = ['path/one', 'missing/two', 'path/three', 'path/one']
+
+        results = _fetch_conjur_variables_concurrently(terms, b'token', "url", "account", True, "cert_file", max_workers=2)
+
+        self.assertEqual(results[0], 'PATH/ONE')
+        self.assertIsInstance(results[1], AnsibleError)
+        self.assertIn('missing/two does not exist', results[1].message)
+        self.assertEqual(results[2:], ['PATH/THREE', 'PATH/ONE'])
+        self.assertEqual(mock_fetch_conjur_variable.call_count, 3)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_variable')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_variable_batch')
+    def test_fetch_conjur_variables_bisects_failed_batch(self, mock_fetch_conjur_variable_batch, mock_fetch_conjur_variable):
+        def fetch_batch(chunk, *args):
+            if any(conjur_variable.startswith('missing') for conjur_variable, unused in chunk):
+                raise ConjurBatchRetrievalException('One or more of the variables does not exist', 404)
+            return {conjur_variable: conjur_variable.upper() for conjur_variable, unused in chunk}
+
+        def fetch(conjur_variable, *args):
+            if conjur_variable.startswith('missing'):
+                raise AnsibleError(f'The variable {conjur_variable} does not exist')
+            return [conjur_variable.upper()]
+
+        mock_fetch_conjur_variable_batch.side_effect = fetch_batch
+        mock_fetch_conjur_variable.side_effect = fetch
+        terms = [f'path/{index}' for index in range(16)]
+        terms[5] = 'missing/five'
+
+        results = _fetch_conjur_variables(terms, b'token', "url", "account", True, "cert_file")
+
+        self.assertIsInstance(results[5], AnsibleError)
+        self.assertIn('missing/five does not exist', results[5].message)
+        self.assertEqual(results[:5] + results[6:], [term.upper() for term in terms if term != 'missing/five'])
+        # 16 -> 8 -> 4 -> 2 -> 1: one failed batch per level, then the good halves
+        self.assertEqual(mock_fetch_conjur_variable_batch.call_count, 7)
+        self.assertEqual(mock_fetch_conjur_variable.call_args_list[-1][0][0], 'missing/five')
+        self.assertEqual(mock_fetch_conjur_variable.call_count, 2)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_variable')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_variables')
+    def test_retrieve_conjur_variables(self, mock_fetch_conjur_variables, mock_fetch_conjur_variable):
+        mock_fetch_conjur_variables.return_value = ['PATH/ONE', AnsibleError('The variable path/two does not exist')]
+
+        with self.assertRaises(AnsibleError) as context:
+            _retrieve_conjur_variables(['path/one', 'path/two'], b'token', "url", "account", True, "cert_file")
+        self.assertIn('path/two does not exist', context.exception.message)
+
+        mock_fetch_conjur_variable.side_effect = AnsibleError('The variable does not exist')
+        with self.assertRaises(AnsibleError) as context:
+            _retrieve_conjur_variables(['path/one', 'path/two'], b'token', "url", "account", True, "cert_file", batch_retrieval=False)
+        self.assertIn('Failed to retrieve 2 Conjur variables', context.exception.message)
+        self.assertEqual(mock_fetch_conjur_variables.call_count, 1)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._get_certificate_file')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_variables')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_token')
+    def test_run_with_multiple_terms(self, mock_fetch_conjur_token, mock_fetch_conjur_variables, mock_get_certificate_file):
+        mock_get_certificate_file.return_value = "./conjur.pem"
+        mock_fetch_conjur_token.return_value = "token"
+        mock_fetch_conjur_variables.return_value = ["first", "second"]
+
+        variables = {'conjur_account': 'fakeaccount',
+                     'conjur_appliance_url': 'https://conjur-fake',
+                     'conjur_cert_file': './conjurfake.pem',
+                     'conjur_authn_login': 'host/ansible/ansible-fake',
+                     'conjur_authn_api_key': 'fakekey'}
+        terms = ['ansible/first-secret', 'ansible/second-secret']
+
+        output = self.lookup.run(terms, variables)
+        self.assertEqual(output, ["first", "second"])
+        self.assertEqual(mock_fetch_conjur_variables.call_args[0][0], terms)
+
+    def test_token_expiration(self):
+        self.assertEqual(_token_expiration(_conjur_token(sub="host/fake", exp=1700000480)), 1700000480)
+        self.assertEqual(_token_expiration(_conjur_token(sub="host/fake", iat=1700000000)), 1700000480)
+        self.assertIsNone(_token_expiration(b"not a token"))
+        self.assertIsNone(_token_expiration("token"))
+
+    def test_token_cache(self):
+        token = _conjur_token(exp=time() + 480)
+        _cache_token(("url", "account"), token)
+        self.assertEqual(_get_cached_token(("url", "account"), 30), token)
+        self.assertIsNone(_get_cached_token(("url", "account"), 600))
+        self.assertIsNone(_get_cached_token(("url", "account"), 30))
+
+        _cache_token(("url", "account"), "token")
+        self.assertIsNone(_get_cached_token(("url", "account"), 30))
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._get_certificate_file')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_variable')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_token')
+    def test_run_reuses_cached_token(self, mock_fetch_conjur_token, mock_fetch_conjur_variable, mock_get_certificate_file):
+        mock_get_certificate_file.return_value = "./conjur.pem"
+        mock_fetch_conjur_token.return_value = _conjur_token(exp=time() + 480)
+        mock_fetch_conjur_variable.return_value = ["conjur_variable"]
+
+        variables = {'conjur_account': 'fakeaccount',
+                     'conjur_appliance_url': 'https://conjur-fake',
+                     'conjur_cert_file': './conjurfake.pem',
+                     'conjur_authn_login': 'host/ansible/ansible-fake',
+                     'conjur_authn_api_key': 'fakekey'}
+
+        self.lookup.run(['ansible/fake-secret'], variables)
+        self.lookup.run(['ansible/fake-secret'], variables)
+        self.assertEqual(mock_fetch_conjur_token.call_count, 1)
+
+        variables['conjur_authn_api_key'] = 'otherkey'
+        self.lookup.run(['ansible/fake-secret'], variables)
+        self.assertEqual(mock_fetch_conjur_token.call_count, 2)
+
+    def test_secret_cache_expiry_and_eviction(self):
+        cache = _SecretCache()
+        cache.put_many("scope", {"a": "first", "b": "second"}, 60, 10)
+        self.assertEqual(cache.get_many("scope", ["a", "b", "c"]), {"a": "first", "b": "second"})
+        self.assertEqual(cache.get_many("other-scope", ["a"]), {})
+
+        evicted = cache._entries[("scope", "b")][0]
+        cache.get_many("scope", ["a"])
+        cache.put_many("scope", {"c": "third"}, 60, 2)
+        self.assertEqual(cache.get_many("scope", ["a", "b", "c"]), {"a": "first", "c": "third"})
+        self.assertEqual(evicted, bytearray(len("second")))
+
+        cache.put_many("scope", {"d": "fourth"}, -1, 10)
+        self.assertEqual(cache.get_many("scope", ["d"]), {})
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._get_certificate_file')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_variables')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_variable')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_token')
+    def test_run_with_secret_cache(self, mock_fetch_conjur_token, mock_fetch_conjur_variable, mock_fetch_conjur_variables,
+                                   mock_get_certificate_file):
+        mock_get_certificate_file.return_value = "./conjur.pem"
+        mock_fetch_conjur_token.return_value = "token"
+        mock_fetch_conjur_variable.return_value = ["first"]
+        mock_fetch_conjur_variables.return_value = ["second", "third"]
+
+        variables = {'conjur_account': 'fakeaccount',
+                     'conjur_appliance_url': 'https://conjur-fake',
+                     'conjur_cert_file': './conjurfake.pem',
+                     'conjur_authn_login': 'host/ansible/ansible-fake',
+                     'conjur_authn_api_key': 'fakekey',
+                     'conjur_secret_cache': True}
+
+        self.assertEqual(self.lookup.run(['ansible/first'], variables), ["first"])
+        self.assertEqual(self.lookup.run(['ansible/first'], variables), ["first"])
+        self.assertEqual(mock_fetch_conjur_token.call_count, 1)
+        self.assertEqual(mock_fetch_conjur_variable.call_count, 1)
+
+        output = self.lookup.run(['ansible/second', 'ansible/first', 'ansible/third'], variables)
+        self.assertEqual(output, ["second", "first", "third"])
+        self.assertEqual(mock_fetch_conjur_variables.call_args[0][0], ['ansible/second', 'ansible/third'])
+
+        variables['conjur_authn_api_key'] = 'otherkey'
+        self.lookup.run(['ansible/first'], variables)
+        self.assertEqual(mock_fetch_conjur_variable.call_count, 2)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._default_tmp_path')
+    def test_negative_cache(self, mock_default_tmp_path):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mock_default_tmp_path.return_value = tmp_dir
+            cache = _NegativeCache()
+            cache.put_many("scope", {
+                "missing": ConjurVariableException("The variable missing does not exist", "missing", 404),
+                "unauthorized": ConjurVariableException("Conjur request has invalid authorization credentials", "unauthorized", 401),
+                "failed": AnsibleError("Failed to retrieve failed: timed out"),
+            }, 60)
+            cache.put_many("scope", {"expired": ConjurVariableException("The variable expired does not exist", "expired", 404)}, -1)
+
+            # Another worker sees the same entries
+            errors = _NegativeCache().get_many("scope", ["missing", "unauthorized", "failed", "expired"])
+            self.assertEqual(list(errors), ["missing"])
+            self.assertEqual(errors["missing"].message, "The variable missing does not exist")
+            self.assertEqual(errors["missing"].code, 404)
+            self.assertEqual(cache.get_many("other-scope", ["missing"]), {})
+
+            # Only status codes are stored, never the variable paths
+            for name in os.listdir(_state_dir()):
+                with open(os.path.join(_state_dir(), name), 'r', encoding='utf-8') as cache_file:
+                    self.assertNotIn("missing", cache_file.read())
+
+            # Malformed entries are ignored
+            for name in os.listdir(_state_dir()):
+                if name.startswith('negative-') and name.endswith('.json'):
+                    with open(os.path.join(_state_dir(), name), 'w', encoding='utf-8') as cache_file:
+                        json.dump({"a": None, "b": {"code": 404}, "c": {"code": 404, "expires_at": "soon"}, "d": []}, cache_file)
+            self.assertEqual(_NegativeCache().get_many("scope", ["missing"]), {})
+            cache.put_many("scope", {"missing": ConjurVariableException("The variable missing does not exist", "missing", 404)}, 60)
+            self.assertEqual(list(cache.get_many("scope", ["missing"])), ["missing"])
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._default_tmp_path')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._get_certificate_file')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_variables')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_variable')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_token')
+    def test_run_with_negative_cache(self, mock_fetch_conjur_token, mock_fetch_conjur_variable, mock_fetch_conjur_variables,
+                                     mock_get_certificate_file, mock_default_tmp_path):
+        mock_get_certificate_file.return_value = "./conjur.pem"
+        mock_fetch_conjur_token.return_value = "token"
+        mock_fetch_conjur_variable.side_effect = ConjurVariableException(
+            "The controlling host's Conjur identity does not have authorization to retrieve ansible/forbidden", "ansible/forbidden", 403
+        )
+        mock_fetch_conjur_variables.return_value = [
+            "value", ConjurVariableException("The variable ansible/missing does not exist", "ansible/missing", 404)
+        ]
+
+        variables = {'conjur_account': 'fakeaccount',
+                     'conjur_appliance_url': 'https://conjur-fake',
+                     'conjur_cert_file': './conjurfake.pem',
+                     'conjur_authn_login': 'host/ansible/ansible-fake',
+                     'conjur_authn_api_key': 'fakekey',
+                     'conjur_negative_cache_ttl': 60}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mock_default_tmp_path.return_value = tmp_dir
+            for _ in range(2):
+                with self.assertRaises(AnsibleError) as context:
+                    self.lookup.run(['ansible/forbidden'], variables)
+                self.assertIn("does not have authorization to retrieve ansible/forbidden", context.exception.message)
+            self.assertEqual(mock_fetch_conjur_variable.call_count, 1)
+
+            for _ in range(2):
+                with self.assertRaises(AnsibleError) as context:
+                    self.lookup.run(['ansible/value', 'ansible/missing'], variables)
+                self.assertEqual("The variable ansible/missing does not exist", context.exception.message)
+            self.assertEqual(mock_fetch_conjur_variables.call_count, 1)
+
+            # Other identities do not share the cached errors
+            variables['conjur_authn_api_key'] = 'otherkey'
+            with self.assertRaises(AnsibleError):
+                self.lookup.run(['ansible/forbidden'], variables)
+            self.assertEqual(mock_fetch_conjur_variable.call_count, 2)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._get_certificate_file')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_variable')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_token')
+    def test_run_concurrently(self, mock_fetch_conjur_token, mock_fetch_conjur_variable, mock_get_certificate_file):
+        mock_get_certificate_file.return_value = "./conjur.pem"
+        mock_fetch_conjur_token.return_value = "token"
+        mock_fetch_conjur_variable.side_effect = \
+            lambda variable, token, conjur_url, *args: [f"{conjur_url}/{variable}"]
+
+        def lookup(index):
+            variables = {'conjur_account': 'fakeaccount',
+                         'conjur_appliance_url': f'https://conjur-{index}',
+                         'conjur_cert_file': './conjurfake.pem',
+                         'conjur_authn_login': 'host/ansible/ansible-fake',
+                         'conjur_authn_api_key': 'fakekey'}
+            return self.lookup.run([f'secret-{index}'], variables)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lookup, range(32)))
+
+        self.assertEqual(results, [[f"https://conjur-{index}/secret-{index}"] for index in range(32)])
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._get_certificate_file')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_variable')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_token')
+    def test_run_coalesces_identical_lookups(self, mock_fetch_conjur_token, mock_fetch_conjur_variable, mock_get_certificate_file):
+        mock_get_certificate_file.return_value = "./conjur.pem"
+        release = threading.Event()
+
+        def fetch_token(*args):
+            release.wait(5)
+            return _conjur_token(exp=time() + 480)
+
+        def fetch_variable(*args):
+            release.wait(5)
+            return ["conjur_variable"]
+
+        mock_fetch_conjur_token.side_effect = fetch_token
+        mock_fetch_conjur_variable.side_effect = fetch_variable
+        variables = {'conjur_account': 'fakeaccount',
+                     'conjur_appliance_url': 'https://conjur-fake',
+                     'conjur_cert_file': './conjurfake.pem',
+                     'conjur_authn_login': 'host/ansible/ansible-fake',
+                     'conjur_authn_api_key': 'fakekey'}
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [executor.submit(self.lookup.run, ['ansible/fake-secret'], variables) for unused in range(8)]
+            sleep(0.2)
+            release.set()
+            self.assertEqual([future.result() for future in futures], [["conjur_variable"]] * 8)
+
+        self.assertEqual(mock_fetch_conjur_token.call_count, 1)
+        self.assertEqual(mock_fetch_conjur_variable.call_count, 1)
+
+    def test_token_refresher(self):
+        timers = []
+        refresher = _TokenRefresher(lambda *args: timers.append(_ManualTimer(*args)) or timers[-1])
+        margins = []
+
+        # A token which was not reused is not refreshed
+        refresher.schedule('key', _conjur_token(exp=time() + 400), 0.5, margins.append)
+        self.assertTrue(timers[0].started)
+        self.assertAlmostEqual(timers[0].interval, 200, delta=1)
+        timers[0].fire()
+        self.assertEqual(margins, [])
+
+        refresher.schedule('key', _conjur_token(exp=time() + 400), 0.75, margins.append)
+        refresher.schedule('key', _conjur_token(exp=time() + 400), 0.5, margins.append)
+        self.assertTrue(timers[1].cancelled)
+        refresher.mark_used('key')
+        timers[2].fire()
+        self.assertEqual(len(margins), 1)
+        self.assertAlmostEqual(margins[0], 200, delta=1)
+
+        # Tokens without expiry are not scheduled
+        refresher.schedule('other', b'opaque', 0.5, margins.append)
+        self.assertEqual(len(timers), 3)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._get_certificate_file')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_variable')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_token')
+    def test_run_refreshes_token_in_background(self, mock_fetch_conjur_token, mock_fetch_conjur_variable, mock_get_certificate_file):
+        timers = []
+        refresher = _TokenRefresher(lambda *args: timers.append(_ManualTimer(*args)) or timers[-1])
+        mock_get_certificate_file.return_value = "./conjur.pem"
+        mock_fetch_conjur_token.side_effect = lambda *args: _conjur_token(exp=time() + 480)
+        mock_fetch_conjur_variable.return_value = ["conjur_variable"]
+        variables = {'conjur_account': 'fakeaccount',
+                     'conjur_appliance_url': 'https://conjur-fake',
+                     'conjur_cert_file': './conjurfake.pem',
+                     'conjur_authn_login': 'host/ansible/ansible-fake',
+                     'conjur_authn_api_key': 'fakekey',
+                     'conjur_token_cache_margin': 0,
+                     'conjur_token_refresh_fraction': 0.5}
+
+        with patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._token_refresher', refresher):
+            self.lookup.run(['ansible/fake-secret'], variables)
+            self.lookup.run(['ansible/fake-secret'], variables)
+            self.assertEqual(mock_fetch_conjur_token.call_count, 1)
+
+            timers[0].fire()
+            self.assertEqual(mock_fetch_conjur_token.call_count, 2)
+            # The renewed token is cached, and its own refresh scheduled
+            self.assertEqual(len(timers), 2)
+            self.lookup.run(['ansible/fake-secret'], variables)
+            self.assertEqual(mock_fetch_conjur_token.call_count, 2)
+
     @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._get_certificate_file')
     @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_variable')
     @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_token')
@@ -122,6 +633,21 @@ class TestConjurLookup(TestCase):
         output = self.lookup.run(terms, variables)
         self.assertEqual(output, ["conjur_variable"])
 
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._get_certificate_file')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_variable')
+    def test_run_rejects_insecure_urls(self, mock_fetch_conjur_variable, mock_get_certificate_file):
+        mock_get_certificate_file.return_value = "./conjur.pem"
+        base_variables = {'conjur_account': 'fakeaccount',
+                          'conjur_cert_file': './conjurfake.pem',
+                          'conjur_authn_token_file': '/dev/null'}
+
+        for urls in [{'conjur_appliance_url': [{'url': 'HTTP://conjur-follower', 'read_only': True}, 'https://conjur-fake']},
+                     {'conjur_appliance_url': 'https://conjur-fake', 'conjur_follower_urls': ['https://one', 'http://two']}]:
+            with self.assertRaises(AnsibleError) as context:
+                self.lookup.run(['ansible/fake-secret'], {**base_variables, **urls})
+            self.assertIn('insecure connection', context.exception.message)
+        mock_fetch_conjur_variable.assert_not_called()
+
     @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._get_certificate_file')
     @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_variable')
     @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_token')
@@ -181,6 +707,583 @@ class TestConjurLookup(TestCase):
         output = self.lookup.run(terms, variables)
         self.assertEqual(output, ["conjur_variable"])
 
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._get_valid_certificate')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._default_tmp_path')
+    def test_get_certificate_file_is_reused(self, mock_default_tmp_path, mock_get_valid_certificate):
+        cert = '-----BEGIN CERTIFICATE-----\nFAKE CERT CONTENT\n-----END CERTIFICATE-----'
+        mock_get_valid_certificate.return_value = cert
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mock_default_tmp_path.return_value = tmp_dir
+            _ca_bundle_cache.clear()
+
+            first = _get_certificate_file(cert, None)
+            second = _get_certificate_file(cert, None)
+            self.assertEqual(first, second)
+            self.assertTrue(first.startswith(_state_dir()))
+            with open(first, 'rb') as bundle:
+                self.assertTrue(bundle.read().endswith(cert.encode() + b"\n"))
+
+            # Another process finds the bundle written by the first one
+            _ca_bundle_cache.clear()
+            self.assertEqual(_get_certificate_file(cert, None), first)
+            self.assertEqual(mock_get_valid_certificate.call_count, 1)
+
+            other = _get_certificate_file(cert.replace('FAKE', 'OTHER'), None)
+            self.assertNotEqual(other, first)
+            self.assertEqual(mock_get_valid_certificate.call_count, 2)
+
+            # Writing a bundle removes those unused for a day, and keeps the recent ones
+            os.utime(first, (time() - 2 * 24 * 60 * 60,) * 2)
+            newest = _get_certificate_file(cert.replace('FAKE', 'NEWEST'), None)
+            self.assertFalse(os.path.exists(first))
+            self.assertTrue(os.path.exists(other))
+            self.assertTrue(os.path.exists(newest))
+        _ca_bundle_cache.clear()
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._default_tmp_path')
+    def test_state_dir_rejects_shared_directory(self, mock_default_tmp_path):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mock_default_tmp_path.return_value = tmp_dir
+            path = _state_dir()
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o700)
+
+            os.chmod(path, 0o777)
+            self.assertIsNone(_state_dir())
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._default_tmp_path')
+    def test_shared_token_cache(self, mock_default_tmp_path):
+        token = _conjur_token(exp=time() + 480)
+        calls = []
+
+        def authenticate():
+            calls.append(1)
+            return token
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mock_default_tmp_path.return_value = tmp_dir
+            cache_key = ('url', 'account', 'host/ansible', 'api_key', None, 'digest')
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                tokens = list(executor.map(lambda unused: _get_shared_token(cache_key, 30, authenticate), range(8)))
+
+            self.assertEqual(tokens, [token] * 8)
+            self.assertEqual(len(calls), 1)
+
+            token_files = [name for name in os.listdir(_state_dir()) if name.startswith('token-') and not name.endswith('.lock')]
+            self.assertEqual(len(token_files), 1)
+            token_path = os.path.join(_state_dir(), token_files[0])
+            self.assertEqual(os.stat(token_path).st_mode & 0o777, 0o600)
+            with open(token_path, 'rb') as token_file:
+                self.assertNotIn(b'payload', token_file.read())
+
+            self.assertEqual(_get_shared_token(cache_key, 600, authenticate), token)
+            self.assertEqual(len(calls), 2)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._default_tmp_path')
+    def test_shared_token_cache_run_id(self, mock_default_tmp_path):
+        token = _conjur_token(exp=time() + 480)
+        run_id = _controller_run_id(os.getpid())
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mock_default_tmp_path.return_value = tmp_dir
+            cache_key = ('url', 'account', 'host/ansible', 'api_key', None, 'digest')
+            self.assertEqual(_get_shared_token(cache_key, 30, lambda: token, run_id), token)
+
+            names = [name for name in os.listdir(_state_dir()) if not name.endswith('.lock')]
+            self.assertIn(f'run-{run_id}.key', names)
+            self.assertTrue([name for name in names if name.startswith(f'token-{run_id}-')])
+            self.assertFalse([name for name in names if _controller_run_id() in name])
+
+            # An entry missing a field is a miss, like one which cannot be decrypted
+            token_name = next(name for name in names if name.startswith(f'token-{run_id}-'))
+            with open(os.path.join(_state_dir(), token_name), 'wb') as token_file:
+                token_file.write(Fernet(_get_run_key(_state_dir(), run_id)).encrypt(json.dumps({'token': 'stale'}).encode('utf-8')))
+            renewed = _conjur_token(exp=time() + 600)
+            self.assertEqual(_get_shared_token(cache_key, 30, lambda: renewed, run_id), renewed)
+
+    def test_controller_run_id(self):
+        self.assertEqual(_controller_run_id(), _controller_run_id(os.getppid()))
+        self.assertTrue(_controller_run_id(os.getpid()).startswith(f'{os.getpid()}-'))
+        self.assertNotEqual(_controller_run_id(os.getpid()), _controller_run_id(os.getppid()))
+
+    def test_single_flight(self):
+        single_flight = _SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def call():
+            calls.append(1)
+            release.wait(5)
+            return 'value'
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [executor.submit(single_flight.do, 'key', call) for unused in range(8)]
+            sleep(0.1)
+            release.set()
+            self.assertEqual([future.result() for future in futures], ['value'] * 8)
+        self.assertEqual(len(calls), 1)
+
+        def fail():
+            raise AnsibleError('failed')
+
+        with self.assertRaises(AnsibleError):
+            single_flight.do('key', fail)
+        self.assertEqual(single_flight.do('key', call), 'value')
+
+    def test_single_flight_deadline(self):
+        single_flight = _SingleFlight()
+        release = threading.Event()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            leader = executor.submit(single_flight.do, 'key', lambda: release.wait(5))
+            sleep(0.1)
+            with self.assertRaises(AnsibleError) as context:
+                single_flight.do('key', lambda: None, time() + 0.1)
+            self.assertIn('deadline was exceeded', context.exception.message)
+            release.set()
+            self.assertTrue(leader.result())
+
+    def test_file_lock_deadline(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'file.lock')
+            with _file_lock(path):
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    def take_lock():
+                        with _file_lock(path, time() + 0.1):
+                            pass
+                    with self.assertRaises(AnsibleError) as context:
+                        executor.submit(take_lock).result(5)
+                    self.assertIn('deadline was exceeded', context.exception.message)
+            with _file_lock(path, time() + 1):
+                pass
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._lookup_values')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._spawn_broker')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._default_tmp_path')
+    def test_query_broker(self, mock_default_tmp_path, mock_spawn_broker, mock_lookup_values):
+        brokers = []
+
+        def spawn(socket_path, run_id, idle_timeout):
+            broker = threading.Thread(target=_run_broker, args=(socket_path, run_id, idle_timeout))
+            broker.start()
+            brokers.append(broker)
+            for unused in range(100):
+                connection = _connect_broker(socket_path)
+                if connection is not None:
+                    return connection
+                sleep(0.05)
+            raise OSError('broker did not start')
+
+        mock_spawn_broker.side_effect = spawn
+        mock_lookup_values.return_value = {'path/one': 'first'}
+        settings = {'request_options': {'connection_pooling': False}}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mock_default_tmp_path.return_value = tmp_dir
+            self.assertEqual(_query_broker(['path/one'], settings, 0.5), {'path/one': 'first'})
+            self.assertEqual(_query_broker(['path/one'], settings, 0.5), {'path/one': 'first'})
+            self.assertEqual(mock_spawn_broker.call_count, 1)
+            self.assertTrue(mock_lookup_values.call_args[0][1]['request_options']['connection_pooling'])
+            self.assertEqual(mock_lookup_values.call_args[0][1]['run_id'], _controller_run_id())
+
+            mock_lookup_values.side_effect = AnsibleError('The variable path/two does not exist')
+            with self.assertRaises(AnsibleError) as context:
+                _query_broker(['path/two'], settings, 0.5)
+            self.assertIn('path/two does not exist', context.exception.message)
+
+            # A slow broker is not bypassed: the worker fails rather than retrieving the secrets too
+            mock_lookup_values.side_effect = lambda *args: sleep(1) or {'path/three': 'third'}
+            slow_settings = {'request_options': {'connection_pooling': False, 'deadline': time() + 0.3}}
+            with self.assertRaises(AnsibleError) as context:
+                _query_broker(['path/three'], slow_settings, 0.5)
+            self.assertIn('did not answer', context.exception.message)
+            self.assertEqual(mock_spawn_broker.call_count, 1)
+
+            brokers[0].join(10)
+            self.assertFalse(brokers[0].is_alive())
+            self.assertFalse([name for name in os.listdir(_state_dir()) if name.endswith('.sock')])
+
+    def test_broker_timeout(self):
+        self.assertEqual(_broker_timeout(vars(_RequestOptions())), 102.0)
+        self.assertEqual(_broker_timeout(vars(_RequestOptions(retry_budget=10, timeouts={'fetch': (1.0, 2.0)}))), 40.0)
+        self.assertEqual(_broker_timeout(vars(_RequestOptions(retry_budget=600))), 300.0)
+        self.assertAlmostEqual(_broker_timeout(vars(_RequestOptions(deadline=time() + 3))), 3, delta=0.5)
+        with self.assertRaises(AnsibleError):
+            _broker_timeout(vars(_RequestOptions(deadline=time() - 1)))
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._uses_proxy')
+    def test_connection_pool_reuses_connections(self, mock_uses_proxy):
+        mock_uses_proxy.return_value = False
+        pool = _ConnectionPool()
+        with _LocalServer() as server:
+            url = f'http://127.0.0.1:{server.server_port}'
+            first = pool.request(f'{url}/one', method='GET')
+            second = pool.request(f'{url}/two?x=1', method='GET')
+
+            self.assertEqual(first.getcode(), 200)
+            self.assertEqual(first.read(), b'/one')
+            self.assertEqual(second.read(), b'/two?x=1')
+            self.assertEqual(server.connections, 1)
+
+            with self.assertRaises(urllib_error.HTTPError) as context:
+                pool.request(f'{url}/missing', method='GET')
+            self.assertEqual(context.exception.code, 404)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._connection_pool')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_open_url_uses_pool_only_when_enabled(self, mock_open_url, mock_connection_pool):
+        _open_url("https://conjur-fake/info", method='GET')
+        _open_url("https://conjur-fake/info", request_options=_RequestOptions(), method='GET')
+        self.assertEqual(mock_open_url.call_count, 2)
+        mock_connection_pool.request.assert_not_called()
+
+        with patch.dict(os.environ, {}, clear=True):
+            _open_url("https://conjur-fake/info", request_options=_RequestOptions(connection_pooling=True), method='GET')
+        mock_connection_pool.request.assert_called_once_with("https://conjur-fake/info", method='GET')
+
+    def test_uses_proxy(self):
+        with patch.dict(os.environ, {'https_proxy': 'http://proxy:3128', 'no_proxy': 'conjur-internal'}, clear=True):
+            self.assertTrue(_uses_proxy("https://conjur-fake/info"))
+            self.assertFalse(_uses_proxy("https://conjur-internal/info"))
+            self.assertFalse(_uses_proxy("http://conjur-fake/info"))
+
+    def test_is_retryable(self):
+        def http_error(code):
+            return urllib_error.HTTPError("url", code, "reason", {}, None)
+
+        self.assertTrue(_is_retryable(http_error(429)))
+        self.assertTrue(_is_retryable(http_error(503)))
+        self.assertFalse(_is_retryable(http_error(401)))
+        self.assertFalse(_is_retryable(http_error(404)))
+        self.assertTrue(_is_retryable(urllib_error.URLError(ConnectionRefusedError("refused"))))
+        self.assertTrue(_is_retryable(urllib_error.URLError(TimeoutError("timed out"))))
+        self.assertFalse(_is_retryable(urllib_error.URLError("unknown url type")))
+
+    def test_retry_after(self):
+        self.assertEqual(_retry_after(urllib_error.HTTPError("url", 429, "reason", {'Retry-After': '7'}, None)), 7.0)
+        self.assertEqual(_retry_after(urllib_error.HTTPError("url", 429, "reason", {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}, None)), 0.0)
+        self.assertIsNone(_retry_after(urllib_error.HTTPError("url", 503, "reason", {}, None)))
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.sleep')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_repeat_open_url_retries_transient_errors(self, mock_open_url, mock_sleep):
+        mock_response = MagicMock()
+        mock_open_url.side_effect = [
+            urllib_error.HTTPError("url", 503, "Service Unavailable", {}, None),
+            urllib_error.HTTPError("url", 429, "Too Many Requests", {'Retry-After': '3'}, None),
+            mock_response
+        ]
+        request_options = _RequestOptions(retries=2, retry_base_delay=0.5, retry_budget=10)
+
+        self.assertEqual(_repeat_open_url("url", method="GET", request_options=request_options), mock_response)
+        self.assertEqual(mock_open_url.call_count, 3)
+        self.assertLessEqual(mock_sleep.call_args_list[0][0][0], 0.5)
+        self.assertEqual(mock_sleep.call_args_list[1][0][0], 3.0)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.sleep')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_repeat_open_url_does_not_retry_client_errors(self, mock_open_url, mock_sleep):
+        mock_open_url.side_effect = urllib_error.HTTPError("url", 404, "Not Found", {}, None)
+
+        with self.assertRaises(urllib_error.HTTPError):
+            _repeat_open_url("url", method="GET")
+        self.assertEqual(mock_open_url.call_count, 1)
+        mock_sleep.assert_not_called()
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.sleep')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_repeat_open_url_retry_budget(self, mock_open_url, mock_sleep):
+        mock_open_url.side_effect = urllib_error.HTTPError("url", 503, "Service Unavailable", {'Retry-After': '30'}, None)
+
+        with self.assertRaises(urllib_error.HTTPError):
+            _repeat_open_url("url", method="GET", request_options=_RequestOptions(retries=5, retry_budget=10))
+        self.assertEqual(mock_open_url.call_count, 1)
+        mock_sleep.assert_not_called()
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._connection_pool')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_open_url_phase_timeouts(self, mock_open_url, mock_connection_pool):
+        timeouts = {'metadata': (1.0, 3.0), 'fetch': (2.0, 7.0)}
+        _open_url("http://metadata", request_options=_RequestOptions(timeouts=timeouts), phase='metadata', method='GET')
+        mock_open_url.assert_called_once_with("http://metadata", method='GET', timeout=3.0)
+
+        mock_open_url.reset_mock()
+        _open_url("http://metadata", request_options=_RequestOptions(timeouts=timeouts), phase='metadata', timeout=0.5)
+        mock_open_url.assert_called_once_with("http://metadata", timeout=0.5)
+
+        with patch.dict(os.environ, {}, clear=True):
+            _open_url("https://conjur-fake/secrets", request_options=_RequestOptions(connection_pooling=True, timeouts=timeouts),
+                      phase='fetch', method='GET')
+        mock_connection_pool.request.assert_called_once_with("https://conjur-fake/secrets", method='GET', timeout=(2.0, 7.0))
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_open_url_deadline(self, mock_open_url):
+        options = _RequestOptions(deadline=time() + 4)
+        _open_url("https://conjur-fake/secrets", request_options=options, phase='fetch', method='GET')
+        self.assertLessEqual(mock_open_url.call_args.kwargs['timeout'], 4)
+
+        options.deadline = time() - 1
+        with self.assertRaises(AnsibleError) as context:
+            _open_url("https://conjur-fake/secrets", request_options=options, phase='fetch', method='GET')
+        self.assertIn("deadline was exceeded", context.exception.message)
+        self.assertEqual(mock_open_url.call_count, 1)
+        self.assertIsNone(options.without_deadline().deadline)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.sleep')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_repeat_open_url_stops_at_deadline(self, mock_open_url, mock_sleep):
+        mock_open_url.side_effect = urllib_error.HTTPError("url", 503, "Service Unavailable", {'Retry-After': '5'}, None)
+
+        with self.assertRaises(urllib_error.HTTPError):
+            _repeat_open_url("url", method="GET", request_options=_RequestOptions(retries=5, deadline=time() + 3))
+        self.assertEqual(mock_open_url.call_count, 1)
+        mock_sleep.assert_not_called()
+
+    def test_parse_endpoints(self):
+        self.assertEqual(_parse_endpoints("https://conjur-fake/"), [("https://conjur-fake", False)])
+        self.assertEqual(
+            _parse_endpoints(["https://leader", "ro:https://follower-1", {"url": "https://follower-2", "read_only": "yes"}]),
+            [("https://leader", False), ("https://follower-1", True), ("https://follower-2", True)]
+        )
+        with self.assertRaises(AnsibleError):
+            _parse_endpoints([{"read_only": True}])
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_endpoint_order(self, mock_open_url):
+        def measured(url, **kwargs):
+            if url == "https://follower-2/":
+                raise urllib_error.URLError(ConnectionRefusedError())
+            if url == "https://follower-1/":
+                sleep(0.05)
+            return MagicMock()
+
+        mock_open_url.side_effect = measured
+        options = _RequestOptions(endpoints=[("https://leader", False), ("https://follower-1", True), ("https://follower-2", True)])
+        for _ in range(2):
+            self.assertEqual(_endpoint_order(options), ["https://follower-1", "https://leader", "https://follower-2"])
+        # Round-trip times are only measured once
+        self.assertEqual(mock_open_url.call_count, 3)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_open_url_fails_over(self, mock_open_url):
+        _endpoint_latencies.update({"https://leader": 0.02, "https://follower": 0.01})
+        options = _RequestOptions(endpoints=[["https://leader", False], ["https://follower", False]], circuit_breaker_threshold=0)
+        mock_open_url.side_effect = [urllib_error.HTTPError("url", 502, "Bad Gateway", {}, None), "response"]
+
+        self.assertEqual(_open_url("https://leader/secrets/conjur/variable/path", request_options=options, method='GET'), "response")
+        self.assertEqual([call.args[0] for call in mock_open_url.call_args_list],
+                         ["https://follower/secrets/conjur/variable/path", "https://leader/secrets/conjur/variable/path"])
+        self.assertIn("https://follower", _unhealthy_endpoints)
+        self.assertEqual(_endpoint_order(options), ["https://leader", "https://follower"])
+
+        mock_open_url.reset_mock()
+        mock_open_url.side_effect = urllib_error.HTTPError("url", 404, "Not Found", {}, None)
+        with self.assertRaises(urllib_error.HTTPError):
+            _open_url("https://follower/secrets/conjur/variable/path", request_options=options, method='GET')
+        self.assertEqual(mock_open_url.call_count, 1)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._default_tmp_path')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_open_url_circuit_breaker(self, mock_open_url, mock_default_tmp_path):
+        options = _RequestOptions(endpoints=[("https://leader", False)], circuit_breaker_threshold=2, circuit_breaker_reset_timeout=0.2)
+        url = "https://leader/secrets/conjur/variable/path"
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mock_default_tmp_path.return_value = tmp_dir
+            mock_open_url.side_effect = urllib_error.URLError(ConnectionRefusedError())
+            for _ in range(2):
+                with self.assertRaises(urllib_error.URLError):
+                    _open_url(url, request_options=options, method='GET')
+
+            # The open circuit fails fast, in this worker and in any other
+            with self.assertRaises(AnsibleError) as context:
+                _open_url(url, request_options=options, method='GET')
+            self.assertIn("circuit of https://leader is open", context.exception.message)
+            self.assertEqual(mock_open_url.call_count, 2)
+            self.assertFalse(_CircuitBreaker().allow("https://leader", 0.2))
+
+            # Half-open after the reset timeout: a single trial request closes it again
+            sleep(0.25)
+            mock_open_url.side_effect = None
+            mock_open_url.return_value = "response"
+            self.assertEqual(_open_url(url, request_options=options, method='GET'), "response")
+            self.assertTrue(_CircuitBreaker().allow("https://leader", 0.2))
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._default_tmp_path')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_repeat_open_url_counts_one_circuit_failure(self, mock_open_url, mock_default_tmp_path):
+        options = _RequestOptions(endpoints=[("https://leader", False)], retries=4, retry_base_delay=0,
+                                  circuit_breaker_threshold=2)
+        url = "https://leader/secrets/conjur/variable/path"
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mock_default_tmp_path.return_value = tmp_dir
+            mock_open_url.side_effect = urllib_error.URLError(ConnectionRefusedError())
+            with self.assertRaises(urllib_error.URLError):
+                _repeat_open_url(url, method='GET', request_options=options)
+            self.assertEqual(mock_open_url.call_count, 5)
+            # Five failed attempts of one request leave the circuit closed
+            self.assertTrue(_CircuitBreaker().allow("https://leader", 30))
+
+            # A request succeeding after failed attempts does not count as a failure
+            mock_open_url.side_effect = [urllib_error.URLError(ConnectionRefusedError()), "response"]
+            self.assertEqual(_repeat_open_url(url, method='GET', request_options=options), "response")
+            mock_open_url.side_effect = urllib_error.URLError(ConnectionRefusedError())
+            with self.assertRaises(urllib_error.URLError):
+                _repeat_open_url(url, method='GET', request_options=options)
+            self.assertTrue(_CircuitBreaker().allow("https://leader", 30))
+
+            with self.assertRaises(urllib_error.URLError):
+                _repeat_open_url(url, method='GET', request_options=options)
+            self.assertFalse(_CircuitBreaker().allow("https://leader", 30))
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._default_tmp_path')
+    def test_rate_limiter_token_bucket(self, mock_default_tmp_path):
+        options = _RequestOptions(rate_limit=20, rate_limit_burst=2)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mock_default_tmp_path.return_value = tmp_dir
+            # Separate instances share the bucket like separate workers
+            limiters = [_RateLimiter(), _RateLimiter()]
+            start = monotonic()
+            for index in range(6):
+                slot = limiters[index % 2].acquire("conjur-fake", options, 'fetch')
+                self.assertIsNone(slot)
+            # The burst is free, the 4 other requests wait 1/20s each
+            self.assertGreaterEqual(monotonic() - start, 0.18)
+
+            options.deadline = time() - 1
+            with self.assertRaises(AnsibleError):
+                limiters[0].acquire("conjur-fake", options, 'fetch')
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._default_tmp_path')
+    def test_rate_limiter_adaptive_concurrency(self, mock_default_tmp_path):
+        options = _RequestOptions(max_concurrency=4)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mock_default_tmp_path.return_value = tmp_dir
+            limiter = _RateLimiter()
+            slots = [limiter.acquire("conjur-fake", options, 'fetch') for _ in range(4)]
+            self.assertEqual(len(set(slots)), 4)
+
+            options.deadline = time() + 0.1
+            with self.assertRaises(AnsibleError):
+                _RateLimiter().acquire("conjur-fake", options, 'fetch')
+            options.deadline = None
+
+            limiter.release("conjur-fake", slots.pop(), options, True)
+            limiter.release("conjur-fake", slots.pop(), options, True)
+            limiter.release("conjur-fake", slots.pop(), options, None)
+            with limiter._locked_state(_state_dir(), "conjur-fake", options) as values:
+                self.assertEqual(values[2], 1.0)
+            limiter.release("conjur-fake", slots.pop(), options, False)
+            with limiter._locked_state(_state_dir(), "conjur-fake", options) as values:
+                self.assertEqual(values[2], 2.0)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._default_tmp_path')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_open_url_backs_off_when_throttled(self, mock_open_url, mock_default_tmp_path):
+        options = _RequestOptions(max_concurrency=8, circuit_breaker_threshold=0)
+        mock_open_url.side_effect = urllib_error.HTTPError("url", 429, "Too Many Requests", {}, None)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mock_default_tmp_path.return_value = tmp_dir
+            for _ in range(2):
+                with self.assertRaises(urllib_error.HTTPError):
+                    _open_url("https://conjur-fake/info", request_options=options, method='GET')
+            with _RateLimiter()._locked_state(_state_dir(), "conjur-fake", options) as values:
+                self.assertEqual(values[2], 2.0)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._default_tmp_path')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_preflight(self, mock_open_url, mock_default_tmp_path):
+        def health(url, **kwargs):
+            if url == "https://follower/health":
+                raise urllib_error.URLError(ConnectionRefusedError("Connection refused"))
+            raise urllib_error.HTTPError(url, 404, "Not Found", {}, None)
+
+        mock_open_url.side_effect = health
+        options = _RequestOptions(endpoints=[("https://leader", False), ("https://follower", True)])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mock_default_tmp_path.return_value = tmp_dir
+            _preflight(options, True, None, 60)
+            self.assertIn("https://follower", _unhealthy_endpoints)
+            self.assertNotIn("https://leader", _unhealthy_endpoints)
+
+            # Results are reused until they expire
+            _preflight(options, True, None, 60)
+            self.assertEqual(mock_open_url.call_count, 2)
+
+            mock_open_url.side_effect = urllib_error.HTTPError("url", 502, "Bad Gateway", {}, None)
+            with self.assertRaises(AnsibleError) as context:
+                _preflight(options, True, None, 0)
+            self.assertIn("https://leader: 502 Bad Gateway", context.exception.message)
+            self.assertIn("https://follower: 502 Bad Gateway", context.exception.message)
+
+    def test_follower_order(self):
+        followers = [f"https://follower-{index}" for index in range(4)]
+        paths = [f"path/to/variable-{index}" for index in range(400)]
+        before = {path: _follower_order(followers, path)[0] for path in paths}
+        self.assertEqual(before, {path: _follower_order(list(reversed(followers)), path)[0] for path in paths})
+        self.assertGreater(len(set(before.values())), 3)
+
+        after = {path: _follower_order(followers + ["https://follower-4"], path)[0] for path in paths}
+        moved = [path for path in paths if before[path] != after[path]]
+        self.assertTrue(all(after[path] == "https://follower-4" for path in moved))
+        self.assertLess(len(moved), len(paths) / 3)
+
+        _unhealthy_endpoints[before[paths[0]]] = monotonic() + 60
+        self.assertEqual(_follower_order(followers, paths[0])[-1], before[paths[0]])
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._telemetry_header', MagicMock(return_value='telemetry'))
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_fetch_conjur_variable_uses_followers(self, mock_open_url):
+        mock_response = MagicMock()
+        mock_response.getcode.return_value = 200
+        mock_response.read.return_value = b"secret"
+        followers = ["https://follower-1", "https://follower-2"]
+        options = _RequestOptions(endpoints=[("https://leader", False)], follower_urls=followers, circuit_breaker_threshold=0)
+        first, second = _follower_order(followers, "path/to/variable")
+        mock_open_url.side_effect = [urllib_error.URLError(ConnectionRefusedError()), mock_response]
+
+        self.assertEqual(_fetch_conjur_variable("path/to/variable", b"token", "https://leader", "conjur", True, None, options), ["secret"])
+        self.assertEqual([call.args[0] for call in mock_open_url.call_args_list],
+                         [f"{first}/secrets/conjur/variable/path%2Fto%2Fvariable",
+                          f"{second}/secrets/conjur/variable/path%2Fto%2Fvariable"])
+
+    def test_connection_pool_does_not_resend_timed_out_requests(self):
+        pool = _ConnectionPool()
+        with _LocalServer() as server:
+            url = f'http://127.0.0.1:{server.server_port}'
+            pool.request(f'{url}/warm', data='{}', method='POST')
+            with self.assertRaises(OSError):
+                pool.request(f'{url}/slow', data='{}', method='POST', timeout=(1.0, 0.1))
+            sleep(0.6)
+            self.assertEqual(server.requests, ['/warm', '/slow'])
+
+    def test_connection_pool_resends_on_stale_connections(self):
+        pool = _ConnectionPool()
+        with _LocalServer() as server:
+            url = f'http://127.0.0.1:{server.server_port}'
+            pool.request(f'{url}/one', method='GET')
+            # The server closes the idle connection
+            for connection in pool._idle[('http', '127.0.0.1', server.server_port, None, True)]:
+                connection.sock.close()
+                connection.sock, peer = socket.socketpair()
+                peer.close()
+            self.assertEqual(pool.request(f'{url}/two', method='GET').read(), b'/two')
+
+    def test_connection_pool_read_timeout(self):
+        pool = _ConnectionPool()
+        with _LocalServer() as server:
+            pool.request(f'http://127.0.0.1:{server.server_port}/one', method='GET', timeout=(1.0, 4.0))
+            connection = pool._idle[('http', '127.0.0.1', server.server_port, None, True)][0]
+            self.assertEqual(connection.sock.gettimeout(), 4.0)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._telemetry_header')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_fetch_conjur_variable_not_found(self, mock_open_url, mock_telemetry_header):
+        mock_telemetry_header.return_value = 'fake_encoded_telemetry_value'
+        mock_open_url.side_effect = urllib_error.HTTPError("url", 404, "Not Found", {}, None)
+
+        with self.assertRaises(AnsibleError) as context:
+            _fetch_conjur_variable("missing/variable", b'token', "url", "account", True, "cert_file")
+        self.assertIn("The variable missing/variable does not exist", context.exception.message)
+
     def test_run_telemetry_header(self):
         with patch('builtins.open', mock_open(read_data='1.0.0')), \
              patch('os.path.abspath', return_value='/fake/path/to/collection'), \
@@ -257,6 +1360,93 @@ class TestConjurLookup(TestCase):
         result = _get_iam_role_metadata("role_name")
         self.assertEqual(result, ("AKIA", "secret", "token"))
 
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_aws_metadata_is_cached(self, mock_open_url):
+        def respond(url, **kwargs):
+            mock_response = MagicMock()
+            mock_response.getcode.return_value = 200
+            if url.endswith('/api/token'):
+                mock_response.read.return_value = b'metadata-token'
+            elif url.endswith('/security-credentials/'):
+                mock_response.read.return_value = b'my-role-name'
+            else:
+                mock_response.read.return_value = json.dumps({
+                    "AccessKeyId": "AKIA", "SecretAccessKey": "secret", "Token": "token",
+                    "Expiration": datetime.datetime.fromtimestamp(time() + 3600, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+                }).encode('utf-8')
+            return mock_response
+
+        mock_open_url.side_effect = respond
+        first = _create_conjur_iam_api_key()
+        self.assertEqual(mock_open_url.call_count, 3)
+        second = _create_conjur_iam_api_key()
+        self.assertEqual(mock_open_url.call_count, 3)
+        self.assertIn('Credential=AKIA/', second)
+        self.assertNotEqual(first, '')
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_get_iam_role_metadata_is_not_cached_past_expiration(self, mock_open_url):
+        mock_response = MagicMock()
+        mock_response.getcode.return_value = 200
+        mock_response.read.return_value = \
+            b'{"AccessKeyId":"AKIA", "SecretAccessKey":"secret", "Token":"token", "Expiration":"2020-01-01T00:00:00Z"}'
+        mock_open_url.return_value = mock_response
+
+        _get_iam_role_metadata("role_name")
+        _get_iam_role_metadata("role_name")
+        self.assertEqual(mock_open_url.call_count, 2)
+
+    def test_get_signature_key_is_cached(self):
+        first = _get_signature_key('secret', '20250425', 'us-east-1', 'sts')
+        self.assertIs(_get_signature_key('secret', '20250425', 'us-east-1', 'sts'), first)
+        self.assertNotEqual(_get_signature_key('secret', '20250426', 'us-east-1', 'sts'), first)
+        self.assertNotEqual(_get_signature_key('other', '20250425', 'us-east-1', 'sts'), first)
+
+    @patch.dict(os.environ, {'AWS_REGION': '', 'AWS_DEFAULT_REGION': ''})
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._get_metadata_token')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_detect_aws_region(self, mock_open_url, mock_get_metadata_token):
+        mock_get_metadata_token.return_value = 'metadata-token'
+        mock_response = MagicMock()
+        mock_response.read.return_value = b'us-west-2-lax-1a'
+        mock_open_url.return_value = mock_response
+
+        self.assertEqual(_detect_aws_region(), 'us-west-2')
+        self.assertEqual(_detect_aws_region(), 'us-west-2')
+        mock_open_url.assert_called_once()
+        self.assertEqual(mock_open_url.call_args[1]['headers'], {'X-aws-ec2-metadata-token': 'metadata-token'})
+
+        with patch.dict(os.environ, {'AWS_REGION': 'eu-west-1'}):
+            self.assertEqual(_detect_aws_region(), 'eu-west-1')
+
+    def test_sts_host(self):
+        self.assertEqual(_sts_host(), 'sts.amazonaws.com')
+        self.assertEqual(_sts_host('eu-west-1'), 'sts.eu-west-1.amazonaws.com')
+        self.assertEqual(_sts_host('cn-north-1'), 'sts.cn-north-1.amazonaws.com.cn')
+
+    def test_create_conjur_iam_api_key_for_regional_endpoint(self):
+        result = json.loads(_create_conjur_iam_api_key("role", "AKIA", "secret", "token", sts_region='eu-west-1'))
+        self.assertEqual(result['host'], 'sts.eu-west-1.amazonaws.com')
+        self.assertIn('/eu-west-1/sts/aws4_request', result['authorization'])
+
+        result = json.loads(_create_conjur_iam_api_key("role", "AKIA", "secret", "token"))
+        self.assertEqual(result['host'], 'sts.amazonaws.com')
+        self.assertIn('/us-east-1/sts/aws4_request', result['authorization'])
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._get_iam_role_metadata')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._get_metadata_token')
+    def test_create_conjur_iam_api_key_is_reused(self, mock_get_metadata_token, mock_get_iam_role_metadata):
+        first = _create_conjur_iam_api_key("role", "AKIA", "secret", "token")
+        self.assertIs(_create_conjur_iam_api_key("role", "AKIA", "secret", "token"), first)
+        self.assertIsNot(_create_conjur_iam_api_key("role", "AKIA", "secret", "other-token"), first)
+        self.assertIsNot(_create_conjur_iam_api_key("role", "AKIA", "secret", "token", sts_region='eu-west-1'), first)
+
+        # Role credentials without a known expiry are never reused past a single request
+        mock_get_metadata_token.return_value = None
+        mock_get_iam_role_metadata.return_value = ("AKIA2", "secret", "token")
+        first = _create_conjur_iam_api_key("role")
+        self.assertIsNot(_create_conjur_iam_api_key("role"), first)
+
     def test_create_canonical_request(self):
         payload_hash = hashlib.sha256(('').encode('utf-8')).hexdigest()
         result = _create_canonical_request(
@@ -389,6 +1579,129 @@ class TestConjurLookup(TestCase):
         )
         self.assertEqual(result, b"conjur-access-token")
 
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_get_azure_identity_token_is_cached(self, mock_open_url):
+        def respond(url, **kwargs):
+            client_id = urllib.parse.parse_qs(urllib.parse.urlparse(url).query).get('client_id', ['default'])[0]
+            mock_response = MagicMock()
+            mock_response.getcode.return_value = 200
+            mock_response.read.return_value = json.dumps({
+                "access_token": f"token-{client_id}", "expires_on": str(int(time() + 3600))
+            }).encode('utf-8')
+            return mock_response
+
+        mock_open_url.side_effect = respond
+        self.assertEqual(_get_azure_identity_token("one"), "token-one")
+        self.assertEqual(_get_azure_identity_token("one"), "token-one")
+        self.assertEqual(_get_azure_identity_token(), "token-default")
+        self.assertEqual(mock_open_url.call_count, 2)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_get_azure_identity_token_retries_throttling(self, mock_open_url):
+        mock_response = MagicMock()
+        mock_response.getcode.return_value = 200
+        mock_response.read.return_value = b'{"access_token": "token"}'
+        mock_open_url.side_effect = [
+            urllib_error.HTTPError(AZURE_METADATA_URL, 429, "Too Many Requests", {}, None),
+            mock_response
+        ]
+
+        request_options = _RequestOptions(retries=2, retry_base_delay=0)
+        self.assertEqual(_get_azure_identity_token(request_options=request_options), "token")
+        self.assertEqual(mock_open_url.call_count, 2)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.open_url')
+    def test_get_gcp_identity_token_is_cached_until_exp(self, mock_open_url):
+        def jwt(exp):
+            payload = urlsafe_b64encode(json.dumps({"exp": exp}).encode()).decode().rstrip("=")
+            return f"e30.{payload}.c2ln".encode()
+
+        mock_response = MagicMock()
+        mock_response.getcode.return_value = 200
+        mock_response.read.return_value = jwt(time() + 3600)
+        mock_open_url.return_value = mock_response
+
+        _get_gcp_identity_token("account", "host/one")
+        _get_gcp_identity_token("account", "host/one")
+        self.assertEqual(mock_open_url.call_count, 1)
+        _get_gcp_identity_token("account", "host/two")
+        self.assertEqual(mock_open_url.call_count, 2)
+
+        mock_response.read.return_value = jwt(time() + 30)
+        _get_gcp_identity_token("account", "host/three")
+        _get_gcp_identity_token("account", "host/three")
+        self.assertEqual(mock_open_url.call_count, 4)
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._probe_gcp')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._probe_azure')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._probe_aws')
+    def test_probe_authn_type(self, mock_probe_aws, mock_probe_azure, mock_probe_gcp):
+        mock_probe_aws.side_effect = urllib_error.URLError(ConnectionRefusedError())
+        mock_probe_azure.side_effect = lambda *args: sleep(0.1) or True
+        mock_probe_gcp.return_value = False
+        self.assertEqual(_probe_authn_type(), 'azure')
+
+        mock_probe_azure.side_effect = urllib_error.HTTPError("url", 404, "Not Found", {}, None)
+        self.assertIsNone(_probe_authn_type())
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._probe_authn_type')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._default_tmp_path')
+    def test_detect_authn_type_is_persisted(self, mock_default_tmp_path, mock_probe_authn_type):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mock_default_tmp_path.return_value = tmp_dir
+            mock_probe_authn_type.return_value = 'gcp'
+            self.assertEqual(_detect_authn_type(), 'gcp')
+            self.assertEqual(_detect_authn_type(), 'gcp')
+
+            _metadata_cache.clear()
+            self.assertEqual(_detect_authn_type(), 'gcp')
+            self.assertEqual(mock_probe_authn_type.call_count, 1)
+
+            for name in os.listdir(_state_dir()):
+                os.unlink(os.path.join(_state_dir(), name))
+            _metadata_cache.clear()
+            mock_probe_authn_type.return_value = None
+            self.assertIsNone(_detect_authn_type())
+            self.assertIsNone(_detect_authn_type())
+            self.assertEqual(mock_probe_authn_type.call_count, 2)
+
+            # A detection which cannot be saved is still returned
+            for name in os.listdir(_state_dir()):
+                os.unlink(os.path.join(_state_dir(), name))
+            _metadata_cache.clear()
+            mock_probe_authn_type.return_value = 'aws'
+            with patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable.os.replace', side_effect=OSError('read-only')):
+                self.assertEqual(_detect_authn_type(), 'aws')
+
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._get_certificate_file')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_variable')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._fetch_conjur_gcp_identity_token')
+    @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._detect_authn_type')
+    def test_run_with_auto_authn_type(self, mock_detect_authn_type, mock_fetch_conjur_gcp_identity_token, mock_fetch_conjur_variable,
+                                      mock_get_certificate_file):
+        mock_get_certificate_file.return_value = "./conjur.pem"
+        mock_detect_authn_type.return_value = 'gcp'
+        mock_fetch_conjur_gcp_identity_token.return_value = b"token"
+        mock_fetch_conjur_variable.return_value = ["conjur_variable"]
+
+        variables = {'conjur_account': 'fakeaccount',
+                     'conjur_appliance_url': 'https://conjur-fake',
+                     'conjur_cert_file': './conjurfake.pem',
+                     'conjur_authn_login': 'host/ansible/ansible-fake',
+                     'conjur_authn_type': 'auto'}
+
+        self.assertEqual(self.lookup.run(['ansible/fake-secret'], variables), ["conjur_variable"])
+        mock_fetch_conjur_gcp_identity_token.assert_called_once()
+
+        # No authenticator is detected for a lookup using a token file
+        mock_detect_authn_type.reset_mock()
+        with tempfile.NamedTemporaryFile() as token_file:
+            token_file.write(b"token")
+            token_file.flush()
+            variables = {**variables, 'conjur_authn_token_file': token_file.name}
+            self.assertEqual(self.lookup.run(['ansible/other-secret'], variables), ["conjur_variable"])
+        mock_detect_authn_type.assert_not_called()
+
     # Negative test cases
 
     @patch('ansible_collections.cyberark.conjur.plugins.lookup.conjur_variable._get_certificate_file')